@@ -1,11 +1,8 @@
 import json
 import base64
+import functools
 from typing import List, Dict, Any, Optional
 from dataclasses import dataclass
-import io
-from PIL import Image
-import PyPDF2
-import fitz  # PyMuPDF for better PDF handling
 
 @dataclass
 class InvoiceProcessingConfig:
@@ -17,7 +14,26 @@ class InvoiceProcessingConfig:
 
 class InvoiceProcessor:
     """Main class for processing invoices and generating prompts"""
-    
+
+    # Identical for every request, so it goes first: models with a prefix
+    # KV cache can reuse it instead of re-encoding it on every call
+    STATIC_PROMPT_PREFIX = """You are an expert invoice data extraction system. Analyze the provided invoice document and extract the fields listed under REQUIRED FIELDS at the end of these instructions.
+
+EXTRACTION GUIDELINES:
+1. Extract information exactly as it appears in the document
+2. For dates, use the format found in the document or convert to YYYY-MM-DD if unclear
+3. For monetary amounts, include currency symbols and preserve decimal places
+4. For line items, extract all available items with their details
+5. If a field is not found, use null or empty string
+6. Be precise and accurate - double-check all extracted values
+
+OUTPUT FORMAT:
+Return the extracted data as a JSON object with an "extracted_fields" object following the JSON STRUCTURE below, plus "confidence_score" (percentage of confidence in extraction accuracy) and "processing_notes" (any relevant notes about the extraction process).
+
+IMPORTANT: Only return the JSON object, no additional text or explanations.
+
+"""
+
     def __init__(self):
         self.common_fields = [
             'vendor_name',
@@ -51,40 +67,41 @@ class InvoiceProcessor:
                                  file_content: str = None,  # type: ignore
                                  file_type: str = "image") -> str:
         """Generate a prompt for invoice field extraction"""
-        
+        prompt = self.compile_prompt(config.fields, config.output_language, config.output_format)
+
+        # Document text is the most variable part, so it goes last
+        if file_content and file_type == "pdf":
+            prompt += f"\n\nDOCUMENT TEXT:\n{file_content}"
+
+        return prompt
+
+    def compile_prompt(self, fields: List[str], output_language: str = "en",
+                       output_format: str = "json") -> str:
+        """Render the prompt for a field selection once and reuse it afterwards"""
+        return self._compile_prompt(tuple(fields), output_language, output_format)
+
+    # Bounded like the notebook's, since callers choose the field tuples
+    @functools.lru_cache(maxsize=256)
+    def _compile_prompt(self, fields: tuple, output_language: str, output_format: str) -> str:
         # Build field list with descriptions
         field_list = []
-        for field in config.fields:
+        for field in fields:
             description = self.field_descriptions.get(field, f"Extract {field} from the invoice")
             field_list.append(f"- {field}: {description}")
-        
-        # Create the main prompt
-        prompt = f"""You are an expert invoice data extraction system. Analyze the provided invoice document and extract the following information:
+
+        prompt = f"""{self.STATIC_PROMPT_PREFIX}LANGUAGE: Extract and return all text in {output_language}
 
 REQUIRED FIELDS:
 {chr(10).join(field_list)}
 
-EXTRACTION GUIDELINES:
-1. Extract information exactly as it appears in the document
-2. For dates, use the format found in the document or convert to YYYY-MM-DD if unclear
-3. For monetary amounts, include currency symbols and preserve decimal places
-4. For line items, extract all available items with their details
-5. If a field is not found, use null or empty string
-6. Be precise and accurate - double-check all extracted values
-
-OUTPUT FORMAT:
-Return the extracted data as a JSON object with the following structure:
+JSON STRUCTURE:
 {{
     "extracted_fields": {{
-        {self._generate_json_structure(config.fields)}
+        {self._generate_json_structure(fields)}
     }},
-    "confidence_score": "percentage of confidence in extraction accuracy",
-    "processing_notes": "any relevant notes about the extraction process"
-}}
-
-LANGUAGE: Extract and return all text in {config.output_language}
-
-IMPORTANT: Only return the JSON object, no additional text or explanations."""
+    "confidence_score": "...",
+    "processing_notes": "..."
+}}"""
 
         return prompt
     
@@ -108,6 +125,10 @@ IMPORTANT: Only return the JSON object, no additional text or explanations."""
     
     def process_pdf_file(self, file_path: str) -> str:
         """Extract text from PDF file"""
+        # Imported here: prompt generation alone shouldn't pay for the PDF libraries
+        import fitz  # PyMuPDF for better PDF handling
+        import PyPDF2
+
         try:
             # Try with PyMuPDF first (better text extraction)
             doc = fitz.open(file_path) # type: ignore
@@ -0,0 +1,258 @@
+"""Admission control for the upload routes: a bounded fair queue and streaming size limits.
+
+Only ``max_active`` requests are processed at once. Others wait in a queue
+of at most ``max_queued`` requests, at most ``max_queued_per_client`` of
+them from any one client, and are admitted round-robin across clients, so
+one client posting a large batch cannot starve everyone else. A request
+that finds the queue full, or waits longer than ``max_wait`` seconds, is
+answered 429 with a ``Retry-After`` estimated from recent request times.
+
+Admission happens before the body is read, so a rejected upload is never
+received. Once admitted, the multipart body is checked as it streams in:
+too many files, a file over ``max_file_bytes`` or a body over
+``max_request_bytes`` stops the upload with 400 / 413 without buffering
+the rest.
+
+Clients are told apart by the ``X-Client-Id`` header, else their address.
+"""
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Iterable, Optional
+
+from .asgi import Refused, call_checked, send_refusal
+from .metrics import REGISTRY
+
+CLIENT_HEADER = "X-Client-Id"
+MAX_HEADER_BYTES = 16 * 1024  # per multipart part
+
+REJECTED = REGISTRY.counter("admission_rejected_total", "Requests turned away before processing", ["reason"])
+WAIT_SECONDS = REGISTRY.histogram("admission_wait_seconds", "Time requests spent queued for admission")
+
+
+class Rejected(Refused):
+    """A request that is not processed; ``status`` and ``detail`` go back to the client"""
+
+    def __init__(self, status: int, reason: str, detail: str, retry_after: Optional[int] = None):
+        headers = [(b"retry-after", str(retry_after).encode())] if retry_after is not None else []
+        super().__init__(status, detail, headers)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class FairQueue:
+    """At most ``max_active`` holders at a time; waiters are admitted round-robin per client"""
+
+    def __init__(self, max_active: int = 4, max_queued: int = 32, max_queued_per_client: int = 8,
+                 max_wait: float = 30.0):
+        self.max_active = max_active
+        self.max_queued = max_queued
+        self.max_queued_per_client = max_queued_per_client
+        self.max_wait = max_wait
+        self.active = 0
+        self.queued = 0
+        self.admitted = 0
+        self._waiting: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+        self._service_seconds = 2.0  # moving average of how long a holder keeps its slot
+        self._rejected: Dict[str, int] = {}
+
+    def retry_after(self) -> int:
+        """Seconds until the queue has likely drained by one full round"""
+        rounds = (self.queued + 1) / self.max_active
+        return max(1, math.ceil(rounds * self._service_seconds))
+
+    def _reject(self, reason: str, detail: str) -> Rejected:
+        self._rejected[reason] = self._rejected.get(reason, 0) + 1
+        REJECTED.inc(reason=reason)
+        return Rejected(429, reason, detail, self.retry_after())
+
+    async def acquire(self, client: str):
+        """Wait for a slot; raises ``Rejected`` when the queue is full or the wait too long"""
+        if self.active < self.max_active and not self.queued:
+            self.active += 1
+            self.admitted += 1
+            return
+        if self.queued >= self.max_queued:
+            raise self._reject("queue_full", "Server is busy, retry later")
+        waiters = self._waiting.setdefault(client, deque())
+        if len(waiters) >= self.max_queued_per_client:
+            raise self._reject("client_queue_full", "Too many queued requests from this client")
+
+        future = asyncio.get_running_loop().create_future()
+        waiters.append(future)
+        self.queued += 1
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(future, self.max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                self.release()  # the slot arrived as we gave up
+            else:
+                self._discard(client, future)
+            if isinstance(e, asyncio.TimeoutError):
+                raise self._reject("timeout", "Timed out waiting in the queue, retry later")
+            raise
+        finally:
+            WAIT_SECONDS.observe(time.perf_counter() - started)
+        self.admitted += 1
+
+    def _discard(self, client: str, future: asyncio.Future):
+        waiters = self._waiting.get(client)
+        if waiters is not None and future in waiters:
+            waiters.remove(future)
+            self.queued -= 1
+            if not waiters:
+                del self._waiting[client]
+
+    def release(self, seconds: Optional[float] = None):
+        """Free a slot, handing it straight to the next client in turn"""
+        if seconds is not None:
+            self._service_seconds = 0.8 * self._service_seconds + 0.2 * seconds
+        while self._waiting:
+            client, waiters = next(iter(self._waiting.items()))
+            future = waiters.popleft()
+            self.queued -= 1
+            if waiters:
+                self._waiting.move_to_end(client)
+            else:
+                del self._waiting[client]
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {"active": self.active, "queued": self.queued, "queuedClients": len(self._waiting),
+                "admitted": self.admitted, "rejected": dict(self._rejected),
+                "maxActive": self.max_active, "maxQueued": self.max_queued,
+                "maxQueuedPerClient": self.max_queued_per_client,
+                "avgRequestSeconds": round(self._service_seconds, 2)}
+
+
+class MultipartLimits:
+    """Counts file parts and their sizes in a multipart body as it is received"""
+
+    def __init__(self, boundary: bytes, max_files: int, max_file_bytes: int, max_request_bytes: int):
+        self.delimiter = b"\r\n--" + boundary
+        self.max_files = max_files
+        self.max_file_bytes = max_file_bytes
+        self.max_request_bytes = max_request_bytes
+        self.files = 0
+        self.received = 0
+        self._tail = b"\r\n"  # the first boundary has no CRLF before it
+        self._headers: Optional[bytes] = None  # part headers while they are being read
+        self._file_bytes: Optional[int] = None  # size so far of the current file part
+
+    def _count(self, n: int):
+        if self._file_bytes is not None:
+            self._file_bytes += n
+            if self._file_bytes > self.max_file_bytes:
+                raise Rejected(413, "file_too_large", f"A file is larger than {self.max_file_bytes} bytes")
+
+    def feed(self, chunk: bytes):
+        self.received += len(chunk)
+        if self.received > self.max_request_bytes:
+            raise Rejected(413, "request_too_large", f"Upload is larger than {self.max_request_bytes} bytes")
+        data, self._tail = self._tail + chunk, b""
+        pos = 0
+        while pos < len(data):
+            if self._headers is not None:
+                start = len(self._headers)
+                self._headers += data[pos:]
+                end = self._headers.find(b"\r\n\r\n")
+                if end < 0:
+                    if len(self._headers) > MAX_HEADER_BYTES:
+                        raise Rejected(400, "bad_multipart", "Multipart part headers are too long")
+                    return
+                pos += end + 4 - start
+                is_file = b"filename=" in self._headers[:end].lower()
+                self._headers = None
+                self._file_bytes = None
+                if is_file:
+                    self.files += 1
+                    if self.files > self.max_files:
+                        raise Rejected(400, "too_many_files", f"At most {self.max_files} files per request")
+                    self._file_bytes = 0
+                continue
+            found = data.find(self.delimiter, pos)
+            if found < 0:
+                # Keep enough to recognise a delimiter split across chunks
+                safe = max(pos, len(data) - len(self.delimiter) + 1)
+                self._count(safe - pos)
+                self._tail = data[safe:]
+                return
+            self._count(found - pos)
+            pos = found + len(self.delimiter)
+            self._headers = b""
+
+
+def _boundary(headers: Dict[bytes, bytes]) -> Optional[bytes]:
+    content_type = headers.get(b"content-type", b"")
+    for param in content_type.split(b";")[1:]:
+        name, _, value = param.strip().partition(b"=")
+        if name.lower() == b"boundary":
+            return value.strip(b'"')
+    return None
+
+
+class AdmissionMiddleware:
+    """ASGI middleware applying ``queue`` and the upload limits to POSTs on ``paths``.
+
+    Requests to ``queued_paths`` hold a ``queue`` slot until their response
+    (streamed or not) has been sent; the other ``paths`` only get the limits.
+    ``request.state.admitted`` is when the request got its slot.
+    """
+
+    def __init__(self, app, queue: FairQueue, paths: Iterable[str], queued_paths: Iterable[str] = (),
+                 max_files: int = 100, max_file_bytes: int = 50 * 1024 * 1024,
+                 max_request_bytes: int = 200 * 1024 * 1024):
+        self.app = app
+        self.queue = queue
+        self.paths = set(paths)
+        self.queued_paths = set(queued_paths)
+        self.max_files = max_files
+        self.max_file_bytes = max_file_bytes
+        self.max_request_bytes = max_request_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        length = headers.get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > self.max_request_bytes:
+            REJECTED.inc(reason="request_too_large")
+            await send_refusal(send, Rejected(413, "request_too_large",
+                                               f"Upload is larger than {self.max_request_bytes} bytes"))
+            return
+
+        queued = scope["path"] in self.queued_paths
+        if queued:
+            client = headers.get(CLIENT_HEADER.lower().encode(), b"").decode() or (scope.get("client") or ("?",))[0]
+            try:
+                await self.queue.acquire(client)
+            except Rejected as e:
+                await send_refusal(send, e)
+                return
+        scope.setdefault("state", {})["admitted"] = time.perf_counter()
+        started = time.perf_counter()
+
+        boundary = _boundary(headers)
+        limits = MultipartLimits(boundary, self.max_files, self.max_file_bytes,
+                                 self.max_request_bytes) if boundary else None
+
+        def check(message):
+            if limits is not None:
+                limits.feed(message.get("body", b""))
+            return message
+
+        try:
+            # A cut-off upload is answered with its Rejected instead of the app's response
+            rejected = await call_checked(self.app, scope, receive, send, check)
+        finally:
+            if queued:
+                self.queue.release(time.perf_counter() - started)
+        if rejected is not None:
+            REJECTED.inc(reason=rejected.reason)
@@ -0,0 +1,65 @@
+"""ASGI helpers for middlewares that check a request body as it streams in.
+
+``AdmissionMiddleware`` (multipart limits) and ``GzipRequestMiddleware``
+(inflated size) look at each body chunk on its way to the app and may refuse
+the request part-way through. ``call_checked`` runs the app with such a
+check: once it raises ``Refused``, the app only sees a broken body, so its
+own error response is dropped and the refusal is sent instead. Standard
+library only, like ``metrics``, so the model servers can use it too.
+"""
+import json
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+Message = Dict[str, Any]
+
+
+class Refused(Exception):
+    """A request answered with ``status`` and ``{"detail": detail}`` rather than by the app"""
+
+    def __init__(self, status: int, detail: str, headers: Iterable[Tuple[bytes, bytes]] = ()):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+        self.headers = list(headers)
+
+
+async def send_refusal(send: Callable[[Message], Awaitable[None]], refused: Refused):
+    body = json.dumps({"detail": refused.detail}).encode()
+    headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    await send({"type": "http.response.start", "status": refused.status, "headers": headers + refused.headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def call_checked(app, scope, receive, send, check: Callable[[Message], Message]) -> Optional[Refused]:
+    """Run ``app`` with ``check`` applied to each ``http.request`` message it receives.
+
+    ``check`` returns the message to pass on, or raises ``Refused``; later
+    messages then go through unchecked. Returns the refusal, already sent,
+    or None if the app answered.
+    """
+    refused: Optional[Refused] = None
+
+    async def checked_receive():
+        nonlocal refused
+        message = await receive()
+        if message["type"] != "http.request" or refused is not None:
+            return message
+        try:
+            return check(message)
+        except Refused as e:
+            refused = e
+            raise
+
+    async def guarded_send(message):
+        # Once the body is refused, the app's own error response is replaced
+        if refused is None:
+            await send(message)
+
+    try:
+        await app(scope, checked_receive, guarded_send)
+    except Exception:
+        if refused is None:
+            raise
+    if refused is not None:
+        await send_refusal(send, refused)
+    return refused
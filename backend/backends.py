@@ -0,0 +1,233 @@
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+import httpx
+
+from .metrics import REGISTRY
+from .model_http import DEADLINES_EXCEEDED, DeadlineExceeded, time_left
+
+HEDGES = REGISTRY.counter("model_hedges_total", "Model calls that got a second, hedged attempt", ["winner"])
+MIN_HEDGE_SAMPLES = 20  # latencies seen before the hedge delay is trusted
+
+
+class BackendUnavailable(Exception):
+    """Raised when every backend is failing or has its circuit open"""
+
+
+class Backend:
+    """One inference endpoint plus the bookkeeping the pool balances on"""
+
+    def __init__(self, url: str, health_path: str = "/health"):
+        self.url = url
+        base = url.rsplit("/", 1)[0] if url.count("/") > 2 else url
+        self.health_url = base + health_path
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.healthy = True
+        self.open_until = 0.0  # circuit is open (no traffic) until this time
+        self.half_open_trial = False
+        self.latencies: "deque[float]" = deque(maxlen=200)
+
+    @property
+    def circuit(self) -> str:
+        if self.open_until == 0.0:
+            return "closed"
+        return "open" if time.monotonic() < self.open_until else "half-open"
+
+    def available(self) -> bool:
+        state = self.circuit
+        if state == "open":
+            return False
+        if state == "half-open":
+            # Let exactly one trial request through after the cooldown
+            return not self.half_open_trial
+        return self.healthy
+
+    def stats(self) -> Dict[str, Any]:
+        latencies = sorted(self.latencies)
+
+        def pct(q: float) -> Optional[float]:
+            return round(latencies[min(int(q * len(latencies)), len(latencies) - 1)], 2) if latencies else None
+
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "circuit": self.circuit,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "consecutiveFailures": self.consecutive_failures,
+            "latencyMs": {"p50": pct(0.5), "p95": pct(0.95), "mean": round(sum(latencies) / len(latencies), 2) if latencies else None},
+        }
+
+
+class BackendPool:
+    """Least-outstanding-requests balancing over several inference backends.
+
+    A backend whose last ``failure_threshold`` calls failed has its circuit
+    opened for ``cooldown`` seconds; after that one trial request decides
+    whether it closes again. Failed calls are retried up to ``max_retries``
+    times with exponential backoff, on a backend not tried yet where possible.
+    No retry starts after the current deadline (``model_http``) has passed.
+    A background task probes every backend's health URL each
+    ``probe_interval`` seconds; any response below 500 counts as healthy.
+
+    ``hedged_call`` cuts tail latency: a call still unanswered after the
+    ``hedge_quantile`` latency of recent calls (but at least ``hedge_min``
+    seconds) gets a second attempt on the least busy other backend, and the
+    first answer wins. At most ``hedge_budget`` of calls are hedged, so a
+    slow pool is not flooded with duplicates.
+    """
+
+    def __init__(self, urls: Sequence[str], failure_threshold: int = 3, cooldown: float = 30.0,
+                 max_retries: int = 2, backoff: float = 0.25, probe_interval: float = 10.0,
+                 health_path: str = "/health", hedge_quantile: float = 0.0, hedge_min: float = 0.1,
+                 hedge_budget: float = 0.05):
+        if not urls:
+            raise ValueError("BackendPool needs at least one URL")
+        self.backends = [Backend(url, health_path) for url in urls]
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.probe_interval = probe_interval
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min = hedge_min
+        self.hedge_budget = hedge_budget
+        self.calls = 0
+        self.hedges = 0
+        self._probe_task: Optional[asyncio.Task] = None
+
+    def pick(self, exclude: Sequence[Backend] = ()) -> Backend:
+        candidates = [b for b in self.backends if b.available() and b not in exclude]
+        if not candidates:
+            candidates = [b for b in self.backends if b.available()]
+        if not candidates:
+            raise BackendUnavailable("No inference backend available: " + ", ".join(
+                f"{b.url} ({b.circuit}, healthy={b.healthy})" for b in self.backends))
+        fewest = min(b.outstanding for b in candidates)
+        return random.choice([b for b in candidates if b.outstanding == fewest])
+
+    async def call(self, send: Callable[[str], Awaitable[httpx.Response]]) -> httpx.Response:
+        """Run ``send(url)`` against the pool, retrying on other backends on failure"""
+        tried: List[Backend] = []
+        for attempt in range(self.max_retries + 1):
+            backend = self.pick(tried)
+            tried.append(backend)
+            if backend.circuit == "half-open":
+                backend.half_open_trial = True
+            backend.outstanding += 1
+            backend.requests += 1
+            started = time.perf_counter()
+            try:
+                response = await send(backend.url)
+                if response.status_code >= 500:
+                    response.raise_for_status()
+            except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                self._failed(backend)
+                if attempt == self.max_retries:
+                    raise
+                error = e
+            else:
+                self._succeeded(backend, 1000 * (time.perf_counter() - started))
+                return response
+            finally:
+                backend.outstanding -= 1
+            delay = self.backoff * 2 ** attempt
+            delay += random.uniform(0, delay)
+            left = time_left()
+            if left is not None and left <= delay:
+                DEADLINES_EXCEEDED.inc()
+                raise DeadlineExceeded(f"Deadline exceeded, not retrying after: {error!r}") from error
+            await asyncio.sleep(delay)
+        raise BackendUnavailable("unreachable")
+
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds to wait before hedging a call; None when hedging is off or not warranted yet"""
+        if self.hedge_quantile <= 0 or self.hedges >= self.hedge_budget * self.calls:
+            return None
+        latencies = sorted(ms for b in self.backends for ms in b.latencies)
+        if len(latencies) < MIN_HEDGE_SAMPLES:
+            return None
+        quantile = latencies[min(int(self.hedge_quantile * len(latencies)), len(latencies) - 1)]
+        return max(quantile / 1000, self.hedge_min)
+
+    async def hedged_call(self, send: Callable[[str], Awaitable[httpx.Response]]) -> httpx.Response:
+        """Like ``call``, with a second attempt if the first is slower than usual; the loser is cancelled"""
+        self.calls += 1
+        delay = self.hedge_delay()
+        if delay is None:
+            return await self.call(send)
+        primary = asyncio.create_task(self.call(send))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        left = time_left()
+        if done or self.hedges >= self.hedge_budget * self.calls or (left is not None and left <= 0):
+            return await primary
+        # The primary's backend has one more outstanding call, so the hedge goes elsewhere if it can
+        self.hedges += 1
+        hedge = asyncio.create_task(self.call(send))
+        pending = {primary, hedge}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        HEDGES.inc(winner="hedge" if task is hedge else "primary")
+                        return task.result()
+            return primary.result()  # both failed: the primary's error
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def _succeeded(self, backend: Backend, ms: float):
+        backend.latencies.append(ms)
+        backend.consecutive_failures = 0
+        backend.open_until = 0.0
+        backend.half_open_trial = False
+        backend.healthy = True
+
+    def _failed(self, backend: Backend):
+        backend.failures += 1
+        backend.consecutive_failures += 1
+        backend.half_open_trial = False
+        if backend.consecutive_failures >= self.failure_threshold:
+            backend.open_until = time.monotonic() + self.cooldown
+
+    # --- Active health checks ---
+    def start(self, client: httpx.AsyncClient):
+        if self._probe_task is None and self.probe_interval > 0:
+            self._probe_task = asyncio.create_task(self._probe_loop(client))
+
+    async def stop(self):
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            await asyncio.gather(self._probe_task, return_exceptions=True)
+            self._probe_task = None
+
+    async def probe(self, client: httpx.AsyncClient):
+        async def check(backend: Backend):
+            try:
+                response = await client.get(backend.health_url, timeout=5)
+                backend.healthy = response.status_code < 500
+            except httpx.HTTPError:
+                backend.healthy = False
+
+        await asyncio.gather(*(check(b) for b in self.backends))
+
+    async def _probe_loop(self, client: httpx.AsyncClient):
+        while True:
+            await self.probe(client)
+            await asyncio.sleep(self.probe_interval)
+
+    def hedge_stats(self) -> Dict[str, Any]:
+        return {"calls": self.calls, "hedged": self.hedges, "quantile": self.hedge_quantile,
+                "delayMs": None if self.hedge_delay() is None else round(1000 * self.hedge_delay(), 1)}
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [b.stats() for b in self.backends]
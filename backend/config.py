@@ -0,0 +1,135 @@
+"""Backend configuration, read from the environment when the app is created.
+
+Each setting is one environment variable; ``Settings.from_env()`` reads
+them all, so nothing is read or built at import time and a test or a
+benchmark can create an app with ``create_app(Settings(...))`` instead of
+patching ``os.environ``. Booleans are ``"1"`` for on; anything else is off.
+"""
+import os
+from dataclasses import dataclass, field, fields
+from typing import List, Mapping, Optional, get_type_hints
+
+
+def env(name: str, default=None):
+    """A setting read from the environment variable ``name``"""
+    return field(default=default, metadata={"env": name})
+
+
+@dataclass(frozen=True)
+class Settings:
+    # --- Model servers ---
+    # The notebook's (or inference.server's) /process; a local server unless set
+    colab_url: str = env("COLAB_URL", "http://127.0.0.1:8001/process")
+    # Comma-separated /process URLs to balance across; defaults to just COLAB_URL
+    inference_urls: Optional[str] = env("INFERENCE_URLS")
+    backend_failure_threshold: int = env("BACKEND_FAILURE_THRESHOLD", 3)  # failures in a row to open the circuit
+    backend_cooldown: float = env("BACKEND_COOLDOWN", 30.0)  # seconds a backend's circuit stays open
+    backend_retries: int = env("BACKEND_RETRIES", 2)
+    health_probe_interval: float = env("HEALTH_PROBE_INTERVAL", 10.0)  # 0 disables active probes
+    max_concurrency: int = env("MAX_CONCURRENCY", 16)  # in-flight model calls across all requests
+    request_concurrency: int = env("REQUEST_CONCURRENCY", 4)  # in-flight model calls per /process request
+    model_timeout: float = env("MODEL_TIMEOUT", 60.0)  # caps a single attempt
+    # Seconds per file for all its model calls - retries, failover, hedges, pages; 0 = none.
+    # Callers may set a tighter one for their request with X-Request-Deadline-Ms.
+    model_deadline: float = env("MODEL_DEADLINE", 120.0)
+    model_http2: bool = env("MODEL_HTTP2", True)  # used when the h2 package is installed
+    model_gzip: bool = env("MODEL_GZIP", False)  # the model servers must run GzipRequestMiddleware
+    hedge_quantile: float = env("HEDGE_QUANTILE", 0.0)  # e.g. 0.95: re-send calls slower than that; 0 = off
+    hedge_min_ms: float = env("HEDGE_MIN_MS", 100.0)  # never hedge sooner than this
+    hedge_budget: float = env("HEDGE_BUDGET", 0.05)  # share of calls that may get a hedge
+    # Optional: copy each upload into a private spool that keeps at most this many
+    # bytes in memory (0 = stream straight from the request's UploadFile)
+    upload_spill_bytes: int = env("UPLOAD_SPILL_BYTES", 0)
+    model_id: str = env("MODEL_ID", "nanonets/Nanonets-OCR-s")  # part of the result cache key
+    result_cache_bytes: int = env("RESULT_CACHE_BYTES", 64 * 1024 * 1024)  # 0 disables the cache
+    result_cache_db: Optional[str] = env("RESULT_CACHE_DB")  # e.g. cache.sqlite3 to keep results across restarts
+    # --- Born-digital PDFs go through text extraction instead of the vision model ---
+    text_routing: bool = env("TEXT_ROUTING", True)
+    text_min_chars: int = env("TEXT_MIN_CHARS", 100)  # per page, to count as born-digital
+    text_llm_url: Optional[str] = env("TEXT_LLM_URL")  # optional chat-completions endpoint for the text path
+    text_llm_model: str = env("TEXT_LLM_MODEL", "gpt-4o-mini")
+    text_llm_api_key: Optional[str] = env("TEXT_LLM_API_KEY")
+    # --- Downscale and re-encode images before they cross the network to the model ---
+    normalize_images: bool = env("NORMALIZE_IMAGES", True)
+    normalize_max_side: int = env("NORMALIZE_MAX_SIDE", 2048)  # longest side in pixels
+    normalize_format: str = env("NORMALIZE_FORMAT", "JPEG")  # JPEG or WEBP
+    normalize_quality: int = env("NORMALIZE_QUALITY", 80)
+    normalize_grayscale: bool = env("NORMALIZE_GRAYSCALE", False)
+    normalize_autocontrast: bool = env("NORMALIZE_AUTOCONTRAST", False)
+    normalize_workers: int = env("NORMALIZE_WORKERS", 2)  # processes
+    # --- Split PDFs / multi-page TIFFs on the vision path into pages sent concurrently ---
+    page_splitting: bool = env("PAGE_SPLITTING", True)
+    page_dpi: int = env("PAGE_DPI", 200)
+    page_concurrency: int = env("PAGE_CONCURRENCY", 4)  # in-flight pages per document
+    max_pages: int = env("MAX_PAGES", 50)  # pages beyond this are not extracted
+    # --- Reuse the result of a near-identical text-layer PDF (renamed, re-saved, re-generated) ---
+    dedupe: bool = env("DEDUPE", True)
+    dedupe_text_distance: int = env("DEDUPE_TEXT_DISTANCE", 3)  # SimHash bits; the numbers must also match
+    # Page-hash bits to reuse a result at for images and scans; 0 = don't hash pages at all,
+    # since invoices from one template hash closer than two scans of the same one
+    dedupe_image_distance: int = env("DEDUPE_IMAGE_DISTANCE", 0)
+    dedupe_report_distance: int = env("DEDUPE_REPORT_DISTANCE", 8)  # closer page hashes are reported as similarTo
+    dedupe_max_entries: int = env("DEDUPE_MAX_ENTRIES", 10000)
+    # --- Learn per-vendor templates for text-layer PDFs and extract repeat layouts without the model ---
+    templates: bool = env("TEMPLATES", True)
+    template_samples: int = env("TEMPLATE_SAMPLES", 3)  # model extractions of a layout before learning it
+    template_max_distance: int = env("TEMPLATE_MAX_DISTANCE", 12)  # layout SimHash bits
+    template_min_confidence: float = env("TEMPLATE_MIN_CONFIDENCE", 1.0)  # share of fields that must check out
+    templates_path: Optional[str] = env("TEMPLATES_PATH")  # e.g. templates.json to keep learned templates
+    # Every extraction is also kept in a queryable SQLite store (empty = off)
+    results_db: Optional[str] = env("RESULTS_DB", "results.sqlite3")
+    # --- First-page preview thumbnails, rendered on a process pool and cached by file hash ---
+    thumbnails: bool = env("THUMBNAILS", True)
+    thumbnail_size: int = env("THUMBNAIL_SIZE", 300)  # fitted into a square of this side
+    thumbnail_format: str = env("THUMBNAIL_FORMAT", "WEBP")  # WEBP or JPEG
+    thumbnail_quality: int = env("THUMBNAIL_QUALITY", 70)
+    thumbnail_cache_bytes: int = env("THUMBNAIL_CACHE_BYTES", 32 * 1024 * 1024)
+    thumbnail_workers: int = env("THUMBNAIL_WORKERS", 2)  # processes
+    thumbnail_max_age: int = env("THUMBNAIL_MAX_AGE", 86400)  # browser cache seconds before revalidating
+    # --- Admission control for the upload routes ---
+    # Defaults to as many requests as MAX_CONCURRENCY keeps busy
+    max_active_requests: Optional[int] = env("MAX_ACTIVE_REQUESTS")
+    max_queued_requests: int = env("MAX_QUEUED_REQUESTS", 32)  # beyond this, 429 right away
+    max_queued_per_client: int = env("MAX_QUEUED_PER_CLIENT", 8)  # clients keyed by X-Client-Id, else address
+    max_queue_wait: float = env("MAX_QUEUE_WAIT", 30.0)  # seconds queued before giving up with 429
+    max_files_per_request: int = env("MAX_FILES_PER_REQUEST", 100)
+    max_file_bytes: int = env("MAX_FILE_BYTES", 50 * 1024 * 1024)
+    max_request_bytes: int = env("MAX_REQUEST_BYTES", 200 * 1024 * 1024)
+    job_workers: int = env("JOB_WORKERS", 4)  # background workers draining /jobs
+    max_queued_job_files: int = env("MAX_QUEUED_JOB_FILES", 1000)  # waiting for a /jobs worker; beyond this, 429
+    # --- Startup ---
+    # Import the document libraries and render the page before (startup) or right after
+    # (background) the server starts listening; off leaves it all to the first request
+    warmup: str = env("WARMUP", "background")
+
+    @classmethod
+    def from_env(cls, environ: Mapping[str, str] = os.environ) -> "Settings":
+        """Settings from ``environ``; unset variables keep their defaults"""
+        types = get_type_hints(cls)
+        values = {}
+        for f in fields(cls):
+            raw = environ.get(f.metadata["env"])
+            if raw is None:
+                continue
+            kind = types[f.name]
+            if kind == bool:
+                values[f.name] = raw == "1"
+            elif kind in (int, float, Optional[int]):
+                values[f.name] = (float if kind == float else int)(raw)
+            else:
+                values[f.name] = (raw or None) if kind == Optional[str] else raw
+        return cls(**values)
+
+    @property
+    def urls(self) -> List[str]:
+        return [u.strip() for u in (self.inference_urls or self.colab_url).split(",") if u.strip()]
+
+    @property
+    def active_requests(self) -> int:
+        if self.max_active_requests is not None:
+            return self.max_active_requests
+        return max(1, self.max_concurrency // self.request_concurrency)
+
+    @property
+    def job_spill_bytes(self) -> int:
+        return self.upload_spill_bytes or 1024 * 1024  # job uploads always outlive the request
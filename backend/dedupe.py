@@ -0,0 +1,270 @@
+"""Near-duplicate detection before inference.
+
+The result cache only catches byte-identical files. Vendors also resend an
+invoice under another name, re-saved or re-generated. For PDFs with a text
+layer a file gets a ``Fingerprint``: a 64-bit SimHash of the normalized text
+and a digest of every number in it. Text fingerprints match when the
+SimHashes are within ``text_distance`` bits and the numbers are identical,
+so a different total never matches; such a file is linked to the earlier
+result and not extracted again.
+
+By default dedupe is text-only: images and scanned PDFs are not
+fingerprinted at all. Their pixels cannot tell apart two invoices from one
+template that differ only in a few digits - those are closer than two scans
+of the same invoice, even on a fine grid - so there is nothing safe to link
+them on. Setting ``image_distance`` turns on per-page perceptual hashes (the
+page trimmed to its inked area, reduced to a 16x16 grid of ink density, one
+bit per cell above or below the median; PDF pages rendered at low DPI) and
+links image matches within that distance, at the risk of handing back
+another invoice's fields. Matches within ``report_distance`` are then
+reported on the freshly extracted result as ``similarTo``.
+
+Lookups go through ``HammingIndex`` (multi-index hashing), so they stay
+fast as the index grows. Matches are only made between files extracted
+with the same prompt.
+"""
+import asyncio
+import hashlib
+import io
+import re
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from .uploads import UploadPayload
+
+IMAGE_BITS = 256
+TEXT_BITS = 64
+
+
+class HammingIndex:
+    """Finds stored hashes within ``max_distance`` bits of a query.
+
+    Each hash is split into ``max_distance + 1`` blocks. Two hashes that
+    differ in at most ``max_distance`` bits agree exactly on at least one
+    block, so only ids sharing a block value are compared bit by bit.
+    """
+
+    def __init__(self, bits: int, max_distance: int):
+        self.bits = bits
+        self.max_distance = max_distance
+        blocks = max_distance + 1
+        edges = [bits * i // blocks for i in range(blocks + 1)]
+        self._blocks = [(lo, (1 << (hi - lo)) - 1) for lo, hi in zip(edges, edges[1:])]
+        self._tables: List[Dict[int, Set[int]]] = [{} for _ in self._blocks]
+        self._hashes: Dict[int, int] = {}
+
+    def _keys(self, value: int):
+        return [(value >> shift) & mask for shift, mask in self._blocks]
+
+    def add(self, item: int, value: int):
+        self._hashes[item] = value
+        for table, key in zip(self._tables, self._keys(value)):
+            table.setdefault(key, set()).add(item)
+
+    def remove(self, item: int):
+        value = self._hashes.pop(item, None)
+        if value is None:
+            return
+        for table, key in zip(self._tables, self._keys(value)):
+            table[key].discard(item)
+            if not table[key]:
+                del table[key]
+
+    def search(self, value: int) -> List[Tuple[int, int]]:
+        """``(item, distance)`` of every match, closest first"""
+        candidates = set()
+        for table, key in zip(self._tables, self._keys(value)):
+            candidates |= table.get(key, set())
+        found = [(item, bin(self._hashes[item] ^ value).count("1")) for item in candidates]
+        return sorted((m for m in found if m[1] <= self.max_distance), key=lambda m: m[1])
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+
+@dataclass(frozen=True)
+class Fingerprint:
+    pages: Tuple[int, ...]  # perceptual hash per page
+    text: Optional[int] = None  # SimHash of the text layer
+    numbers: Optional[str] = None  # digest of the numbers in the text layer
+
+
+# --- Hashing (runs on a worker thread) ---
+def page_hash(image) -> int:
+    """Perceptual hash of one page"""
+    import numpy as np
+    from PIL import Image, ImageOps
+
+    gray = ImageOps.exif_transpose(image).convert("L")
+    gray.thumbnail((1200, 1200))
+    ink = 1.0 - np.asarray(gray, dtype=np.float32) / 255
+    # Rows / columns with real content; scattered scan speckle stays below this
+    rows = np.where(ink.mean(axis=1) > 0.01)[0]
+    cols = np.where(ink.mean(axis=0) > 0.01)[0]
+    if len(rows) and len(cols):
+        ink = ink[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+    cells = np.asarray(Image.fromarray((ink * 255).astype(np.uint8)).resize((16, 16), Image.Resampling.BOX),
+                       dtype=np.float32).flatten()
+    value = 0
+    for bit in cells > np.median(cells):
+        value = (value << 1) | int(bit)
+    return value
+
+
+def _hash64(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), "big")
+
+
+def simhash_features(features: Iterable[str]) -> int:
+    """64-bit SimHash of a bag of string features"""
+    weights = [0] * TEXT_BITS
+    for feature in features:
+        h = _hash64(feature)
+        for bit in range(TEXT_BITS):
+            weights[bit] += 1 if h >> bit & 1 else -1
+    return sum(1 << bit for bit, w in enumerate(weights) if w > 0)
+
+
+def simhash(text: str) -> int:
+    """64-bit SimHash over word trigrams of lower-cased alphanumeric text"""
+    words = re.findall(r"[a-z0-9]+", text.lower())
+    return simhash_features(" ".join(words[i:i + 3]) for i in range(max(len(words) - 2, 1)))
+
+
+def numbers_digest(text: str) -> str:
+    numbers = sorted(n.replace(",", "") for n in re.findall(r"\d[\d,]*(?:\.\d+)?", text))
+    return hashlib.sha256(" ".join(numbers).encode()).hexdigest()
+
+
+def compute_fingerprint(data: bytes, kind: str, max_pages: int = 10, dpi: int = 50,
+                        min_text_chars: int = 100) -> Optional[Fingerprint]:
+    from PIL import Image
+
+    try:
+        if kind == "pdf":
+            import fitz  # PyMuPDF
+
+            hashes, text = [], []
+            with fitz.open(stream=data, filetype="pdf") as doc:
+                for page in doc:
+                    text.append(page.get_text())
+                    if page.number < max_pages:
+                        pixmap = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+                        hashes.append(page_hash(Image.frombytes("L", (pixmap.width, pixmap.height), pixmap.samples)))
+            joined = "\n".join(text)
+            has_text = len("".join(joined.split())) >= min_text_chars
+            return Fingerprint(tuple(hashes), simhash(joined) if has_text else None,
+                               numbers_digest(joined) if has_text else None)
+        with Image.open(io.BytesIO(data)) as image:
+            image.draft("L", (1200, 1200))
+            return Fingerprint((page_hash(image),))
+    except Exception:
+        return None
+
+
+# --- Index ---
+class DuplicateDetector:
+    """Links files to an earlier result for a near-identical file.
+
+    Keeps the last ``max_entries`` results in memory, indexed per prompt.
+    """
+
+    def __init__(self, text_distance: int = 3, image_distance: int = 0, report_distance: int = 8,
+                 max_entries: int = 10000, max_pages: int = 10, dpi: int = 50):
+        self.text_distance = text_distance
+        self.image_distance = image_distance
+        self.report_distance = max(report_distance, image_distance)
+        self.max_entries = max_entries
+        self.max_pages = max_pages
+        self.dpi = dpi
+        # Page hashes can only ever link when image_distance is set; otherwise don't pay for them
+        self.hash_pages = image_distance > 0
+        self._entries: "OrderedDict[int, Tuple[str, Fingerprint, Dict[str, Any]]]" = OrderedDict()
+        self._indexes: Dict[str, Tuple[HammingIndex, HammingIndex]] = {}
+        self._next_id = 0
+        self.counts = {"checked": 0, "textMatches": 0, "imageMatches": 0, "imageSimilar": 0, "unhashable": 0}
+
+    @staticmethod
+    def _kind(payload: UploadPayload) -> Optional[str]:
+        name = payload.filename.lower()
+        if name.endswith(".pdf") or payload.content_type == "application/pdf":
+            return "pdf"
+        if payload.content_type.startswith("image/") or name.endswith((".png", ".jpg", ".jpeg", ".webp", ".tif", ".tiff", ".bmp")):
+            return "image"
+        return None
+
+    async def fingerprint(self, payload: UploadPayload) -> Optional[Fingerprint]:
+        kind = self._kind(payload)
+        if kind is None or (kind == "image" and not self.hash_pages):
+            return None
+        data = await payload.read()
+        fingerprint = await asyncio.to_thread(compute_fingerprint, data, kind,
+                                              self.max_pages if self.hash_pages else 0, self.dpi)
+        if fingerprint is None:
+            self.counts["unhashable"] += 1
+        elif not fingerprint.pages and fingerprint.text is None:
+            return None  # a scanned PDF with page hashing off
+        return fingerprint
+
+    def _index(self, prompt: str) -> Tuple[HammingIndex, HammingIndex]:
+        if prompt not in self._indexes:
+            self._indexes[prompt] = (HammingIndex(IMAGE_BITS, self.report_distance),
+                                     HammingIndex(TEXT_BITS, self.text_distance))
+        return self._indexes[prompt]
+
+    @staticmethod
+    def _page_distance(a: Fingerprint, b: Fingerprint) -> Optional[int]:
+        """Largest distance between corresponding pages, or None if the page counts differ"""
+        if len(a.pages) != len(b.pages) or not a.pages:
+            return None
+        return max(bin(x ^ y).count("1") for x, y in zip(a.pages, b.pages))
+
+    def find(self, fingerprint: Fingerprint, prompt: str) -> Optional[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        """``(earlier result, match info)`` for the closest near-duplicate, if any.
+
+        ``match info["linked"]`` says whether the earlier result may be used
+        instead of extracting; unlinked matches are only worth reporting.
+        """
+        self.counts["checked"] += 1
+        images, texts = self._index(prompt)
+        if fingerprint.text is not None:
+            for item, distance in texts.search(fingerprint.text):
+                _, other, result = self._entries[item]
+                if other.numbers == fingerprint.numbers:
+                    self.counts["textMatches"] += 1
+                    return result, {"fileName": result.get("fileName"), "match": "text", "distance": distance,
+                                    "linked": True}
+        if fingerprint.pages:
+            for item, _ in images.search(fingerprint.pages[0]):
+                _, other, result = self._entries[item]
+                distance = self._page_distance(fingerprint, other)
+                # A text layer on both sides that disagrees outranks the pixels
+                if distance is None or distance > self.report_distance or (
+                        fingerprint.numbers and other.numbers and fingerprint.numbers != other.numbers):
+                    continue
+                linked = self.image_distance > 0 and distance <= self.image_distance
+                self.counts["imageMatches" if linked else "imageSimilar"] += 1
+                return result, {"fileName": result.get("fileName"), "match": "image", "distance": distance,
+                                "linked": linked}
+        return None
+
+    def add(self, fingerprint: Fingerprint, prompt: str, result: Dict[str, Any]):
+        item = self._next_id
+        self._next_id += 1
+        images, texts = self._index(prompt)
+        stored = {k: v for k, v in result.items() if k not in ("timing", "cached", "duplicateOf", "similarTo")}
+        self._entries[item] = (prompt, fingerprint, stored)
+        if fingerprint.pages:
+            images.add(item, fingerprint.pages[0])
+        if fingerprint.text is not None:
+            texts.add(item, fingerprint.text)
+        while len(self._entries) > self.max_entries:
+            old, (old_prompt, _, _) = self._entries.popitem(last=False)
+            for index in self._indexes[old_prompt]:
+                index.remove(old)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counts, "entries": len(self._entries), "textDistance": self.text_distance,
+                "imageDistance": self.image_distance, "reportDistance": self.report_distance,
+                "pageHashing": self.hash_pages}
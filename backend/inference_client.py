@@ -0,0 +1,357 @@
+import asyncio
+import json
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple, Union
+
+import httpx
+
+from .backends import BackendPool
+from .cache import ResultCache, cache_key
+from .dedupe import DuplicateDetector, Fingerprint
+from .metrics import REGISTRY, REQUEST_ID_HEADER, Timeline, current_timeline, span, timeline_scope
+from .model_http import (DeadlineExceeded, call_timeout, check_deadline, compressible, deadline_headers,
+                         deadline_scope, gzip_chunks, gzip_headers, http2_available, make_client)
+from .normalize import ImageNormalizer
+from .pages import PagePipeline
+from .results import ResultStore
+from .routing import DocumentRouter
+from .streaming import iter_sse
+from .templates import Layout, TemplateLearner
+from .uploads import UploadPayload, multipart_body
+
+MODEL_BYTES = REGISTRY.counter("model_bytes_total", "Bytes sent to and received from the model servers", ["direction"])
+
+
+class InferenceClient:
+    """Shared async client for the Colab /process endpoint(s).
+
+    One instance lives for the whole app so every request reuses the same
+    keep-alive connection pool (HTTP/2 when ``h2`` is installed). ``urls``
+    may be a single endpoint or a ``BackendPool`` spreading calls over
+    several of them; one-shot calls are hedged when the pool is set up for
+    it. The global semaphore caps how many calls are in flight across all
+    clients; callers can pass a tighter per-request cap. Each file has
+    ``deadline`` seconds, or less if the caller set a tighter deadline, for
+    all of its model calls; ``timeout`` caps any single attempt. With
+    ``gzip``, bodies that are not already compressed are sent gzipped.
+    With a ``cache``, files already extracted with the same prompt and model
+    are answered locally without calling the endpoint. With a ``router``,
+    PDFs that carry a usable text layer skip the vision model. With a
+    ``normalizer``, images are downscaled and re-encoded before they are
+    sent; the cache key is still the original file. With ``pages``, PDFs
+    and multi-frame TIFFs on the vision path are split into pages that are
+    extracted concurrently and merged. With ``dedupe``, a near-identical copy
+    of a text-layer PDF already extracted gets the earlier result, marked
+    ``duplicateOf``. With ``templates``, PDFs from a vendor whose
+    layout has been learned are extracted from their text layer without the
+    model. With ``results``, every new extraction is also written to the
+    queryable results store. ``stream`` relays the model's tokens as they
+    are generated.
+    """
+
+    def __init__(self, urls: Union[str, Sequence[str], BackendPool], max_concurrency: int = 16,
+                 timeout: float = 60.0, cache: Optional[ResultCache] = None,
+                 model_id: str = "nanonets/Nanonets-OCR-s", router: Optional[DocumentRouter] = None,
+                 normalizer: Optional[ImageNormalizer] = None, pages: Optional[PagePipeline] = None,
+                 dedupe: Optional[DuplicateDetector] = None, results: Optional[ResultStore] = None,
+                 templates: Optional[TemplateLearner] = None, deadline: Optional[float] = None,
+                 http2: bool = True, gzip: bool = False):
+        if isinstance(urls, BackendPool):
+            self.backends = urls
+        else:
+            self.backends = BackendPool([urls] if isinstance(urls, str) else list(urls))
+        self.max_concurrency = max_concurrency
+        self.cache = cache
+        self.model_id = model_id
+        self.router = router
+        self.normalizer = normalizer
+        self.pages = pages
+        self.dedupe = dedupe
+        self.results = results
+        self.templates = templates
+        self.timeout = timeout
+        self.deadline = deadline
+        self.gzip = gzip
+        self.http2 = http2 and http2_available()
+        self._global_limit = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+        self._client = make_client(max_concurrency, timeout, self.http2)
+
+    async def _lookup(self, payload: UploadPayload, prompt: str) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        if self.cache is None:
+            return None, None
+        key = cache_key(await payload.sha256(), prompt, self.model_id)
+        cached = await self.cache.get(key)
+        if cached is not None:
+            cached = {**cached, "fileName": payload.filename, "cached": True}
+        return key, cached
+
+    async def _find_duplicate(self, payload: UploadPayload, prompt: str
+                              ) -> Tuple[Optional[Fingerprint], Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """``(fingerprint, earlier result to reuse, near match to report)``"""
+        if self.dedupe is None:
+            return None, None, None
+        with span("dedupe"):
+            fingerprint = await self.dedupe.fingerprint(payload)
+            match = self.dedupe.find(fingerprint, prompt) if fingerprint is not None else None
+        if match is None:
+            return fingerprint, None, None
+        earlier, info = match
+        if info.pop("linked"):
+            return fingerprint, {**earlier, "fileName": payload.filename, "duplicateOf": info}, None
+        return fingerprint, None, info
+
+    def _remember(self, fingerprint: Optional[Fingerprint], prompt: str, result: Dict[str, Any],
+                  similar: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        if fingerprint is not None and "error" not in result:
+            self.dedupe.add(fingerprint, prompt, result)
+        return result if similar is None else {**result, "similarTo": similar}
+
+    async def _from_template(self, payload: UploadPayload, prompt: str, fields: Optional[List[str]]
+                             ) -> Tuple[Optional[Layout], Optional[Dict[str, Any]]]:
+        """``(layout to learn from, template result)``; no layout when templates don't apply"""
+        if self.templates is None or not fields or not self.templates.applies_to(payload):
+            return None, None
+        with span("template"):
+            layout = await self.templates.read(payload)
+            result = self.templates.extract(layout, payload, prompt, fields) if layout is not None else None
+        return layout, result
+
+    async def _learn_template(self, layout: Optional[Layout], result: Dict[str, Any], started: float):
+        # Documents the text rules already handle need no template
+        raw = result.get("rawResponse")
+        if layout is not None and not (isinstance(raw, dict) and raw.get("source") == "text-rules"):
+            await self.templates.learn(layout, result, 1000 * (time.perf_counter() - started))
+
+    async def _record(self, payload: UploadPayload, result: Dict[str, Any]):
+        if self.results is not None:
+            with span("results"):
+                await asyncio.to_thread(self.results.add, await payload.sha256(), result)
+
+    def _routes(self, payload: UploadPayload, fields: Optional[List[str]]) -> bool:
+        return self.router is not None and fields is not None and self.router.applies_to(payload)
+
+    async def _normalized(self, payload: UploadPayload) -> UploadPayload:
+        return payload if self.normalizer is None else await self.normalizer.normalize(payload)
+
+    def _paged(self, payload: UploadPayload) -> bool:
+        return self.pages is not None and self.pages.applies_to(payload)
+
+    async def _to_model(self, payload: UploadPayload, prompt: str,
+                        fields: Optional[List[str]] = None) -> Dict[str, Any]:
+        if self._paged(payload):
+            result = await self.pages.process(payload, prompt, lambda p: self._to_model(p, prompt, fields))
+            if result is not None:
+                return result
+        return await self._send(await self._normalized(payload), prompt, fields)
+
+    async def process(self, payload: UploadPayload, prompt: str,
+                      fields: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Extract one file and return its JSON result"""
+        with span("cache"):
+            key, cached = await self._lookup(payload, prompt)
+        if cached is not None:
+            return cached
+
+        fingerprint, result, similar = await self._find_duplicate(payload, prompt)
+        if result is None:
+            layout, result = await self._from_template(payload, prompt, fields)
+            if result is None:
+                started = time.perf_counter()
+                if self._routes(payload, fields):
+                    result = await self.router.route(payload, prompt, fields, self._client,
+                                                     lambda p: self._to_model(p, prompt, fields))
+                else:
+                    result = await self._to_model(payload, prompt, fields)
+                await self._learn_template(layout, result, started)
+            result = self._remember(fingerprint, prompt, result, similar)
+            await self._record(payload, result)
+
+        if key is not None:
+            with span("cache_put"):
+                await self.cache.put(key, result)
+        return result
+
+    async def stream(self, payload: UploadPayload, prompt: str,
+                     fields: Optional[List[str]] = None) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """Like ``process`` but yields ``("token", {"text": ...})`` events while the
+        model generates, then ``("result", result)``.
+
+        Cached, duplicate, template, text-routed and multi-page files produce
+        their result without any tokens.
+        """
+        with span("cache"):
+            key, cached = await self._lookup(payload, prompt)
+        if cached is not None:
+            yield "result", cached
+            return
+
+        fingerprint, result, similar = await self._find_duplicate(payload, prompt)
+        if result is None:
+            layout, result = await self._from_template(payload, prompt, fields)
+            if result is None:
+                started = time.perf_counter()
+                if self._routes(payload, fields):
+                    result = await self.router.route(payload, prompt, fields, self._client,
+                                                     lambda p: self._to_model(p, prompt, fields))
+                elif self._paged(payload):
+                    result = await self._to_model(payload, prompt, fields)
+                else:
+                    async for event, data in self._send_stream(await self._normalized(payload), prompt, fields):
+                        if event == "result":
+                            result = data
+                        else:
+                            yield event, data
+                    if result is None:
+                        raise httpx.RemoteProtocolError("Model stream ended without a result")
+                await self._learn_template(layout, result, started)
+            result = self._remember(fingerprint, prompt, result, similar)
+            await self._record(payload, result)
+
+        if key is not None:
+            with span("cache_put"):
+                await self.cache.put(key, result)
+        yield "result", result
+
+    @staticmethod
+    def _form(prompt: str, fields: Optional[List[str]]) -> Dict[str, str]:
+        # The field list lets the model server constrain its output to that JSON schema
+        return {"prompt": prompt} if fields is None else {"prompt": prompt, "fields": json.dumps(fields)}
+
+    def _request(self, payload: UploadPayload, prompt: str,
+                 fields: Optional[List[str]]) -> Tuple[AsyncIterator[bytes], Dict[str, str]]:
+        """Body and headers for one attempt; rebuilt per attempt so a retry re-reads the payload"""
+        body, headers = multipart_body(payload, self._form(prompt, fields))
+        if self.gzip and compressible(payload.content_type):
+            body, headers = gzip_chunks(body), gzip_headers(headers)
+        timeline = current_timeline.get()
+        if timeline is not None:
+            headers[REQUEST_ID_HEADER] = timeline.request_id
+        return _counted(body), deadline_headers(headers)
+
+    @staticmethod
+    def _merge_remote(result: Dict[str, Any]) -> Dict[str, Any]:
+        """Fold the model server's own stage timings into the current timeline"""
+        remote = result.pop("timing", None)
+        timeline = current_timeline.get()
+        if timeline is not None and isinstance(remote, dict):
+            timeline.merge(remote.get("stages", {}))
+        return result
+
+    async def _send(self, payload: UploadPayload, prompt: str,
+                    fields: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Stream one file to the least busy vision model backend"""
+        async def send(url: str) -> httpx.Response:
+            timeout = call_timeout(self.timeout)
+            body, headers = self._request(payload, prompt, fields)
+            return await self._client.post(url, content=body, headers=headers, timeout=timeout)
+
+        async with self._global_limit:
+            self.in_flight += 1
+            try:
+                with span("model_call"):
+                    response = await self.backends.hedged_call(send)
+            finally:
+                self.in_flight -= 1
+        MODEL_BYTES.inc(len(response.content), direction="received")
+        response.raise_for_status()
+        return self._merge_remote(response.json())
+
+    async def _send_stream(self, payload: UploadPayload, prompt: str,
+                           fields: Optional[List[str]] = None) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """Relay ``/process/stream`` events from the least busy backend.
+
+        Failover only happens before the first byte: once tokens have been
+        passed on, a broken stream is an error for that file.
+        """
+        async def send(url: str) -> httpx.Response:
+            timeout = call_timeout(self.timeout)
+            body, headers = self._request(payload, prompt, fields)
+            request = self._client.build_request("POST", url.rstrip("/") + "/stream", content=body,
+                                                 headers=headers, timeout=timeout)
+            response = await self._client.send(request, stream=True)
+            if response.status_code >= 500:
+                await response.aclose()
+            return response
+
+        async with self._global_limit:
+            self.in_flight += 1
+            try:
+                with span("model_call"):
+                    response = await self.backends.call(send)
+                    if response.status_code != 404:
+                        try:
+                            response.raise_for_status()
+                            async for event, data in iter_sse(response.aiter_lines()):
+                                check_deadline()
+                                if event == "error":
+                                    # The model server gave up after the response had started
+                                    raise DeadlineExceeded(data.get("detail", "Model server gave up"))
+                                if event == "result":
+                                    data = self._merge_remote(data)
+                                yield event, data
+                        finally:
+                            MODEL_BYTES.inc(response.num_bytes_downloaded, direction="received")
+                            await response.aclose()
+                        return
+                await response.aclose()
+            finally:
+                self.in_flight -= 1
+
+        # Model server without a streaming route: fall back to one-shot
+        yield "result", await self._send(payload, prompt, fields)
+
+    async def try_process(self, payload: UploadPayload, prompt: str,
+                          fields: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Like ``process`` but folds any failure into an error result for that file.
+
+        The result carries a ``timing`` block: the request id and the time
+        spent in each stage, including the model server's own stages.
+        """
+        timeline = Timeline(parent=current_timeline.get())
+        with timeline_scope(timeline), deadline_scope(self.deadline):
+            try:
+                result = await self.process(payload, prompt, fields)
+            except Exception as e:
+                result = {
+                    "fileName": payload.filename,
+                    "error": str(e),
+                    "promptUsed": prompt
+                }
+        return {**result, "timing": timeline.to_dict()}
+
+    async def process_many(self, payloads: Sequence[UploadPayload], prompt: str,
+                           max_concurrency: Optional[int] = None,
+                           fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Send files concurrently; results come back in the same order as ``payloads``"""
+        local_limit = asyncio.Semaphore(max_concurrency or len(payloads) or 1)
+
+        async def run(payload: UploadPayload) -> Dict[str, Any]:
+            async with local_limit:
+                return await self.try_process(payload, prompt, fields)
+
+        return await asyncio.gather(*(run(p) for p in payloads))
+
+    def http_stats(self) -> Dict[str, Any]:
+        return {"http2": self.http2, "gzip": self.gzip, "deadlineSeconds": self.deadline,
+                "attemptTimeoutSeconds": self.timeout, "hedging": self.backends.hedge_stats()}
+
+    def start(self):
+        self.backends.start(self._client)
+
+    async def aclose(self):
+        await self.backends.stop()
+        await self._client.aclose()
+        if self.normalizer is not None:
+            self.normalizer.close()
+        if self.cache is not None:
+            self.cache.close()
+        if self.results is not None:
+            self.results.close()
+
+
+async def _counted(body: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    # Counted as sent, so a gzipped body counts its compressed size
+    async for chunk in body:
+        MODEL_BYTES.inc(len(chunk), direction="sent")
+        yield chunk
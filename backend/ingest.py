@@ -0,0 +1,332 @@
+"""Bulk ingest: extract every invoice under directories and ZIP/TAR archives.
+
+Runs the same processing core as the ``/process`` route (``build_inference``:
+routing, normalization, page splitting, result cache, backend pool), but
+from the command line and without one giant multipart upload::
+
+    python -m backend.ingest invoices/2024-06 june.zip scans.tar.gz \\
+        --fields vendor_name,invoice_number,invoice_date,total_amount \\
+        --out june.jsonl --workers 8
+
+Sources are walked lazily: a file is only read when a worker is about to
+take it, and at most ``2 * workers`` are held in memory. Files larger than
+``--max-file-bytes`` (the server's ``MAX_FILE_BYTES`` by default) are never
+read; they are written with an error, by the size the directory or archive
+records for them. Results are written
+as each file finishes, to JSONL (the full result per line), CSV (one column
+per field) or Parquet (a directory of part files, needs pyarrow). Every
+written file is recorded in the checkpoint (``<out>.checkpoint`` by
+default); rerunning the same command skips those and carries on. Files that
+fail are written with their error but not checkpointed, so a rerun retries
+them - when reading the output, the last row per ``source`` wins.
+
+Configuration (model URLs, cache, routing, ...) comes from the same
+environment variables as the server.
+"""
+import argparse
+import asyncio
+import csv
+import io
+import json
+import mimetypes
+import os
+import sys
+import tarfile
+import time
+import zipfile
+from abc import ABC, abstractmethod
+from functools import partial
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from .uploads import UploadPayload
+
+EXTENSIONS = (".pdf", ".png", ".jpg", ".jpeg", ".tif", ".tiff", ".webp", ".bmp")
+ARCHIVES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+
+
+def _wanted(name: str) -> bool:
+    base = os.path.basename(name)
+    return name.lower().endswith(EXTENSIONS) and not base.startswith(".") and "__MACOSX" not in name
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def iter_source(path: str) -> Iterator[Tuple[str, str, int, Callable[[], bytes]]]:
+    """Yield ``(source key, file name, size, read)`` for every invoice in a directory, archive or file.
+
+    The key identifies the file across runs: its path, or ``archive!member``.
+    ``size`` is the uncompressed size recorded for it; reading a ZIP or TAR
+    member never returns more. ``read`` must be called before the iterator
+    is advanced (TAR members are only readable while the stream is
+    positioned on them).
+    """
+    lower = path.lower()
+    if os.path.isdir(path):
+        for directory, subdirs, files in os.walk(path):
+            subdirs.sort()
+            for name in sorted(files):
+                full = os.path.join(directory, name)
+                if full.lower().endswith(ARCHIVES):
+                    yield from iter_source(full)
+                elif _wanted(full):
+                    yield full, name, os.path.getsize(full), partial(_read_file, full)
+    elif lower.endswith(".zip"):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and _wanted(info.filename):
+                    yield (f"{path}!{info.filename}", os.path.basename(info.filename), info.file_size,
+                           partial(archive.read, info))
+    elif lower.endswith(ARCHIVES):
+        # Stream mode reads members in order without seeking, so compressed tars stay lazy too
+        with tarfile.open(path, "r|*") as archive:
+            for member in archive:
+                if member.isfile() and _wanted(member.name):
+                    yield (f"{path}!{member.name}", os.path.basename(member.name), member.size,
+                           archive.extractfile(member).read)
+    elif _wanted(path):
+        yield path, os.path.basename(path), os.path.getsize(path), partial(_read_file, path)
+
+
+def iter_sources(paths: List[str], done: Set[str], counts: Dict[str, int],
+                 max_bytes: Optional[int] = None) -> Iterator[Tuple[str, str, Optional[bytes]]]:
+    """``(key, name, bytes)`` of every file not in ``done``; finished files are never read.
+
+    Files over ``max_bytes`` are not read either: they come with None
+    instead of their bytes.
+    """
+    for path in paths:
+        for key, name, size, read in iter_source(path):
+            if key in done:
+                counts["skipped"] += 1
+            elif max_bytes is not None and size > max_bytes:
+                yield key, name, None
+            else:
+                yield key, name, read()
+
+
+# --- Output ---
+def flatten(source: str, result: Dict[str, Any], fields: List[str]) -> Dict[str, Any]:
+    """One flat row per file: source, file name, error, time, then one column per field"""
+    extracted = result.get("extractedFields")
+    row = {
+        "source": source,
+        "fileName": result.get("fileName"),
+        "error": result.get("error"),
+        "ms": result.get("ms"),
+        "cached": bool(result.get("cached")),
+    }
+    for field in fields:
+        value = extracted.get(field) if isinstance(extracted, dict) else None
+        row[field] = json.dumps(value) if isinstance(value, (list, dict)) else value
+    if extracted is not None and not isinstance(extracted, dict):
+        row["raw"] = str(extracted)
+    return row
+
+
+class ResultWriter(ABC):
+    """Appends results as they finish; ``write`` returns the sources now safely on disk"""
+
+    def __init__(self, path: str, fields: List[str]):
+        self.path = path
+        self.fields = fields
+
+    @abstractmethod
+    def write(self, source: str, result: Dict[str, Any]) -> List[str]:
+        ...
+
+    @abstractmethod
+    def close(self) -> List[str]:
+        """Flush what is buffered; returns the sources that made it to disk"""
+
+
+class JsonlWriter(ResultWriter):
+    def __init__(self, path: str, fields: List[str]):
+        super().__init__(path, fields)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def write(self, source: str, result: Dict[str, Any]) -> List[str]:
+        self._file.write(json.dumps({"source": source, **result}) + "\n")
+        self._file.flush()
+        return [source]
+
+    def close(self) -> List[str]:
+        self._file.close()
+        return []
+
+
+class CsvWriter(ResultWriter):
+    def __init__(self, path: str, fields: List[str]):
+        super().__init__(path, fields)
+        resuming = os.path.exists(path) and os.path.getsize(path) > 0
+        self._file = open(path, "a", newline="", encoding="utf-8")
+        self._csv = csv.DictWriter(self._file, ["source", "fileName", "error", "ms", "cached"] + fields + ["raw"])
+        if not resuming:
+            self._csv.writeheader()
+
+    def write(self, source: str, result: Dict[str, Any]) -> List[str]:
+        self._csv.writerow(flatten(source, result, self.fields))
+        self._file.flush()
+        return [source]
+
+    def close(self) -> List[str]:
+        self._file.close()
+        return []
+
+
+class ParquetWriter(ResultWriter):
+    """Buffers ``rows_per_part`` rows, then writes them as a new part file in the ``path`` directory"""
+
+    def __init__(self, path: str, fields: List[str], rows_per_part: int = 500):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise SystemExit("Parquet output needs pyarrow: pip install pyarrow")
+        super().__init__(path, fields)
+        self.rows_per_part = rows_per_part
+        os.makedirs(path, exist_ok=True)
+        self._run = time.strftime("%Y%m%d-%H%M%S")
+        self._parts = 0
+        self._rows: List[Dict[str, Any]] = []
+
+    def write(self, source: str, result: Dict[str, Any]) -> List[str]:
+        self._rows.append(flatten(source, result, self.fields))
+        return self._flush() if len(self._rows) >= self.rows_per_part else []
+
+    def _flush(self) -> List[str]:
+        if not self._rows:
+            return []
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        columns = ["source", "fileName", "error", "ms", "cached"] + self.fields + ["raw"]
+        table = pa.table({c: [r.get(c) for r in self._rows] for c in columns})
+        name = os.path.join(self.path, f"part-{self._run}-{self._parts:05d}.parquet")
+        pq.write_table(table, name + ".tmp")
+        os.replace(name + ".tmp", name)  # readers never see half a part
+        self._parts += 1
+        written, self._rows = [r["source"] for r in self._rows], []
+        return written
+
+    def close(self) -> List[str]:
+        return self._flush()
+
+
+WRITERS = {"jsonl": JsonlWriter, "csv": CsvWriter, "parquet": ParquetWriter}
+
+
+class Checkpoint:
+    """Append-only list of finished sources, one per line"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done: Set[str] = set()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.done = {line.rstrip("\n") for line in f if line.strip()}
+        self._file = open(path, "a", encoding="utf-8")
+
+    def add(self, sources: List[str]):
+        if sources:
+            self._file.write("".join(s + "\n" for s in sources))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.done.update(sources)
+
+    def close(self):
+        self._file.close()
+
+
+# --- Run ---
+async def ingest(paths: List[str], fields: List[str], writer: ResultWriter, checkpoint: Checkpoint,
+                 workers: int = 8, progress_every: float = 5.0, max_file_bytes: Optional[int] = None) -> Dict[str, Any]:
+    from .config import Settings
+    from .main import build_inference, build_prompt
+
+    settings = Settings.from_env()
+    max_file_bytes = max_file_bytes if max_file_bytes is not None else settings.max_file_bytes
+    client = build_inference(settings)
+    client.start()
+    prompt = build_prompt(fields)
+    counts = {"processed": 0, "failed": 0, "skipped": 0}
+    sources = iter_sources(paths, set(checkpoint.done), counts, max_file_bytes)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=2 * workers)
+    failed: Set[str] = set()  # written with their error, but retried by the next run
+    started = last_report = time.perf_counter()
+
+    async def produce():
+        # Archive members are read on a worker thread, one at a time, as the queue drains
+        while True:
+            item = await asyncio.to_thread(next, sources, None)
+            if item is None:
+                break
+            await queue.put(item)
+        for _ in range(workers):
+            await queue.put(None)
+
+    async def work():
+        nonlocal last_report
+        while (item := await queue.get()) is not None:
+            key, name, data = item
+            file_started = time.perf_counter()
+            if data is None:
+                result = {"fileName": name, "error": f"File is larger than {max_file_bytes} bytes",
+                          "promptUsed": prompt}
+            else:
+                payload = UploadPayload(name, io.BytesIO(data), len(data),
+                                        mimetypes.guess_type(name)[0] or "application/octet-stream")
+                result = await client.try_process(payload, prompt, fields)
+            result["ms"] = round(1000 * (time.perf_counter() - file_started), 1)
+            if "error" in result:
+                failed.add(key)
+            counts["failed" if "error" in result else "processed"] += 1
+            checkpoint.add([s for s in writer.write(key, result) if s not in failed])
+            if time.perf_counter() - last_report >= progress_every:
+                last_report = time.perf_counter()
+                rate = (counts["processed"] + counts["failed"]) / (last_report - started)
+                print(f"{counts['processed']} done, {counts['failed']} failed, "
+                      f"{counts['skipped']} skipped, {rate:.1f} files/s", file=sys.stderr)
+
+    try:
+        await asyncio.gather(produce(), *(work() for _ in range(workers)))
+    finally:
+        checkpoint.add([s for s in writer.close() if s not in failed])
+        await client.aclose()
+    seconds = time.perf_counter() - started
+    return {**counts, "seconds": round(seconds, 1),
+            "filesPerSec": round((counts["processed"] + counts["failed"]) / seconds, 2) if seconds else None}
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("sources", nargs="+", help="directories, ZIP/TAR archives or single files")
+    parser.add_argument("--fields", required=True, help="comma-separated field names, as in the UI")
+    parser.add_argument("--out", required=True, help="output file (jsonl/csv) or directory (parquet)")
+    parser.add_argument("--format", choices=sorted(WRITERS), help="defaults to the --out extension, else jsonl")
+    parser.add_argument("--checkpoint", help="defaults to <out>.checkpoint")
+    parser.add_argument("--workers", type=int, default=8, help="files in flight")
+    parser.add_argument("--parquet-rows", type=int, default=500, help="rows per Parquet part file")
+    parser.add_argument("--max-file-bytes", type=int,
+                        help="larger files are written with an error, unread; defaults to MAX_FILE_BYTES")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or next((f for f in WRITERS if args.out.lower().endswith("." + f)), "jsonl")
+    fields = [f.strip() for f in args.fields.split(",") if f.strip()]
+    writer = ParquetWriter(args.out, fields, args.parquet_rows) if fmt == "parquet" else WRITERS[fmt](args.out, fields)
+    checkpoint = Checkpoint(args.checkpoint or args.out.rstrip("/") + ".checkpoint")
+    try:
+        summary = asyncio.run(ingest(args.sources, fields, writer, checkpoint, args.workers,
+                                     max_file_bytes=args.max_file_bytes))
+    except KeyboardInterrupt:
+        print(f"Interrupted; rerun the same command to resume ({len(checkpoint.done)} files checkpointed)",
+              file=sys.stderr)
+        raise SystemExit(130)
+    finally:
+        checkpoint.close()
+    print(json.dumps(summary))
+
+
+if __name__ == "__main__":
+    main()
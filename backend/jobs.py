@@ -0,0 +1,201 @@
+import asyncio
+import math
+import time
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from .inference_client import InferenceClient
+from .metrics import Timeline, current_timeline, timeline_scope
+from .uploads import UploadPayload
+
+
+@dataclass
+class Job:
+    """One batch of files submitted through POST /jobs"""
+    id: str
+    file_names: List[str]
+    prompt: str
+    status: str = "queued"  # queued -> running -> done
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    # results[i] is the result for file_names[i]; events is the completion order
+    results: List[Optional[Dict[str, Any]]] = field(default_factory=list)
+    events: List[Dict[str, Any]] = field(default_factory=list)
+
+    def __post_init__(self):
+        if not self.results:
+            self.results = [None] * len(self.file_names)
+
+    @property
+    def completed(self) -> int:
+        return len(self.events)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "jobId": self.id,
+            "status": self.status,
+            "total": len(self.file_names),
+            "completed": self.completed,
+            "createdAt": self.created_at,
+            "finishedAt": self.finished_at,
+        }
+
+
+class JobQueueFull(Exception):
+    """Raised by ``JobRunner.submit`` when the files would not fit in the queue;
+    without ``retry_after`` they never will"""
+
+    def __init__(self, detail: str, retry_after: Optional[int] = None):
+        super().__init__(detail)
+        self.retry_after = retry_after
+
+
+class JobStore(ABC):
+    """Where job state lives. Subclass this to back jobs with Redis, a database, etc."""
+
+    @abstractmethod
+    async def create(self, job: Job):
+        ...
+
+    @abstractmethod
+    async def get(self, job_id: str) -> Optional[Job]:
+        ...
+
+    @abstractmethod
+    async def add_result(self, job_id: str, index: int, result: Dict[str, Any]):
+        ...
+
+    @abstractmethod
+    async def wait(self, job_id: str, seen: int):
+        """Return once the job has more than ``seen`` events or is done"""
+
+    async def events(self, job_id: str) -> AsyncIterator[Dict[str, Any]]:
+        """Yield every finished file result in completion order, replaying earlier ones first"""
+        seen = 0
+        while True:
+            job = await self.get(job_id)
+            if job is None:
+                return
+            while seen < len(job.events):
+                yield job.events[seen]
+                seen += 1
+            if job.status == "done":
+                return
+            await self.wait(job_id, seen)
+
+
+class InMemoryJobStore(JobStore):
+    """Job state in a dict on this process; lost on restart, not shared between workers"""
+
+    def __init__(self, ttl: float = 3600):
+        self.ttl = ttl
+        self._jobs: Dict[str, Job] = {}
+        self._changed = asyncio.Condition()
+
+    async def create(self, job: Job):
+        self._expire()
+        self._jobs[job.id] = job
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    async def add_result(self, job_id: str, index: int, result: Dict[str, Any]):
+        job = self._jobs[job_id]
+        job.results[index] = result
+        job.events.append({"index": index, "result": result})
+        job.status = "running"
+        if job.completed == len(job.file_names):
+            job.status = "done"
+            job.finished_at = time.time()
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def wait(self, job_id: str, seen: int):
+        async with self._changed:
+            await self._changed.wait_for(
+                lambda: job_id not in self._jobs
+                or len(self._jobs[job_id].events) > seen
+                or self._jobs[job_id].status == "done"
+            )
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        for job_id in [j.id for j in self._jobs.values() if j.finished_at and j.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+
+class JobRunner:
+    """Background worker pool that drains queued files through the inference client.
+
+    At most ``max_queued`` files wait for a worker - each holds its upload
+    spool - and a job that would not fit is refused whole with
+    ``JobQueueFull``.
+    """
+
+    def __init__(self, store: JobStore, client: InferenceClient, workers: int = 4, max_queued: int = 1000):
+        self.store = store
+        self.client = client
+        self.workers = workers
+        self.max_queued = max_queued
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queued)
+        self._reserved = 0  # files of jobs being created, not yet queued
+        self._file_seconds = 1.0  # moving average, for Retry-After
+        self.rejected = 0
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def check_room(self, files: int):
+        """Raise ``JobQueueFull`` unless ``files`` more files fit in the queue"""
+        if files > self.max_queued:
+            self.rejected += 1
+            raise JobQueueFull(f"A job may have at most {self.max_queued} files; split this one up")
+        depth = self._queue.qsize() + self._reserved
+        if depth + files > self.max_queued:
+            self.rejected += 1
+            retry_after = max(1, math.ceil((depth + files - self.max_queued) * self._file_seconds / self.workers))
+            raise JobQueueFull(f"Job queue is full ({depth}/{self.max_queued} files queued), retry later",
+                               retry_after)
+
+    async def submit(self, payloads: List[UploadPayload], prompt: str,
+                     fields: Optional[List[str]] = None) -> Job:
+        self.check_room(len(payloads))
+        self._reserved += len(payloads)
+        try:
+            job = Job(id=uuid.uuid4().hex, file_names=[p.filename for p in payloads], prompt=prompt)
+            await self.store.create(job)
+        finally:
+            self._reserved -= len(payloads)
+        # Each file's timing starts from the submitting request's (upload, spool)
+        parent = current_timeline.get()
+        queued = time.perf_counter()
+        for index, payload in enumerate(payloads):
+            self._queue.put_nowait((job.id, index, payload, prompt, fields, parent, queued))
+        return job
+
+    async def _work(self):
+        while True:
+            job_id, index, payload, prompt, fields, parent, queued = await self._queue.get()
+            try:
+                timeline = Timeline(parent=parent)
+                timeline.add("job_queue", time.perf_counter() - queued)
+                started = time.perf_counter()
+                with timeline_scope(timeline):
+                    result = await self.client.try_process(payload, prompt, fields)
+                self._file_seconds = 0.8 * self._file_seconds + 0.2 * (time.perf_counter() - started)
+                await self.store.add_result(job_id, index, result)
+            finally:
+                payload.close()
+                self._queue.task_done()
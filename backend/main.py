@@ -1,72 +1,605 @@
-from fastapi import FastAPI, UploadFile, File, Form
+"""The backend's HTTP API.
+
+``create_app()`` builds the app from ``Settings`` (the environment by
+default); ``uvicorn backend.main:app`` still works, the module builds its
+``app`` the first time it is asked for. Importing this module does no more
+than import FastAPI: the document libraries (PyMuPDF, Pillow, NumPy) load
+on first use, Jinja2 with the first page view, and the process pools,
+stores and model client start with the app. ``WARMUP`` decides whether the
+warmup hooks run before the server listens, right after, or not at all.
+"""
+from fastapi import APIRouter, FastAPI, Request, UploadFile, File, Form, HTTPException, Depends, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from typing import List
-import shutil, os, requests, json
-from fastapi.templating import Jinja2Templates
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Sequence
+import asyncio, logging, os, json, tempfile, time
+
+from .admission import AdmissionMiddleware, FairQueue
+from .backends import BackendPool
+from .cache import ResultCache
+from .config import Settings
+from .dedupe import DuplicateDetector
+from .inference_client import InferenceClient
+from .jobs import InMemoryJobStore, JobQueueFull, JobRunner
+from .metrics import REGISTRY, MetricsMiddleware, Timeline, timeline_scope
+from .model_http import deadline_scope, request_deadline
+from .normalize import ImageNormalizer, NormalizeOptions
+from .pages import PagePipeline
+from .results import InvoiceQuery, ResultStore
+from .routing import DocumentRouter
+from .streaming import FieldScanner, StreamStats, StreamTimer, sse
+from .templates import TemplateLearner
+from .thumbnails import ThumbnailCache, ThumbnailOptions
+from .uploads import UploadPayload
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WARMUP_MODES = ("startup", "background", "off")
+
+logger = logging.getLogger(__name__)
+
+
+def build_inference(settings: Optional[Settings] = None) -> InferenceClient:
+    """The processing core behind every route, configured from ``settings`` (default: the environment).
+
+    Also used by the bulk ingester (``python -m backend.ingest``), so both
+    extract files the same way.
+    """
+    s = settings or Settings.from_env()
+    cache = ResultCache(s.result_cache_bytes, s.result_cache_db) if s.result_cache_bytes else None
+    router = DocumentRouter(min_chars=s.text_min_chars, text_llm_url=s.text_llm_url, text_llm_model=s.text_llm_model,
+                            text_llm_api_key=s.text_llm_api_key) if s.text_routing else None
+    backends = BackendPool(s.urls, s.backend_failure_threshold, s.backend_cooldown,
+                           s.backend_retries, probe_interval=s.health_probe_interval, hedge_quantile=s.hedge_quantile,
+                           hedge_min=s.hedge_min_ms / 1000, hedge_budget=s.hedge_budget)
+    normalizer = ImageNormalizer(NormalizeOptions(s.normalize_max_side, s.normalize_format.upper(),
+                                                  s.normalize_quality, s.normalize_grayscale,
+                                                  s.normalize_autocontrast),
+                                 s.normalize_workers) if s.normalize_images else None
+    if normalizer is not None:
+        normalizer.start()
+    pages = PagePipeline(s.page_dpi, s.page_concurrency, s.max_pages) if s.page_splitting else None
+    dedupe = DuplicateDetector(s.dedupe_text_distance, s.dedupe_image_distance, s.dedupe_report_distance,
+                               s.dedupe_max_entries) if s.dedupe else None
+    results = ResultStore(s.results_db) if s.results_db else None
+    templates = TemplateLearner(s.template_samples, s.template_max_distance, s.template_min_confidence,
+                                s.templates_path) if s.templates else None
+    return InferenceClient(backends, s.max_concurrency, s.model_timeout, cache, s.model_id, router, normalizer,
+                           pages, dedupe, results, templates, deadline=s.model_deadline or None, http2=s.model_http2,
+                           gzip=s.model_gzip)
+
+
+# --- Warmup ---
+def warm_document_libraries():
+    """Import what the request path uses in this process: PyMuPDF, Pillow and NumPy"""
+    import fitz  # noqa: F401  PyMuPDF
+    import numpy  # noqa: F401
+    from PIL import Image
+
+    Image.init()  # registers the format plugins, otherwise done by the first Image.open
+
+
+def warm_frontend():
+    frontend().get_template("index.html")
+
+
+WARMUP_HOOKS: List[Callable[[], None]] = [warm_document_libraries, warm_frontend]
+
+
+def run_warmup(hooks: Sequence[Callable[[], None]], report: Dict) -> Dict:
+    """Run each hook (on a worker thread), recording how long it took; a failing hook is logged, not raised"""
+    started = time.perf_counter()
+    for hook in hooks:
+        hook_started = time.perf_counter()
+        try:
+            hook()
+        except Exception:
+            logger.exception("Warmup hook %s failed", hook.__name__)
+        report["hooksMs"][hook.__name__] = round(1000 * (time.perf_counter() - hook_started), 1)
+    report["warmupMs"] = round(1000 * (time.perf_counter() - started), 1)
+    return report
 
-# --- Config ---
-COLAB_URL = "https://9c5f-34-145-65-140.ngrok-free.app/process"  # Replace with your actual Colab endpoint
-UPLOAD_DIR = "temp"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 # --- App Setup ---
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    settings: Settings = app.state.settings
+    started = time.perf_counter()
+    # One pooled client for the lifetime of the app so connections are reused
+    app.state.inference = build_inference(settings)
+    app.state.inference.start()
+    app.state.jobs = JobRunner(InMemoryJobStore(), app.state.inference, settings.job_workers,
+                               settings.max_queued_job_files)
+    app.state.jobs.start()
+    app.state.stream_stats = StreamStats()
+    app.state.thumbnails = ThumbnailCache(ThumbnailOptions(settings.thumbnail_size, settings.thumbnail_size,
+                                                           settings.thumbnail_format.upper(),
+                                                           settings.thumbnail_quality),
+                                          settings.thumbnail_cache_bytes,
+                                          settings.thumbnail_workers) if settings.thumbnails else None
+    if app.state.thumbnails is not None:
+        app.state.thumbnails.start()
+    admission = app.state.admission
+    REGISTRY.gauge("model_calls_in_flight", "Calls to the model servers in flight",
+                   lambda: app.state.inference.in_flight)
+    REGISTRY.gauge("job_queue_depth", "Files waiting for a /jobs worker", lambda: app.state.jobs.queue_depth)
+    REGISTRY.gauge("admission_queue_depth", "Requests queued for admission", lambda: admission.queued)
+    REGISTRY.gauge("admission_active", "Admitted requests being processed", lambda: admission.active)
+    REGISTRY.gauge("backend_outstanding_requests", "Requests outstanding across inference backends",
+                   lambda: sum(b.outstanding for b in app.state.inference.backends.backends))
+    report = app.state.startup
+    report["lifespanMs"] = round(1000 * (time.perf_counter() - started), 1)
+    warmup = None
+    if report["warmup"] == "startup":
+        await asyncio.to_thread(run_warmup, app.state.warmup_hooks, report)
+    elif report["warmup"] == "background":
+        warmup = asyncio.create_task(asyncio.to_thread(run_warmup, app.state.warmup_hooks, report))
+    yield
+    if warmup is not None:
+        await warmup
+    await app.state.jobs.stop()
+    await app.state.inference.aclose()
+    if app.state.thumbnails is not None:
+        app.state.thumbnails.close()
+
+
+def create_app(settings: Optional[Settings] = None,
+               warmup_hooks: Optional[Sequence[Callable[[], None]]] = None) -> FastAPI:
+    """The backend app; ``settings`` default to the environment, ``warmup_hooks`` to ``WARMUP_HOOKS``"""
+    settings = settings or Settings.from_env()
+    if settings.warmup not in WARMUP_MODES:
+        raise ValueError(f"WARMUP must be one of {', '.join(WARMUP_MODES)}, not {settings.warmup!r}")
+    app = FastAPI(lifespan=lifespan)
+    app.state.settings = settings
+    app.state.warmup_hooks = list(WARMUP_HOOKS if warmup_hooks is None else warmup_hooks)
+    app.state.startup = {"warmup": settings.warmup, "lifespanMs": None, "warmupMs": None, "hooksMs": {}}
+    app.state.admission = FairQueue(settings.active_requests, settings.max_queued_requests,
+                                    settings.max_queued_per_client, settings.max_queue_wait)
+    # Queued extraction requests; /jobs has its own queue and only gets the upload limits
+    app.add_middleware(AdmissionMiddleware, queue=app.state.admission,
+                       paths=["/process", "/process/stream", "/jobs", "/thumbnails"],
+                       queued_paths=["/process", "/process/stream"], max_files=settings.max_files_per_request,
+                       max_file_bytes=settings.max_file_bytes, max_request_bytes=settings.max_request_bytes)
+    app.add_middleware(MetricsMiddleware)
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],  # Adjust for production
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+    app.mount("/static", StaticFiles(directory=os.path.join(ROOT, "static")), name="static")
+    app.include_router(router)
+    return app
+
+
+def __getattr__(name: str):
+    # ``backend.main:app`` for uvicorn and ``from backend.main import app``, built on first access
+    if name == "app":
+        globals()["app"] = create_app()
+        return globals()["app"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+router = APIRouter()
+
+
+@lru_cache(maxsize=1)
+def frontend():
+    from fastapi.templating import Jinja2Templates  # imports jinja2, which only the page itself needs
+
+    return Jinja2Templates(directory=os.path.join(ROOT, "frontend"))
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # Adjust for production
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
 
-# Static files and templates
-frontend = Jinja2Templates(directory="frontend")
-app.mount("/static", StaticFiles(directory="static"), name="static")
+@router.get("/")
+async def root(request: Request):
+    return frontend().TemplateResponse(request, "index.html")
 
-@app.get("/")
-async def root():
-    return frontend.TemplateResponse("index.html", {"request": {}})
+
+def build_prompt(fields: List[str]) -> str:
+    return _compile_prompt(tuple(fields))
+
+
+@lru_cache(maxsize=256)
+def _compile_prompt(fields: tuple) -> str:
+    # Static instruction first, selected fields last, so prompts share a prefix
+    field_list = [f.replace("_", " ").title() for f in fields]
+    return f"Extract the following fields from the invoice: {', '.join(field_list)}."
+
+
+def request_timeline(request: Request) -> Timeline:
+    """Timeline shared by a request's files, starting with the upload itself"""
+    timeline = Timeline(request.state.request_id)
+    # Queueing, body receipt and multipart parsing happen before the handler runs
+    admitted = getattr(request.state, "admitted", request.state.started)
+    timeline.add("admission", admitted - request.state.started)
+    timeline.add("upload", time.perf_counter() - admitted)
+    return timeline
+
+
+def caller_deadline(request: Request) -> Optional[float]:
+    """Seconds left of the deadline the caller sent in X-Request-Deadline-Ms, counted from arrival"""
+    deadline = request_deadline(request.headers, request.state.started)
+    return None if deadline is None else deadline - time.perf_counter()
 
 
 # --- Main Route ---
-@app.post("/process")
+@router.post("/process")
 async def process(
+    request: Request,
     files: List[UploadFile] = File(...),
     fields: str = Form(...)
 ):
+    settings: Settings = request.app.state.settings
+    timeline = request_timeline(request)
     parsed_fields = json.loads(fields)
-    field_list = [f.replace("_", " ").title() for f in parsed_fields]
-    prompt = f"Extract the following fields from the invoice: {', '.join(field_list)}."
+    prompt = build_prompt(parsed_fields)
 
-    results = []
-    os.makedirs("temp", exist_ok=True)
+    # Stream each upload straight into the outgoing request - no temp/ copy
+    with timeline.span("spool"):
+        payloads = [await UploadPayload.from_upload(file, settings.upload_spill_bytes) for file in files]
 
-    for file in files:
-        temp_path = f"temp/{file.filename}"
-        with open(temp_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+    # Fan out to the model concurrently; results keep upload order
+    try:
+        with timeline_scope(timeline), deadline_scope(caller_deadline(request)):
+            results = await request.app.state.inference.process_many(payloads, prompt, settings.request_concurrency,
+                                                                     parsed_fields)
+    finally:
+        for payload in payloads:
+            payload.close()
+
+    return JSONResponse(content=results)
+
+
+@router.post("/process/stream")
+async def process_stream(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    fields: str = Form(...)
+):
+    """Server-sent events while the files are extracted.
 
-        with open(temp_path, "rb") as f:
+    ``token`` carries generated text as it arrives, ``field`` fires once per
+    requested field as soon as its value is complete, ``result`` carries the
+    same JSON ``/process`` returns (plus a ``timing`` block) and ``done``
+    closes the stream. Events of different files interleave; each has the
+    file's ``index``.
+    """
+    settings: Settings = request.app.state.settings
+    timeline = request_timeline(request)
+    parsed_fields = json.loads(fields)
+    prompt = build_prompt(parsed_fields)
+    # The response body outlives this handler, and with it the UploadFiles
+    with timeline.span("spool"):
+        payloads = [await UploadPayload.from_upload(file, settings.job_spill_bytes) for file in files]
+    started = time.perf_counter()
+
+    async def extract(index: int, payload: UploadPayload, limit: asyncio.Semaphore, queue: asyncio.Queue):
+        timer = StreamTimer(started)
+        scanner = FieldScanner(parsed_fields)
+        file_timeline = Timeline(parent=timeline)
+
+        def found(pairs):
+            for name, value in pairs:
+                queue.put_nowait(sse("field", {"index": index, "name": name, "value": value,
+                                               "elapsedMs": timer.field()}))
+
+        async with limit:
             try:
-                response = requests.post(
-                    COLAB_URL,
-                    files={"file": f},
-                    data={"prompt": prompt},
-                    timeout=60
-                )
-                response.raise_for_status()
-                result_data = response.json()
+                with timeline_scope(file_timeline), deadline_scope(caller_deadline(request)), \
+                        deadline_scope(request.app.state.inference.deadline):
+                    async for event, data in request.app.state.inference.stream(payload, prompt, parsed_fields):
+                        if event == "token":
+                            timer.token()
+                            queue.put_nowait(sse("token", {"index": index, "text": data.get("text", "")}))
+                            found(scanner.feed(data.get("text", "")))
+                        elif event == "result":
+                            extracted = data.get("extractedFields")
+                            if isinstance(extracted, dict):
+                                # Cached and text-routed results arrive whole
+                                found((k, v) for k, v in extracted.items()
+                                      if k in scanner.fields and k not in scanner.found)
+                            result = data
             except Exception as e:
-                result_data = {
-                    "fileName": file.filename,
-                    "error": str(e),
-                    "promptUsed": prompt
-                }
+                result = {"fileName": payload.filename, "error": str(e), "promptUsed": prompt}
+            finally:
+                payload.close()
+        result = {**result, "timing": {**timer.timing(), **file_timeline.to_dict()}}
+        request.app.state.stream_stats.record(result["timing"])
+        queue.put_nowait(sse("result", {"index": index, "result": result}))
+        return result
 
-        os.remove(temp_path)
-        results.append(result_data)
+    async def stream():
+        queue: asyncio.Queue = asyncio.Queue()
+        limit = asyncio.Semaphore(settings.request_concurrency)
+        tasks = [asyncio.create_task(extract(i, p, limit, queue)) for i, p in enumerate(payloads)]
+        gathered = asyncio.gather(*tasks)
+        try:
+            while not (gathered.done() and queue.empty()):
+                getter = asyncio.ensure_future(queue.get())
+                await asyncio.wait({getter, gathered}, return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    yield getter.result()
+                else:
+                    getter.cancel()
+            first_fields = [r["timing"]["firstFieldMs"] for r in gathered.result()
+                            if r["timing"]["firstFieldMs"] is not None]
+            yield sse("done", {"total": len(payloads), "completed": len(payloads),
+                               "timeToFirstFieldMs": min(first_fields, default=None),
+                               "totalMs": round(1000 * (time.perf_counter() - started), 1)})
+        finally:
+            # Client went away: stop generating for it
+            for task in tasks:
+                task.cancel()
+            for payload in payloads:
+                payload.close()
 
-    return JSONResponse(content=results)
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# --- Thumbnails ---
+def thumbnail_response(request: Request, thumbnails: ThumbnailCache, sha256: str,
+                       thumbnail: Optional[bytes]) -> Response:
+    max_age = request.app.state.settings.thumbnail_max_age
+    headers = {"ETag": thumbnails.etag(sha256), "Cache-Control": f"public, max-age={max_age}",
+               "X-File-Hash": sha256}
+    if thumbnail is None:
+        return Response(status_code=304, headers=headers)
+    return Response(thumbnail, media_type=thumbnails.content_type, headers=headers)
+
+
+@router.get("/thumbnails/stats")
+async def thumbnail_stats(request: Request):
+    """Thumbnail cache hits, renders and render time"""
+    thumbnails = request.app.state.thumbnails
+    return thumbnails.stats() if thumbnails is not None else {"enabled": False}
+
+
+@router.get("/thumbnails/{sha256}")
+async def get_thumbnail(sha256: str, request: Request):
+    """First-page thumbnail of the file with this SHA-256; 404 until it has been posted to /thumbnails"""
+    thumbnails = request.app.state.thumbnails
+    if thumbnails is None:
+        raise HTTPException(status_code=404, detail="Thumbnails are disabled")
+    sha256 = sha256.lower()
+    # The URL names the content, so a matching ETag is current even if the cache has since dropped it
+    if request.headers.get("if-none-match") == thumbnails.etag(sha256):
+        return thumbnail_response(request, thumbnails, sha256, None)
+    thumbnail = thumbnails.get(sha256)
+    if thumbnail is None:
+        raise HTTPException(status_code=404, detail="No thumbnail for this file yet")
+    return thumbnail_response(request, thumbnails, sha256, thumbnail)
+
+
+@router.post("/thumbnails")
+async def create_thumbnail(request: Request, file: UploadFile = File(...)):
+    """Render (or look up) the thumbnail of one uploaded file; it is then also served by hash"""
+    thumbnails = request.app.state.thumbnails
+    if thumbnails is None:
+        raise HTTPException(status_code=404, detail="Thumbnails are disabled")
+    payload = await UploadPayload.from_upload(file, request.app.state.settings.upload_spill_bytes)
+    try:
+        thumbnail = await thumbnails.render(payload)
+        sha256 = await payload.sha256()
+    finally:
+        payload.close()
+    if thumbnail is None:
+        raise HTTPException(status_code=415, detail=f"Cannot render a preview of {file.filename}")
+    return thumbnail_response(request, thumbnails, sha256, thumbnail)
+
+
+# --- Results store ---
+def invoice_query(vendor_name: Optional[str] = None, vendor_prefix: Optional[str] = None,
+                  invoice_number: Optional[str] = None, date_from: Optional[str] = None,
+                  date_to: Optional[str] = None, min_total: Optional[float] = None,
+                  max_total: Optional[float] = None, currency: Optional[str] = None) -> InvoiceQuery:
+    """Filters shared by the /invoices routes, from the query string"""
+    return InvoiceQuery(vendor_name, vendor_prefix, invoice_number, date_from, date_to, min_total, max_total,
+                        currency)
+
+
+def results_store(request: Request) -> ResultStore:
+    results = request.app.state.inference.results
+    if results is None:
+        raise HTTPException(status_code=404, detail="The results store is disabled")
+    return results
+
+
+@router.get("/invoices")
+async def list_invoices(request: Request, query: InvoiceQuery = Depends(invoice_query), sort: str = "id",
+                        order: str = "desc", limit: int = 50, cursor: Optional[str] = None, line_items: bool = False):
+    """Stored invoices matching the filters, a page at a time; pass ``nextCursor`` back for the next page"""
+    try:
+        return await asyncio.to_thread(results_store(request).page, query, sort, order != "asc", limit, cursor,
+                                       line_items)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/invoices/aggregate")
+async def aggregate_invoices(request: Request, query: InvoiceQuery = Depends(invoice_query),
+                             group_by: Optional[str] = None, limit: int = 100):
+    """Invoice count and amount totals of the matches, overall or per vendor_name / currency / month / year"""
+    try:
+        return {"groups": await asyncio.to_thread(results_store(request).aggregate, query, group_by, limit)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/invoices/export")
+async def export_invoices(request: Request, background: BackgroundTasks,
+                          query: InvoiceQuery = Depends(invoice_query), format: str = "csv", table: str = "invoices"):
+    """The matching invoices (or their line items) as CSV or Parquet"""
+    results = results_store(request)
+    if table not in ("invoices", "line_items"):
+        raise HTTPException(status_code=400, detail="table must be invoices or line_items")
+    if format == "csv":
+        return StreamingResponse(results.export_csv(query, table), media_type="text/csv",
+                                 headers={"Content-Disposition": f'attachment; filename="{table}.csv"'})
+    if format != "parquet":
+        raise HTTPException(status_code=400, detail="format must be csv or parquet")
+    fd, path = tempfile.mkstemp(suffix=".parquet")
+    os.close(fd)
+    try:
+        await asyncio.to_thread(results.export_parquet, query, path, table)
+    except RuntimeError as e:
+        os.remove(path)
+        raise HTTPException(status_code=501, detail=str(e))
+    background.add_task(os.remove, path)
+    return FileResponse(path, media_type="application/vnd.apache.parquet", filename=f"{table}.parquet")
+
+
+@router.get("/invoices/stats")
+async def invoice_stats(request: Request):
+    """Invoices and line items stored, skipped and replaced"""
+    results = request.app.state.inference.results
+    return await asyncio.to_thread(results.stats) if results is not None else {"enabled": False}
+
+
+@router.get("/invoices/{invoice_id}")
+async def get_invoice(request: Request, invoice_id: int):
+    """One stored invoice with all its extracted fields and line items"""
+    invoice = await asyncio.to_thread(results_store(request).get, invoice_id)
+    if invoice is None:
+        raise HTTPException(status_code=404, detail=f"Unknown invoice: {invoice_id}")
+    return invoice
+
+
+# --- Job API ---
+@router.post("/jobs", status_code=202)
+async def create_job(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    fields: str = Form(...)
+):
+    """Queue files for background processing and return the job id right away"""
+    settings: Settings = request.app.state.settings
+    timeline = request_timeline(request)
+    parsed_fields = json.loads(fields)
+    prompt = build_prompt(parsed_fields)
+    jobs: JobRunner = request.app.state.jobs
+    try:
+        # Refuse before spooling when the queue is already full
+        jobs.check_room(len(files))
+        with timeline.span("spool"):
+            payloads = [await UploadPayload.from_upload(file, settings.job_spill_bytes) for file in files]
+        with timeline_scope(timeline):
+            try:
+                job = await jobs.submit(payloads, prompt, parsed_fields)
+            except JobQueueFull:
+                for payload in payloads:
+                    payload.close()
+                raise
+    except JobQueueFull as e:
+        if e.retry_after is None:
+            raise HTTPException(status_code=413, detail=str(e))
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    return job.summary()
+
+
+async def get_job_or_404(request: Request, job_id: str):
+    job = await request.app.state.jobs.store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return job
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(request: Request, job_id: str):
+    job = await get_job_or_404(request, job_id)
+    return {**job.summary(), "results": job.results}
+
+
+@router.get("/jobs/{job_id}/events")
+async def job_events(request: Request, job_id: str):
+    """Server-sent events: one ``result`` event per finished file, then ``done``"""
+    await get_job_or_404(request, job_id)
+    store = request.app.state.jobs.store
+
+    async def stream():
+        async for event in store.events(job_id):
+            yield f"event: result\ndata: {json.dumps(event)}\n\n"
+        job = await store.get(job_id)
+        yield f"event: done\ndata: {json.dumps(job.summary())}\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.get("/metrics")
+async def metrics():
+    """Prometheus text format: stage histograms, in-flight requests, queue depth, bytes"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@router.get("/backends/stats")
+async def backend_stats(request: Request):
+    return request.app.state.inference.backends.stats()
+
+
+@router.get("/model/stats")
+async def model_stats(request: Request):
+    """How the model servers are called: HTTP/2, gzip, deadline, hedging"""
+    return request.app.state.inference.http_stats()
+
+
+@router.get("/routing/stats")
+async def routing_stats(request: Request):
+    router = request.app.state.inference.router
+    return router.stats() if router is not None else {"enabled": False}
+
+
+@router.get("/normalize/stats")
+async def normalize_stats(request: Request):
+    """Images re-encoded before the model hop, bytes before / after and time spent"""
+    normalizer = request.app.state.inference.normalizer
+    return normalizer.stats() if normalizer is not None else {"enabled": False}
+
+
+@router.get("/pages/stats")
+async def pages_stats(request: Request):
+    pages = request.app.state.inference.pages
+    return pages.stats() if pages is not None else {"enabled": False}
+
+
+@router.get("/admission/stats")
+async def admission_stats(request: Request):
+    """Requests being processed, queued and turned away"""
+    return request.app.state.admission.stats()
+
+
+@router.get("/dedupe/stats")
+async def dedupe_stats(request: Request):
+    """Files checked for near-duplicates and how many were linked or reported"""
+    dedupe = request.app.state.inference.dedupe
+    return dedupe.stats() if dedupe is not None else {"enabled": False}
+
+
+@router.get("/templates/stats")
+async def template_stats(request: Request):
+    """Vendor templates learned, template hit rate and model time saved"""
+    templates = request.app.state.inference.templates
+    return templates.stats() if templates is not None else {"enabled": False}
+
+
+@router.get("/stream/stats")
+async def stream_stats(request: Request):
+    """Time to first token / first field / full result for streamed extractions"""
+    return request.app.state.stream_stats.stats()
+
+
+@router.get("/cache/stats")
+async def cache_stats(request: Request):
+    cache = request.app.state.inference.cache
+    return cache.stats() if cache is not None else {"enabled": False}
+
+
+@router.get("/startup/stats")
+async def startup_stats(request: Request):
+    """Warmup mode, time spent starting the app and in each warmup hook"""
+    return request.app.state.startup
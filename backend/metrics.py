@@ -0,0 +1,254 @@
+"""Per-stage timing spans and a Prometheus text-format ``/metrics``.
+
+Used by both the backend and the notebook model server, so it only needs
+the standard library. Each file's work is recorded on a ``Timeline``: named
+stage durations that end up in the result's ``timing`` block and in the
+``invoice_stage_seconds`` histogram. The current timeline lives in a
+context variable, so code deep in the call stack (routing, the model hop)
+can add spans without it being passed around; tasks started with
+``asyncio.gather`` inherit it.
+
+The request id comes from the ``X-Request-ID`` header or is generated by
+``MetricsMiddleware``, is sent on to the model server with every call and
+comes back with its stages, which are merged in under ``model.``.
+"""
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+REQUEST_ID_HEADER = "X-Request-ID"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32)
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{_labels(self.labelnames, k)} {v}" for k, v in sorted(self._values.items())]
+
+
+class Gauge(_Metric):
+    """A settable value, or one read from ``fn`` at scrape time"""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Optional[Callable[[], float]] = None):
+        super().__init__(name, help)
+        self.fn = fn
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.inc(-amount)
+
+    def _samples(self) -> List[str]:
+        value = self.fn() if self.fn is not None else self.value
+        return [f"{self.name} {value}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[str, ...], List[float]] = {}  # bucket counts..., sum, count
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, series in sorted(self._series.items()):
+            for bound, count in zip(self.buckets, series):
+                le = _labels(self.labelnames, key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{le} {count}")
+            le = _labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {series[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {round(series[-2], 6)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {series[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _add(self, metric: _Metric) -> Any:
+        # Re-registering (e.g. a re-run notebook cell) returns the existing metric
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, fn: Optional[Callable[[], float]] = None) -> Gauge:
+        gauge = self._add(Gauge(name, help, fn))
+        if fn is not None:
+            gauge.fn = fn
+        return gauge
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def render(self) -> str:
+        return "\n".join(line for m in self._metrics.values() for line in m.render()) + "\n"
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram("invoice_stage_seconds", "Time spent per processing stage", ["stage"])
+HTTP_IN_FLIGHT = REGISTRY.gauge("http_requests_in_flight", "HTTP requests being served")
+HTTP_REQUESTS = REGISTRY.counter("http_requests_total", "HTTP requests served", ["method", "status"])
+HTTP_BYTES = REGISTRY.counter("http_bytes_total", "HTTP body bytes received and sent", ["direction"])
+
+
+class Timeline:
+    """Stage durations (ms) for one file, optionally on top of its request's timeline.
+
+    Stages recorded here are also observed in ``STAGE_SECONDS``; stages
+    merged from the model server with ``merge`` are not, since that server
+    exports its own.
+    """
+
+    def __init__(self, request_id: Optional[str] = None, parent: Optional["Timeline"] = None):
+        self.request_id = request_id or (parent.request_id if parent else None) or uuid.uuid4().hex
+        self.parent = parent
+        self.stages: Dict[str, float] = {}
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = round(self.stages.get(stage, 0.0) + 1000 * seconds, 2)
+        STAGE_SECONDS.observe(seconds, stage=stage)
+
+    @contextmanager
+    def span(self, stage: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - started)
+
+    def merge(self, stages: Dict[str, float], prefix: str = "model."):
+        for stage, ms in stages.items():
+            key = prefix + stage
+            self.stages[key] = round(self.stages.get(key, 0.0) + ms, 2)
+
+    def to_dict(self) -> Dict[str, Any]:
+        stages = {**(self.parent.to_dict()["stages"] if self.parent else {}), **self.stages}
+        return {"requestId": self.request_id, "stages": stages}
+
+
+current_timeline: ContextVar[Optional[Timeline]] = ContextVar("current_timeline", default=None)
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Time a stage on the current timeline, if there is one"""
+    timeline = current_timeline.get()
+    if timeline is None:
+        yield
+    else:
+        with timeline.span(stage):
+            yield
+
+
+@contextmanager
+def timeline_scope(timeline: Timeline) -> Iterator[Timeline]:
+    token = current_timeline.set(timeline)
+    try:
+        yield timeline
+    finally:
+        current_timeline.reset(token)
+
+
+class MetricsMiddleware:
+    """ASGI middleware: request id, in-flight gauge, status counts and body bytes.
+
+    Bytes are counted as they pass, so streamed responses are included.
+    ``request.state.request_id`` and ``request.state.started`` are set for
+    the handlers.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(REQUEST_ID_HEADER.lower().encode(), b"").decode() or uuid.uuid4().hex
+        state = scope.setdefault("state", {})
+        state["request_id"] = request_id
+        state["started"] = time.perf_counter()
+        status = [500]
+
+        async def counted_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                HTTP_BYTES.inc(len(message.get("body", b"")), direction="in")
+            return message
+
+        async def counted_send(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                message = {**message, "headers": list(message.get("headers", []))
+                           + [(REQUEST_ID_HEADER.lower().encode(), request_id.encode())]}
+            elif message["type"] == "http.response.body":
+                HTTP_BYTES.inc(len(message.get("body", b"")), direction="out")
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, counted_receive, counted_send)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            HTTP_REQUESTS.inc(method=scope["method"], status=status[0])
@@ -0,0 +1,231 @@
+"""HTTP to the model servers: one pooled client, deadlines, gzip bodies.
+
+Every call to a model server - the Colab ``/process`` contract and
+OpenAI-style chat-completions endpoints alike - goes through one
+``httpx.AsyncClient`` made by ``make_client``, so TCP and TLS setup to the
+tunnel is paid once per connection rather than once per invoice. It speaks
+HTTP/2 when the ``h2`` package is installed: concurrent calls to the same
+server are then multiplexed over a single connection, which is what
+HTTP/1.1 pipelining was meant to give and never reliably did.
+
+Deadlines replace the flat per-call timeout. ``deadline_scope`` sets how
+long the work in its block may take in total; retries, failover, hedges and
+the pages of one document all share it. Each attempt's timeout is the time
+left (``call_timeout``), no retry starts once it is spent, and the time left
+travels to the model server in ``X-Request-Deadline-Ms`` so it can drop
+work whose caller has already given up (``request_deadline``).
+
+``gzip_chunks`` compresses a streamed request body on the fly. Only our own
+model servers accept that - they install ``GzipRequestMiddleware`` - so it
+is opt-in, and bodies that are already compressed (JPEG, PNG, WebP) are
+sent as they are. Responses are negotiated with ``Accept-Encoding`` by
+httpx as usual.
+"""
+import json
+import time
+import zlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import httpx
+
+from .asgi import Refused, call_checked
+from .metrics import REGISTRY
+
+DEADLINE_HEADER = "X-Request-Deadline-Ms"
+COMPRESSED_TYPES = {"image/jpeg", "image/png", "image/webp", "image/gif", "application/zip", "application/gzip"}
+CONNECT_TIMEOUT = 10.0
+
+# perf_counter() time by which the current request's model calls must be done
+current_deadline: ContextVar[Optional[float]] = ContextVar("current_deadline", default=None)
+
+DEADLINES_EXCEEDED = REGISTRY.counter("model_deadline_exceeded_total",
+                                      "Model calls not started or retried because the deadline had passed")
+
+
+class DeadlineExceeded(Exception):
+    """Raised when the request's deadline passes before its model calls are done"""
+
+
+@contextmanager
+def deadline_scope(seconds: Optional[float]):
+    """Give the block ``seconds`` to finish; an enclosing, tighter deadline still wins"""
+    if seconds is None:
+        yield
+        return
+    deadline = time.perf_counter() + seconds
+    outer = current_deadline.get()
+    token = current_deadline.set(deadline if outer is None else min(outer, deadline))
+    try:
+        yield
+    finally:
+        current_deadline.reset(token)
+
+
+def time_left() -> Optional[float]:
+    """Seconds until the current deadline, None without one"""
+    deadline = current_deadline.get()
+    return None if deadline is None else deadline - time.perf_counter()
+
+
+def check_deadline():
+    left = time_left()
+    if left is not None and left <= 0:
+        DEADLINES_EXCEEDED.inc()
+        raise DeadlineExceeded(f"Deadline exceeded by {-1000 * left:.0f} ms")
+
+
+def call_timeout(timeout: float) -> httpx.Timeout:
+    """The timeout for one attempt: ``timeout``, or less if the deadline is closer"""
+    check_deadline()
+    left = time_left()
+    if left is not None:
+        timeout = min(timeout, left)
+    return httpx.Timeout(timeout, connect=min(timeout, CONNECT_TIMEOUT))
+
+
+def deadline_headers(headers: Dict[str, str]) -> Dict[str, str]:
+    left = time_left()
+    return headers if left is None else {**headers, DEADLINE_HEADER: str(max(int(1000 * left), 0))}
+
+
+def http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def make_client(max_connections: int = 16, timeout: float = 60.0, http2: bool = True) -> httpx.AsyncClient:
+    """The pooled client every model call shares; HTTP/2 only if ``h2`` is installed"""
+    return httpx.AsyncClient(
+        timeout=timeout,
+        http2=http2 and http2_available(),
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+    )
+
+
+def compressible(content_type: str) -> bool:
+    return content_type.split(";")[0].strip().lower() not in COMPRESSED_TYPES
+
+
+async def gzip_chunks(chunks: AsyncIterator[bytes], level: int = 6) -> AsyncIterator[bytes]:
+    """Compress a streamed body as it is sent"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    async for chunk in chunks:
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+def gzip_headers(headers: Dict[str, str]) -> Dict[str, str]:
+    # The compressed length isn't known up front, so the body goes chunked
+    headers = {k: v for k, v in headers.items() if k.lower() != "content-length"}
+    return {**headers, "Content-Encoding": "gzip"}
+
+
+class ChatCompletions:
+    """An OpenAI-style ``/chat/completions`` endpoint, called over the shared client"""
+
+    def __init__(self, url: str, model: str, api_key: Optional[str] = None, timeout: float = 60.0,
+                 gzip: bool = False, max_tokens: Optional[int] = None):
+        self.url = url
+        self.model = model
+        self.timeout = timeout
+        self.gzip = gzip
+        self.max_tokens = max_tokens
+        self.headers = {"Content-Type": "application/json"}
+        if api_key:
+            self.headers["Authorization"] = f"Bearer {api_key}"
+
+    def body(self, messages: List[Dict[str, Any]], **params) -> Tuple[bytes, Dict[str, str]]:
+        request = {"model": self.model, "messages": messages, **params}
+        if self.max_tokens is not None:
+            request.setdefault("max_tokens", self.max_tokens)
+        body = json.dumps(request).encode()
+        if self.gzip:
+            return zlib.compress(body, wbits=31), {**self.headers, "Content-Encoding": "gzip"}
+        return body, self.headers
+
+    async def complete(self, client: httpx.AsyncClient, messages: List[Dict[str, Any]], **params) -> str:
+        """The first choice's message content"""
+        body, headers = self.body(messages, **params)
+        response = await client.post(self.url, content=body, headers=deadline_headers(headers),
+                                     timeout=call_timeout(self.timeout))
+        response.raise_for_status()
+        return response.json()["choices"][0]["message"]["content"]
+
+
+# --- Model server side ---
+def request_deadline(headers, received: Optional[float] = None) -> Optional[float]:
+    """The perf_counter() time by which the caller wants an answer, from ``X-Request-Deadline-Ms``"""
+    value = headers.get(DEADLINE_HEADER.lower())
+    if not value:
+        return None
+    try:
+        return (received if received is not None else time.perf_counter()) + float(value) / 1000
+    except ValueError:
+        return None
+
+
+INFLATE_STEP = 1024 * 1024
+
+
+class GzipRequestMiddleware:
+    """ASGI middleware: inflate request bodies sent with ``Content-Encoding: gzip``.
+
+    The body is decompressed as it arrives, at most ``INFLATE_STEP`` bytes
+    per message handed to the app (a chunk that inflates further is passed
+    on in several), so memory stays bounded whatever the compression ratio.
+    More than ``max_bytes`` inflated is refused with 413.
+    """
+
+    def __init__(self, app, max_bytes: int = 200 * 1024 * 1024):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        headers = dict(scope.get("headers") or []) if scope["type"] == "http" else {}
+        if headers.get(b"content-encoding", b"").lower() != b"gzip":
+            await self.app(scope, receive, send)
+            return
+
+        scope = {**scope, "headers": [(k, v) for k, v in scope["headers"]
+                                      if k not in (b"content-encoding", b"content-length")]}
+        decompressor = zlib.decompressobj(31)
+        inflated = 0
+        received_all = False
+
+        async def next_chunk():
+            nonlocal received_all
+            # Input a capped call left over is inflated before more is read
+            if decompressor.unconsumed_tail:
+                return {"type": "http.request", "body": decompressor.unconsumed_tail, "more_body": not received_all}
+            message = await receive()
+            if message["type"] == "http.request" and not message.get("more_body", False):
+                received_all = True
+            return message
+
+        def inflate(message):
+            nonlocal inflated
+            room = self.max_bytes - inflated
+            try:
+                # Capped output: a few KB of zeros would otherwise inflate to gigabytes in one call
+                body = decompressor.decompress(message.get("body", b""), min(room + 1, INFLATE_STEP))
+                done = not message.get("more_body", False) and not decompressor.unconsumed_tail
+                if done and len(body) <= room:
+                    # All input is consumed, so this only drains zlib's window
+                    body += decompressor.flush()
+            except zlib.error:
+                raise Refused(400, "Invalid gzip body")
+            if len(body) > room:
+                raise Refused(413, f"Request body inflates to more than {self.max_bytes} bytes")
+            if done and not decompressor.eof:
+                raise Refused(400, "Truncated gzip body")
+            inflated += len(body)
+            return {**message, "body": body, "more_body": not done}
+
+        await call_checked(self.app, scope, next_chunk, send, inflate)
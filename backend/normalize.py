@@ -0,0 +1,134 @@
+"""Shrink uploaded images before they cross the network to the model server.
+
+Phone photos of receipts arrive as 8-12 MB JPEGs at resolutions the model
+server downsamples anyway (``inference.regions`` fits every crop to 1280 px).
+``ImageNormalizer`` applies the EXIF orientation, scales the longest side
+down to ``max_side``, optionally converts to grayscale and stretches the
+contrast, and re-encodes as JPEG or WebP at ``quality``. The work is CPU
+bound, so it runs in a process pool and never on the event loop.
+
+The original file is sent unchanged when it is not an image, cannot be
+decoded, or when re-encoding would not make it smaller and there is no
+rotation to apply. PDFs are left alone here; the router rasterizes the
+pages it sends to the model itself.
+"""
+import asyncio
+import io
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from .metrics import REGISTRY, span
+from .uploads import UploadPayload
+
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png", ".webp", ".tif", ".tiff", ".bmp", ".gif", ".heic")
+CONTENT_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+SUFFIXES = {"JPEG": ".jpg", "WEBP": ".webp"}
+
+NORMALIZE_BYTES = REGISTRY.counter("normalize_bytes_total", "Image bytes before and after normalization",
+                                   ["direction"])
+
+
+@dataclass(frozen=True)
+class NormalizeOptions:
+    max_side: int = 2048  # longest side in pixels; the model server crops, then fits crops to 1280
+    format: str = "JPEG"  # or "WEBP"
+    quality: int = 80
+    grayscale: bool = False
+    autocontrast: bool = False
+
+
+def normalize_image(data: bytes, options: NormalizeOptions) -> Optional[bytes]:
+    """Re-encoded image, or None to send the original; runs in a pool worker"""
+    from PIL import Image, ImageOps
+
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            # JPEG draft mode decodes at 1/2, 1/4 or 1/8 scale straight from the DCT
+            scale = min(options.max_side / max(image.size), 1.0)
+            image.draft("RGB", (int(image.width * scale), int(image.height * scale)))
+            orientation = image.getexif().get(0x0112, 1)
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((options.max_side, options.max_side), Image.Resampling.LANCZOS)
+            if options.grayscale:
+                image = image.convert("L")
+            elif image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            if options.autocontrast:
+                image = ImageOps.autocontrast(image, cutoff=1)
+            buffer = io.BytesIO()
+            image.save(buffer, options.format, quality=options.quality, optimize=options.format == "JPEG")
+    except Exception:
+        return None
+
+    encoded = buffer.getvalue()
+    if len(encoded) >= len(data) and orientation == 1:
+        return None
+    return encoded
+
+
+class ImageNormalizer:
+    """Runs ``normalize_image`` for uploads on a shared process pool"""
+
+    def __init__(self, options: Optional[NormalizeOptions] = None, workers: int = 2,
+                 executor: Optional[Executor] = None):
+        self.options = options or NormalizeOptions()
+        self.workers = workers
+        self._executor = executor
+        self._own_executor = executor is None
+        self.counts = {"normalized": 0, "skipped": 0, "bytesIn": 0, "bytesOut": 0, "ms": 0.0}
+
+    def applies_to(self, payload: UploadPayload) -> bool:
+        return payload.content_type.startswith("image/") or payload.filename.lower().endswith(IMAGE_SUFFIXES)
+
+    def start(self):
+        """Spawn the workers and import Pillow in them before the first upload arrives"""
+        if self._executor is None:
+            # Spawned, not forked: a forked worker would inherit the server's listening socket
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+        for _ in range(self.workers):
+            self._executor.submit(normalize_image, b"", self.options)
+
+    async def normalize(self, payload: UploadPayload) -> UploadPayload:
+        """A payload holding the normalized image, or ``payload`` itself if nothing was gained"""
+        if not self.applies_to(payload):
+            return payload
+        if self._executor is None:
+            self.start()
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        with span("normalize"):
+            data = await payload.read()
+            encoded = await loop.run_in_executor(self._executor, normalize_image, data, self.options)
+        self.counts["ms"] += 1000 * (loop.time() - started)
+        if encoded is None:
+            self.counts["skipped"] += 1
+            return payload
+
+        self.counts["normalized"] += 1
+        self.counts["bytesIn"] += len(data)
+        self.counts["bytesOut"] += len(encoded)
+        NORMALIZE_BYTES.inc(len(data), direction="in")
+        NORMALIZE_BYTES.inc(len(encoded), direction="out")
+        stem = payload.filename.rsplit(".", 1)[0]
+        return UploadPayload(stem + SUFFIXES[self.options.format], io.BytesIO(encoded), len(encoded),
+                             CONTENT_TYPES[self.options.format])
+
+    def close(self):
+        if self._own_executor and self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        calls = self.counts["normalized"] + self.counts["skipped"]
+        saved = self.counts["bytesIn"] - self.counts["bytesOut"]
+        return {
+            **self.counts,
+            "ms": round(self.counts["ms"], 1),
+            "avgMs": round(self.counts["ms"] / calls, 2) if calls else None,
+            "bytesSaved": saved,
+            "ratio": round(self.counts["bytesOut"] / self.counts["bytesIn"], 3) if self.counts["bytesIn"] else None,
+            "options": vars(self.options),
+        }
@@ -0,0 +1,207 @@
+"""Multi-page documents on the vision path: split, extract pages concurrently, merge.
+
+The model server reads one image per request, so a scanned PDF (or
+multi-frame TIFF) is rendered page by page and every page goes out as its
+own PNG. Pages are rendered on worker threads and sent as soon as they are
+ready, at most ``concurrency`` per document; pages that reach the model
+server together share a generate call through its micro-batcher.
+
+Per-page fields are merged into one invoice record: header fields (vendor,
+invoice number, dates, ...) come from the first page that has them, totals
+from the last, and line items are concatenated in page order. Pages the
+model answered in free text are kept under ``raw``.
+
+The document is opened once per request. A single-page one skips the
+split and merge. Past ``max_pages``, the first ``max_pages - 1`` pages and
+the last one are extracted, so the totals still come from the real last
+page; the result says so in ``warning``, with ``pagesTotal`` and
+``pagesProcessed``.
+"""
+import asyncio
+import io
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+from .metrics import REGISTRY, span
+from .uploads import UploadPayload
+
+# Printed at the end of the document; everything else is a header field
+TOTAL_FIELDS = ("total_amount", "tax_amount", "subtotal", "amount_due", "balance_due")
+
+PAGE_SECONDS = REGISTRY.histogram("invoice_page_seconds", "Render plus model time per document page")
+
+
+def _kind(payload: UploadPayload) -> Optional[str]:
+    name = payload.filename.lower()
+    if name.endswith(".pdf") or payload.content_type == "application/pdf":
+        return "pdf"
+    if name.endswith((".tif", ".tiff")) or payload.content_type == "image/tiff":
+        return "tiff"
+    return None
+
+
+class PageSource:
+    """A document opened once per request, whose pages are rendered to PNG on worker threads.
+
+    Renders are serialized: neither PyMuPDF documents nor Pillow images may
+    be used from two threads at once.
+    """
+
+    def __init__(self, data: bytes, kind: str):
+        self.kind = kind
+        self._lock = threading.Lock()
+        if kind == "pdf":
+            import fitz  # PyMuPDF
+
+            self._doc = fitz.open(stream=data, filetype="pdf")
+            self.count = self._doc.page_count
+        else:
+            from PIL import Image
+
+            self._doc = Image.open(io.BytesIO(data))
+            self.count = getattr(self._doc, "n_frames", 1)
+
+    def render(self, number: int, dpi: int) -> bytes:
+        """PNG of one 1-based page"""
+        with self._lock:
+            if self.kind == "pdf":
+                return self._doc[number - 1].get_pixmap(dpi=dpi).tobytes("png")
+            self._doc.seek(number - 1)
+            buffer = io.BytesIO()
+            self._doc.convert("RGB").save(buffer, "PNG")
+            return buffer.getvalue()
+
+    def close(self):
+        self._doc.close()
+
+
+def page_numbers(total: int, max_pages: int) -> List[int]:
+    """The pages to extract: all of them, or the first ``max_pages - 1`` and the last, which has the totals"""
+    if total <= max_pages:
+        return list(range(1, total + 1))
+    return list(range(1, max_pages)) + [total] if max_pages > 1 else [1]
+
+
+def merge_page_fields(pages: Sequence[Any]) -> Dict[str, Any]:
+    """One record from per-page ``extractedFields``; pages answered in free text are kept under ``raw``"""
+    merged: Dict[str, Any] = {}
+    raw = [str(p) for p in pages if p is not None and not isinstance(p, dict)]
+    for page in pages:
+        if not isinstance(page, dict):
+            continue
+        for key, value in page.items():
+            if key == "line_items":
+                merged[key] = list(merged.get(key) or []) + list(value or [])
+            elif key in TOTAL_FIELDS:
+                if value not in (None, ""):
+                    merged[key] = value  # the last page that has it wins
+                else:
+                    merged.setdefault(key, None)
+            elif merged.get(key) in (None, ""):
+                merged[key] = value  # the first page that has it wins
+    if raw:
+        merged["raw"] = "\n\n".join(raw)
+    return merged
+
+
+class PagePipeline:
+    """Sends each page of a multi-page document to the model and merges the results"""
+
+    def __init__(self, dpi: int = 200, concurrency: int = 4, max_pages: int = 50):
+        self.dpi = dpi
+        self.concurrency = concurrency
+        self.max_pages = max_pages
+        self.documents = 0
+        self.pages = 0
+        self.truncated = 0  # documents longer than max_pages
+
+    def applies_to(self, payload: UploadPayload) -> bool:
+        return _kind(payload) is not None
+
+    async def process(self, payload: UploadPayload, prompt: str,
+                      send_page: Callable[[UploadPayload], Awaitable[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+        """Extract every page with ``send_page`` and return the merged result.
+
+        None for a single-frame TIFF: it is an ordinary image and goes to the
+        model as it is.
+        """
+        kind = _kind(payload)
+        started = time.perf_counter()
+        with span("split"):
+            data = await payload.read()
+            source = await asyncio.to_thread(PageSource, data, kind)
+        try:
+            total = source.count
+            if total == 1:
+                self.documents += 1
+                self.pages += 1
+                if kind == "tiff":
+                    return None
+                # Nothing to split or merge, but the model reads images: render the one page
+                with span("render"):
+                    png = await asyncio.to_thread(source.render, 1, self.dpi)
+                page = UploadPayload(f"{payload.filename}#page1.png", io.BytesIO(png), len(png), "image/png")
+                return {**await send_page(page), "fileName": payload.filename, "promptUsed": prompt}
+            return await self._split(payload, prompt, send_page, source, started)
+        finally:
+            source.close()
+
+    async def _split(self, payload: UploadPayload, prompt: str,
+                     send_page: Callable[[UploadPayload], Awaitable[Dict[str, Any]]], source: PageSource,
+                     started: float) -> Dict[str, Any]:
+        total = source.count
+        numbers = page_numbers(total, self.max_pages)
+        limit = asyncio.Semaphore(self.concurrency)
+
+        async def one(number: int) -> Dict[str, Any]:
+            async with limit:
+                page_started = time.perf_counter()
+                try:
+                    with span("render"):
+                        png = await asyncio.to_thread(source.render, number, self.dpi)
+                    page = UploadPayload(f"{payload.filename}#page{number}.png", io.BytesIO(png), len(png), "image/png")
+                    result = await send_page(page)
+                except Exception as e:
+                    result = {"error": str(e)}
+                seconds = time.perf_counter() - page_started
+                PAGE_SECONDS.observe(seconds)
+                # Every page repeats the document's prompt; keep only what differs
+                return {"page": number, "ms": round(1000 * seconds, 1),
+                        **{k: v for k, v in result.items() if k not in ("fileName", "promptUsed")}}
+
+        if not numbers:
+            raise RuntimeError("document has no pages")
+        pages = await asyncio.gather(*(one(n) for n in numbers))
+        self.documents += 1
+        self.pages += len(pages)
+
+        failed = [p["page"] for p in pages if "error" in p]
+        if len(failed) == len(pages):
+            raise RuntimeError(f"all {len(pages)} pages failed: {pages[0]['error']}")
+        page_ms = sorted(p["ms"] for p in pages)
+        result = {
+            "fileName": payload.filename,
+            "promptUsed": prompt,
+            "extractedFields": merge_page_fields([p.get("extractedFields") for p in pages]),
+            "rawResponse": {"source": "pages", "pages": total, "processedPages": len(pages),
+                            "failedPages": failed},
+            "pagesTotal": total,
+            "pagesProcessed": len(pages),
+            "pages": pages,
+            "pageTiming": {
+                "p50": page_ms[len(page_ms) // 2],
+                "max": page_ms[-1],
+                "totalMs": round(1000 * (time.perf_counter() - started), 1),
+            },
+        }
+        if len(numbers) < total:
+            self.truncated += 1
+            skipped = f"{numbers[-2] + 1}-{total - 1}" if len(numbers) > 1 else f"2-{total}"
+            result["warning"] = (f"Only {len(numbers)} of {total} pages were extracted (MAX_PAGES); "
+                                 f"pages {skipped} were skipped, so line items are incomplete")
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {"documents": self.documents, "pages": self.pages, "truncated": self.truncated, "dpi": self.dpi,
+                "concurrency": self.concurrency, "maxPages": self.max_pages}
@@ -0,0 +1,506 @@
+"""Persistent store of extracted invoices, queryable by their fields.
+
+Results otherwise only live in the JSON sent back to the browser. Every
+successful extraction is written to a SQLite file: one ``invoices`` row per
+file and a ``line_items`` table. The header fields are stored typed so they
+can be filtered and summed: dates as ISO ``YYYY-MM-DD`` text, amounts as
+numbers (``"$1,234.50"`` -> ``1234.5``), the currency taken from the amount's
+symbol or code. The untouched extraction is kept as JSON alongside.
+
+``vendor_name``, ``invoice_number``, ``invoice_date`` and ``total_amount``
+are indexed; the vendor and date indexes also carry the amounts, so totals
+per vendor or month are answered from the index alone. Pages are fetched
+with a keyset cursor rather than OFFSET, so page 10,000 costs what page 1
+does. The database runs in WAL mode: queries read through their own
+connections while extractions are being written.
+
+A file is keyed by its SHA-256; extracting it again replaces its row.
+Results linked to an earlier file as ``duplicateOf`` are not stored, so a
+re-scanned invoice is not counted twice.
+"""
+import base64
+import csv
+import io
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS invoices (
+    id INTEGER PRIMARY KEY,
+    file_sha256 TEXT NOT NULL UNIQUE,
+    file_name TEXT,
+    processed_at REAL NOT NULL,
+    vendor_name TEXT COLLATE NOCASE,
+    invoice_number TEXT,
+    invoice_date TEXT,
+    due_date TEXT,
+    total_amount REAL,
+    tax_amount REAL,
+    currency TEXT,
+    fields TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS line_items (
+    invoice_id INTEGER NOT NULL REFERENCES invoices (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    description TEXT,
+    quantity REAL,
+    unit_price REAL,
+    total REAL,
+    PRIMARY KEY (invoice_id, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS invoices_vendor ON invoices (vendor_name, invoice_date, total_amount, tax_amount);
+CREATE INDEX IF NOT EXISTS invoices_number ON invoices (invoice_number);
+CREATE INDEX IF NOT EXISTS invoices_date ON invoices (invoice_date, total_amount, tax_amount);
+CREATE INDEX IF NOT EXISTS invoices_total ON invoices (total_amount);
+"""
+
+INVOICE_COLUMNS = ["id", "file_sha256", "file_name", "processed_at", "vendor_name", "invoice_number",
+                   "invoice_date", "due_date", "total_amount", "tax_amount", "currency"]
+LINE_ITEM_COLUMNS = ["invoice_id", "position", "description", "quantity", "unit_price", "total"]
+TABLES = {"invoices": INVOICE_COLUMNS, "line_items": LINE_ITEM_COLUMNS}
+SORTS = ("id", "invoice_date", "total_amount")  # keyset-pageable: each is indexed together with id
+GROUPS = {
+    "vendor_name": "vendor_name",
+    "currency": "currency",
+    "month": "substr(invoice_date, 1, 7)",
+    "year": "substr(invoice_date, 1, 4)",
+}
+MAX_PAGE_SIZE = 1000
+EXPORT_BATCH = 10000
+
+# Month-first wins for ambiguous dates such as 03/04/2024, as in the notebook's US invoices
+DATE_FORMATS = ("%Y-%m-%d", "%Y/%m/%d", "%m/%d/%Y", "%d/%m/%Y", "%m/%d/%y", "%d.%m.%Y", "%d-%m-%Y",
+                "%B %d, %Y", "%b %d, %Y", "%B %d %Y", "%b %d %Y", "%d %B %Y", "%d %b %Y")
+# A minus before the first digit
+LEADING_MINUS = re.compile(r"\D*?-")
+CURRENCY_SYMBOLS = {"$": "USD", "€": "EUR", "£": "GBP", "¥": "JPY", "₹": "INR"}
+# Keys the model uses for line item columns; the frontend asks for the item_* names
+LINE_ITEM_KEYS = {
+    "description": ("description", "item_description", "item", "name"),
+    "quantity": ("quantity", "item_quantity", "qty"),
+    "unit_price": ("unit_price", "item_unit_price", "price", "rate"),
+    "total": ("total", "item_total", "amount", "line_total"),
+}
+
+
+# --- Parsing extracted values ---
+def parse_date(value: Any) -> Optional[str]:
+    """``YYYY-MM-DD``, or None if the value is not a date in a known format"""
+    if not isinstance(value, str) or not value.strip():
+        return None
+    text = " ".join(value.replace(",", ", ").split()).replace(" ,", ",").rstrip(".")
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).strftime("%Y-%m-%d")
+        except ValueError:
+            pass
+    return None
+
+
+def parse_amount(value: Any) -> Optional[float]:
+    """The number in ``"$1,234.50"``, ``"1.234,50 EUR"``, ``"(12.00)"`` etc.; None if there is none.
+
+    Negative when wrapped in parentheses or when a minus comes before the
+    number (``"-$12.00"``, ``"USD -12.00"``); a dash after it, as in
+    ``"12.00 - paid"``, is not a sign.
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not isinstance(value, str):
+        return None
+    negative = value.strip().startswith("(") or LEADING_MINUS.match(value) is not None
+    digits = re.sub(r"[^\d.,]", "", value)
+    if not re.search(r"\d", digits):
+        return None
+    if "," in digits and "." in digits:
+        # Whichever separator comes last is the decimal point
+        if digits.rfind(",") > digits.rfind("."):
+            digits = digits.replace(".", "").replace(",", ".")
+        else:
+            digits = digits.replace(",", "")
+    elif "," in digits:
+        head, _, tail = digits.rpartition(",")
+        # "1,234" is a thousand and more; "12,50" / "12,5" a decimal comma
+        digits = digits.replace(",", "") if len(tail) == 3 else f"{head.replace(',', '')}.{tail}"
+    elif digits.count(".") > 1:
+        digits = digits.replace(".", "")
+    try:
+        number = float(digits)
+    except ValueError:
+        return None
+    return -number if negative else number
+
+
+def parse_currency(*values: Any) -> Optional[str]:
+    """ISO code from the first value with a currency symbol or a three-letter code"""
+    for value in values:
+        if not isinstance(value, str):
+            continue
+        code = re.search(r"\b([A-Z]{3})\b", value)
+        if code:
+            return code.group(1)
+        for symbol, iso in CURRENCY_SYMBOLS.items():
+            if symbol in value:
+                return iso
+    return None
+
+
+def _item_value(item: Dict[str, Any], column: str) -> Any:
+    return next((item[k] for k in LINE_ITEM_KEYS[column] if item.get(k) not in (None, "")), None)
+
+
+def invoice_row(sha256: str, result: Dict[str, Any]) -> Optional[Tuple[Dict[str, Any], List[Dict[str, Any]]]]:
+    """``(invoice columns, line items)`` for a result, or None if it holds no fields"""
+    fields = result.get("extractedFields")
+    if isinstance(fields, str):
+        try:
+            fields = json.loads(fields)
+        except ValueError:
+            return None
+    if not isinstance(fields, dict):
+        return None
+    vendor = fields.get("vendor_name")
+    number = fields.get("invoice_number")
+    invoice = {
+        "file_sha256": sha256,
+        "file_name": result.get("fileName"),
+        "processed_at": time.time(),
+        "vendor_name": str(vendor).strip() if vendor not in (None, "") else None,
+        "invoice_number": str(number).strip() if number not in (None, "") else None,
+        "invoice_date": parse_date(fields.get("invoice_date")),
+        "due_date": parse_date(fields.get("due_date")),
+        "total_amount": parse_amount(fields.get("total_amount")),
+        "tax_amount": parse_amount(fields.get("tax_amount")),
+        "currency": (fields.get("currency") if isinstance(fields.get("currency"), str) else None)
+                    or parse_currency(fields.get("total_amount"), fields.get("tax_amount")),
+        "fields": json.dumps(fields),
+    }
+    items = []
+    raw_items = fields.get("line_items")
+    for position, item in enumerate(raw_items if isinstance(raw_items, list) else []):
+        if not isinstance(item, dict):
+            continue
+        description = _item_value(item, "description")
+        items.append({
+            "position": position,
+            "description": str(description) if description is not None else None,
+            "quantity": parse_amount(_item_value(item, "quantity")),
+            "unit_price": parse_amount(_item_value(item, "unit_price")),
+            "total": parse_amount(_item_value(item, "total")),
+        })
+    return invoice, items
+
+
+# --- Queries ---
+@dataclass
+class InvoiceQuery:
+    """Filters over the indexed invoice fields; unset filters match everything"""
+    vendor_name: Optional[str] = None  # exact, case-insensitive
+    vendor_prefix: Optional[str] = None  # case-insensitive
+    invoice_number: Optional[str] = None
+    date_from: Optional[str] = None  # inclusive, YYYY-MM-DD
+    date_to: Optional[str] = None  # inclusive
+    min_total: Optional[float] = None
+    max_total: Optional[float] = None
+    currency: Optional[str] = None
+
+    def where(self) -> Tuple[List[str], List[Any]]:
+        clauses, params = [], []
+        if self.vendor_name is not None:
+            clauses.append("vendor_name = ?")
+            params.append(self.vendor_name)
+        if self.vendor_prefix:
+            # A range rather than LIKE, so the NOCASE index is used whatever the prefix holds
+            clauses.append("vendor_name >= ? AND vendor_name < ?")
+            params += [self.vendor_prefix, self.vendor_prefix + "\U0010ffff"]
+        if self.invoice_number is not None:
+            clauses.append("invoice_number = ?")
+            params.append(self.invoice_number)
+        for column, op, value in (("invoice_date", ">=", self.date_from), ("invoice_date", "<=", self.date_to),
+                                  ("total_amount", ">=", self.min_total), ("total_amount", "<=", self.max_total)):
+            if value is not None:
+                clauses.append(f"{column} {op} ?")
+                params.append(value)
+        if self.currency is not None:
+            clauses.append("currency = ?")
+            params.append(self.currency.upper())
+        return clauses, params
+
+
+def encode_cursor(value: Any, row_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([value, row_id]).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Any, int]:
+    try:
+        value, row_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return value, int(row_id)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+
+def _segments(sort: str, descending: bool, cursor: Optional[Tuple[Any, int]]) -> List[Tuple[str, List[Any]]]:
+    """Conditions for the rows after ``cursor``, one per run of the sort order.
+
+    SQLite sorts NULLs first, so an ascending walk over a nullable column
+    covers the NULL rows (ordered by id) before the others, a descending one
+    after. Each run is a range over the ``(column, id)`` index.
+    """
+    before = "<" if descending else ">"
+    if sort == "id":
+        return [(f"id {before} ?", [cursor[1]]) if cursor else ("1", [])]
+    values, nulls = (f"{sort} IS NOT NULL", []), (f"{sort} IS NULL", [])
+    if cursor is None:
+        return [values, nulls] if descending else [nulls, values]
+    if cursor[0] is None:
+        after = (f"{sort} IS NULL AND id {before} ?", [cursor[1]])
+        return [after] if descending else [after, values]
+    after = (f"({sort}, id) {before} (?, ?)", list(cursor))
+    return [after, nulls] if descending else [after]
+
+
+class ResultStore:
+    """Invoices and line items in a SQLite file, written as extractions finish"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.counts = {"stored": 0, "replaced": 0, "skipped": 0, "failed": 0}
+        self._local = threading.local()
+        self._readers: List[sqlite3.Connection] = []  # every thread's, so close() can close them
+        self._write_lock = threading.Lock()
+        self._db = self._connect()
+        self._db.executescript(SCHEMA)
+        self._db.commit()
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.db_path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode = WAL")
+        db.execute("PRAGMA synchronous = NORMAL")  # durable at checkpoints; a crash loses the last moments at most
+        db.execute("PRAGMA foreign_keys = ON")
+        db.row_factory = sqlite3.Row
+        return db
+
+    def _reader(self) -> sqlite3.Connection:
+        # One connection per worker thread: WAL readers don't block the writer or each other
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = self._connect()
+            with self._write_lock:
+                self._readers.append(db)
+        return db
+
+    # --- Writing ---
+    def write(self, entries: Iterable[Tuple[str, Dict[str, Any]]]) -> int:
+        """Store ``(file sha256, result)`` pairs in one transaction; returns how many were stored"""
+        stored = 0
+        with self._write_lock, self._db:
+            for sha256, result in entries:
+                if "error" in result or result.get("duplicateOf"):
+                    self.counts["skipped"] += 1
+                    continue
+                row = invoice_row(sha256, result)
+                if row is None:
+                    self.counts["skipped"] += 1
+                    continue
+                invoice, items = row
+                replaced = self._db.execute("DELETE FROM invoices WHERE file_sha256 = ?", (sha256,)).rowcount
+                invoice_id = self._db.execute(
+                    f"INSERT INTO invoices ({', '.join(invoice)}) VALUES ({', '.join('?' * len(invoice))})",
+                    list(invoice.values()),
+                ).lastrowid
+                self._db.executemany(
+                    "INSERT INTO line_items (invoice_id, position, description, quantity, unit_price, total) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [(invoice_id, i["position"], i["description"], i["quantity"], i["unit_price"], i["total"])
+                     for i in items],
+                )
+                self.counts["replaced" if replaced else "stored"] += 1
+                stored += 1
+        return stored
+
+    def add(self, sha256: str, result: Dict[str, Any]) -> bool:
+        """Store one result; a failed write is counted, never raised into the extraction"""
+        try:
+            return self.write([(sha256, result)]) > 0
+        except sqlite3.Error:
+            self.counts["failed"] += 1
+            return False
+
+    # --- Reading ---
+    def page(self, query: InvoiceQuery, sort: str = "id", descending: bool = True, limit: int = 50,
+             cursor: Optional[str] = None, line_items: bool = False) -> Dict[str, Any]:
+        """One page of matching invoices and the cursor for the next (None on the last page)"""
+        if sort not in SORTS:
+            raise ValueError(f"sort must be one of {SORTS}")
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        clauses, params = query.where()
+        direction = "DESC" if descending else "ASC"
+        db = self._reader()
+        rows: List[sqlite3.Row] = []
+        for condition, condition_params in _segments(sort, descending, decode_cursor(cursor) if cursor else None):
+            order = "id" if sort == "id" else f"{sort} {direction}, id"
+            rows += db.execute(
+                f"SELECT {', '.join(INVOICE_COLUMNS)}, fields FROM invoices "
+                f"WHERE {' AND '.join(clauses + [condition])} ORDER BY {order} {direction} LIMIT ?",
+                params + condition_params + [limit + 1 - len(rows)],
+            ).fetchall()
+            if len(rows) > limit:
+                break
+        invoices = [self._invoice(row) for row in rows[:limit]]
+        if line_items:
+            self._attach_items(db, invoices)
+        last = invoices[-1] if len(rows) > limit else None
+        return {"invoices": invoices,
+                "nextCursor": encode_cursor(last[sort], last["id"]) if last is not None else None}
+
+    def get(self, invoice_id: int) -> Optional[Dict[str, Any]]:
+        db = self._reader()
+        row = db.execute(f"SELECT {', '.join(INVOICE_COLUMNS)}, fields FROM invoices WHERE id = ?",
+                         (invoice_id,)).fetchone()
+        if row is None:
+            return None
+        invoice = self._invoice(row)
+        self._attach_items(db, [invoice])
+        return invoice
+
+    @staticmethod
+    def _invoice(row: sqlite3.Row) -> Dict[str, Any]:
+        invoice = {column: row[column] for column in INVOICE_COLUMNS}
+        invoice["fields"] = json.loads(row["fields"])
+        return invoice
+
+    @staticmethod
+    def _attach_items(db: sqlite3.Connection, invoices: List[Dict[str, Any]]):
+        by_id = {invoice["id"]: invoice for invoice in invoices}
+        for invoice in invoices:
+            invoice["line_items"] = []
+        if not by_id:
+            return
+        for row in db.execute(
+            f"SELECT {', '.join(LINE_ITEM_COLUMNS)} FROM line_items "
+            f"WHERE invoice_id IN ({', '.join('?' * len(by_id))}) ORDER BY invoice_id, position",
+            list(by_id),
+        ):
+            by_id[row["invoice_id"]]["line_items"].append({c: row[c] for c in LINE_ITEM_COLUMNS[1:]})
+
+    def aggregate(self, query: InvoiceQuery, group_by: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """Count and amount totals of the matching invoices, overall or per group.
+
+        Amounts are summed as extracted, whatever their currency; group or
+        filter by ``currency`` to keep them apart.
+        """
+        if group_by is not None and group_by not in GROUPS:
+            raise ValueError(f"group_by must be one of {tuple(GROUPS)}")
+        clauses, params = query.where()
+        key = GROUPS[group_by] if group_by else "NULL"
+        sql = (f"SELECT {key} AS grp, COUNT(*) AS invoices, SUM(total_amount) AS total_amount, "
+               "SUM(tax_amount) AS tax_amount, AVG(total_amount) AS avg_total, "
+               "MIN(total_amount) AS min_total, MAX(total_amount) AS max_total, "
+               "MIN(invoice_date) AS first_date, MAX(invoice_date) AS last_date FROM invoices")
+        if clauses:
+            sql += f" WHERE {' AND '.join(clauses)}"
+        if group_by:
+            # The biggest vendors first; months and years in calendar order
+            sql += f" GROUP BY grp ORDER BY {'total_amount DESC' if group_by == 'vendor_name' else 'grp'} LIMIT ?"
+            params = params + [max(1, limit)]
+        rows = self._reader().execute(sql, params).fetchall()
+        groups = []
+        for row in rows:
+            group = {name: row[name] for name in row.keys() if name != "grp"}
+            for name in ("total_amount", "tax_amount", "avg_total", "min_total", "max_total"):
+                if group[name] is not None:
+                    group[name] = round(group[name], 2)
+            groups.append({group_by: row["grp"], **group} if group_by else group)
+        return groups
+
+    # --- Export ---
+    def iter_rows(self, query: InvoiceQuery, table: str = "invoices") -> Iterator[List[Tuple]]:
+        """Batches of rows of ``table`` for the matching invoices, in id order, on a connection of its own"""
+        if table not in TABLES:
+            raise ValueError(f"table must be one of {tuple(TABLES)}")
+        clauses, params = query.where()
+        db = self._connect()
+        db.row_factory = None
+        try:
+            after = 0
+            while True:
+                if table == "invoices":
+                    batch = db.execute(f"SELECT {', '.join(INVOICE_COLUMNS)} FROM invoices "
+                                       f"WHERE {' AND '.join(clauses + ['id > ?'])} ORDER BY id LIMIT ?",
+                                       params + [after, EXPORT_BATCH]).fetchall()
+                    if not batch:
+                        return
+                    after = batch[-1][0]
+                else:
+                    ids = [r[0] for r in db.execute(
+                        f"SELECT id FROM invoices WHERE {' AND '.join(clauses + ['id > ?'])} ORDER BY id LIMIT ?",
+                        params + [after, EXPORT_BATCH])]
+                    if not ids:
+                        return
+                    after = ids[-1]
+                    batch = db.execute(f"SELECT {', '.join(LINE_ITEM_COLUMNS)} FROM line_items "
+                                       f"WHERE invoice_id IN ({', '.join('?' * len(ids))}) "
+                                       "ORDER BY invoice_id, position", ids).fetchall()
+                yield batch
+        finally:
+            db.close()
+
+    def export_csv(self, query: InvoiceQuery, table: str = "invoices") -> Iterator[str]:
+        """CSV text of ``table``, header first, one chunk per batch"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(TABLES[table])
+        for batch in self.iter_rows(query, table):
+            writer.writerows(batch)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    def export_parquet(self, query: InvoiceQuery, path: str, table: str = "invoices") -> int:
+        """Write ``table`` to a Parquet file at ``path``; returns the row count"""
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Parquet export needs pyarrow: pip install pyarrow")
+        types = {"id": pa.int64(), "invoice_id": pa.int64(), "position": pa.int32(), "processed_at": pa.float64(),
+                 "total_amount": pa.float64(), "tax_amount": pa.float64(), "quantity": pa.float64(),
+                 "unit_price": pa.float64(), "total": pa.float64()}
+        schema = pa.schema([(c, types.get(c, pa.string())) for c in TABLES[table]])
+        rows = 0
+        with pq.ParquetWriter(path, schema) as writer:
+            for batch in self.iter_rows(query, table):
+                columns = list(zip(*batch))
+                writer.write_table(pa.table({c: list(v) for c, v in zip(schema.names, columns)}, schema=schema))
+                rows += len(batch)
+            if not rows:
+                writer.write_table(schema.empty_table())
+        return rows
+
+    def stats(self) -> Dict[str, Any]:
+        db = self._reader()
+        return {
+            **self.counts,
+            "invoices": db.execute("SELECT COUNT(*) FROM invoices").fetchone()[0],
+            "lineItems": db.execute("SELECT COUNT(*) FROM line_items").fetchone()[0],
+            "dbBytes": sum(os.path.getsize(p) for p in (self.db_path, self.db_path + "-wal")
+                           if os.path.exists(p)),
+        }
+
+    def close(self):
+        with self._write_lock:
+            readers, self._readers = self._readers, []
+            for db in readers:
+                db.close()
+            self._db.close()
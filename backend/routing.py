@@ -0,0 +1,269 @@
+import asyncio
+import io
+import json
+import re
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from .metrics import span
+from .model_http import ChatCompletions
+from .pages import merge_page_fields
+from .uploads import UploadPayload
+
+# --- Rule-based extraction for born-digital text ---
+DATE = r"(\d{4}-\d{2}-\d{2}|\d{1,2}[/.\-]\d{1,2}[/.\-]\d{2,4}|\d{1,2}\s+[A-Za-z]{3,9}\.?\s+\d{4}|[A-Za-z]{3,9}\.?\s+\d{1,2},?\s+\d{4})"
+AMOUNT = r"([$€£¥]?[ \t]?-?\d{1,3}(?:[, ]\d{3})*(?:\.\d{2})?(?:[ \t]?(?-i:[A-Z]{3})\b)?)"
+
+FIELD_PATTERNS = {
+    "invoice_number": r"invoice\s*(?:no\.?|number|num\.?|#)\s*[:#]?\s*([A-Z0-9][A-Z0-9\-/]{2,})",
+    "invoice_date": r"(?:invoice\s+date|date\s+of\s+issue|issue\s+date|date)\s*[:]?\s*" + DATE,
+    "due_date": r"(?:due\s+date|payment\s+due|due)\s*[:]?\s*" + DATE,
+    "total_amount": r"(?<!sub)(?<!sub\s)total(?:\s+(?:amount\s+)?due|\s+amount)?\s*[:]?\s*" + AMOUNT,
+    "tax_amount": r"(?:tax|vat|gst)(?:\s+amount)?(?:\s*\(?\d+(?:\.\d+)?%\)?)?\s*[:]?\s*" + AMOUNT,
+}
+# Totals are usually the last occurrence on the page; headers the first
+LAST_MATCH_FIELDS = {"total_amount", "tax_amount"}
+# Guessed from the layout rather than matched against a label: without a text
+# LLM to check them, a document whose guess fails goes to the vision model
+HEURISTIC_FIELDS = {"vendor_name"}
+# Lines that label, address or reach someone rather than name the vendor
+NOT_VENDOR_LINE = re.compile(
+    r"^(?:bill(?:ed)?|ship(?:ped)?|sold|remit|deliver(?:ed)?)\s+to\b|^(?:customer|client|attn|page)\b"
+    r"|invoice|statement|receipt|\bdate\b|\bdue\b|\btotal\b|\btax\b|\bvat\b"
+    r"|\b(?:tel|phone|fax|e-?mail)\b|@|www\.|https?://|:$",
+    re.IGNORECASE)
+VENDOR_LINES = 8  # the vendor heads the page; further down it's addresses and tables
+
+
+def guess_vendor(text: str) -> Optional[str]:
+    """The first header line that reads like a name: mostly letters, not a label, address or contact line"""
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    for line in lines[:VENDOR_LINES]:
+        letters = sum(c.isalpha() for c in line)
+        chars = len("".join(line.split()))
+        if NOT_VENDOR_LINE.search(line) or line[0].isdigit() or len(line) > 80 \
+                or letters < 2 or letters < 0.6 * chars:
+            continue
+        return line
+    return None
+
+
+def plausible(field: str, value: str) -> bool:
+    """Whether a rule match can stand as the field's value"""
+    if field in ("invoice_number", "total_amount", "tax_amount"):
+        return any(c.isdigit() for c in value)
+    if field in ("invoice_date", "due_date"):
+        numbers = [int(n) for n in re.findall(r"\d+", value)]
+        if re.fullmatch(r"\d{4}-\d{2}-\d{2}", value):
+            return 1 <= numbers[1] <= 12 and 1 <= numbers[2] <= 31
+        if re.fullmatch(r"\d{1,2}[/.\-]\d{1,2}[/.\-]\d{2,4}", value):
+            # Day and month in either order
+            return 1 <= min(numbers[:2]) <= 12 and max(numbers[:2]) <= 31
+    return True
+
+
+def extract_fields_from_text(text: str, fields: List[str]) -> Dict[str, Optional[str]]:
+    """Cheap regex extraction; fields it can't find, or finds only implausible values for, come back as None"""
+    extracted: Dict[str, Optional[str]] = {}
+    for field in fields:
+        value = None
+        if field == "vendor_name":
+            value = guess_vendor(text)
+        elif field in FIELD_PATTERNS:
+            matches = re.findall(FIELD_PATTERNS[field], text, re.IGNORECASE)
+            candidates = [m.strip() for m in (reversed(matches) if field in LAST_MATCH_FIELDS else matches)]
+            value = next((m for m in candidates if plausible(field, m)), None)
+        extracted[field] = value
+    return extracted
+
+
+# --- Text-layer inspection ---
+@dataclass
+class PageText:
+    number: int
+    text: str
+    chars: int
+    coverage: float  # fraction of the page area covered by text blocks
+
+
+def inspect_pdf(data: bytes) -> List[PageText]:
+    import fitz  # PyMuPDF
+
+    pages = []
+    with fitz.open(stream=data, filetype="pdf") as doc:
+        for page in doc:
+            area = page.rect.width * page.rect.height or 1.0
+            blocks = [b for b in page.get_text("blocks") if b[6] == 0 and b[4].strip()]
+            text = "\n".join(b[4] for b in blocks)
+            covered = sum((b[2] - b[0]) * (b[3] - b[1]) for b in blocks)
+            pages.append(PageText(
+                number=page.number + 1,
+                text=text,
+                chars=len("".join(text.split())),
+                coverage=min(covered / area, 1.0),
+            ))
+    return pages
+
+
+def render_pages(data: bytes, page_numbers: List[int], dpi: int) -> List[bytes]:
+    """PNG-encode the given 1-based pages"""
+    import fitz  # PyMuPDF
+
+    with fitz.open(stream=data, filetype="pdf") as doc:
+        return [doc[n - 1].get_pixmap(dpi=dpi).tobytes("png") for n in page_numbers]
+
+
+class DocumentRouter:
+    """Sends born-digital PDFs down a text path and only scanned pages to the vision model.
+
+    A page counts as born-digital when its text layer has at least
+    ``min_chars`` characters covering at least ``min_coverage`` of the page.
+    Text pages are extracted with regex rules, optionally refined by a
+    text-only chat-completions model at ``text_llm_url`` (a
+    ``model_http.ChatCompletions`` on the shared client) prompted with
+    ``InvoiceProcessor.generate_extraction_prompt``. If the rules find fewer
+    than ``min_rule_fields`` of the requested fields, or cannot place a
+    requested field they only guess from the layout (the vendor name), and
+    no LLM is set up, the document goes to the vision model after all.
+    """
+
+    def __init__(self, min_chars: int = 100, min_coverage: float = 0.02, min_rule_fields: float = 0.5,
+                 raster_dpi: int = 200, max_bytes: int = 20 * 1024 * 1024,
+                 text_llm_url: Optional[str] = None, text_llm_model: str = "gpt-4o-mini",
+                 text_llm_api_key: Optional[str] = None):
+        self.min_chars = min_chars
+        self.min_coverage = min_coverage
+        self.min_rule_fields = min_rule_fields
+        self.raster_dpi = raster_dpi
+        self.max_bytes = max_bytes
+        self.text_llm_url = text_llm_url
+        self.text_llm_model = text_llm_model
+        self.text_llm = ChatCompletions(text_llm_url, text_llm_model, text_llm_api_key) if text_llm_url else None
+        self._prompts = None  # InvoiceProcessor, created on first text-LLM call
+        # Running average of real vision-model latency, used to estimate time saved
+        self.vision_ms: Optional[float] = None
+        self.routed = {"text": 0, "vision": 0, "mixed": 0}
+
+    def is_text_page(self, page: PageText) -> bool:
+        return page.chars >= self.min_chars and page.coverage >= self.min_coverage
+
+    def record_vision_latency(self, ms: float):
+        self.vision_ms = ms if self.vision_ms is None else 0.8 * self.vision_ms + 0.2 * ms
+
+    def applies_to(self, payload: UploadPayload) -> bool:
+        return (payload.filename.lower().endswith(".pdf") or payload.content_type == "application/pdf") \
+            and payload.size <= self.max_bytes
+
+    async def route(self, payload: UploadPayload, prompt: str, fields: List[str],
+                    http: httpx.AsyncClient, send_to_model) -> Dict[str, Any]:
+        """Process a PDF; ``send_to_model(payload)`` is the vision fallback"""
+        started = time.perf_counter()
+        try:
+            with span("pdf_inspect"):
+                data = await payload.read()
+                pages = await asyncio.to_thread(inspect_pdf, data)
+        except Exception as e:
+            return await self._vision(payload, send_to_model, {}, f"could not read PDF: {e}")
+        text_pages = [p for p in pages if self.is_text_page(p)]
+        scanned = [p.number for p in pages if not self.is_text_page(p)]
+        decision = {
+            "pages": len(pages),
+            "textPages": [p.number for p in text_pages],
+            "scannedPages": scanned,
+            "textChars": sum(p.chars for p in pages),
+            "decisionMs": round(1000 * (time.perf_counter() - started), 2),
+        }
+
+        if not text_pages:
+            return await self._vision(payload, send_to_model, decision, "no usable text layer")
+
+        text = "\n".join(p.text for p in text_pages)
+        with span("text_rules"):
+            fields_found = extract_fields_from_text(text, fields)
+        llm_used = False
+        if self.text_llm_url:
+            with span("text_llm"):
+                llm_fields = await self._ask_text_llm(http, text, fields)
+            if llm_fields:
+                fields_found.update({k: v for k, v in llm_fields.items() if v not in (None, "")})
+                llm_used = True
+
+        found = sum(v is not None for v in fields_found.values())
+        if not llm_used and fields and found / len(fields) < self.min_rule_fields:
+            return await self._vision(payload, send_to_model, decision,
+                                      f"rules found {found}/{len(fields)} fields")
+        unsure = [f for f in fields if f in HEURISTIC_FIELDS and fields_found.get(f) is None]
+        if not llm_used and unsure:
+            return await self._vision(payload, send_to_model, decision, f"rules found no {', '.join(unsure)}")
+
+        result = {
+            "fileName": payload.filename,
+            "promptUsed": prompt,
+            "extractedFields": fields_found,
+            "rawResponse": {"source": "text-llm" if llm_used else "text-rules"},
+        }
+
+        if scanned:
+            # Mixed document: OCR only the pages without a text layer
+            with span("rasterize"):
+                images = await asyncio.to_thread(render_pages, data, scanned, self.raster_dpi)
+            page_payloads = [UploadPayload(f"{payload.filename}#page{n}.png", io.BytesIO(png), len(png), "image/png")
+                             for n, png in zip(scanned, images)]
+            vision_started = time.perf_counter()
+            result["pages"] = await asyncio.gather(*(send_to_model(p) for p in page_payloads))
+            self.record_vision_latency(1000 * (time.perf_counter() - vision_started))
+            # The text layer wins; scanned pages fill in what it lacks and add their line items
+            scanned_fields = merge_page_fields([p.get("extractedFields") for p in result["pages"]])
+            for key, value in scanned_fields.items():
+                if key == "line_items":
+                    fields_found[key] = list(fields_found.get(key) or []) + list(value or [])
+                elif fields_found.get(key) is None:
+                    fields_found[key] = value
+            path = "mixed"
+        else:
+            path = "text"
+
+        elapsed_ms = 1000 * (time.perf_counter() - started)
+        saved = None
+        if self.vision_ms is not None:
+            saved = max(self.vision_ms * len(text_pages) / len(pages) - elapsed_ms, 0.0)
+        result["routing"] = {
+            **decision,
+            "path": path,
+            "reason": f"{len(text_pages)}/{len(pages)} pages have a usable text layer",
+            "llmUsed": llm_used,
+            "elapsedMs": round(elapsed_ms, 2),
+            "timeSavedMs": None if saved is None else round(saved, 2),
+        }
+        self.routed[path] += 1
+        return result
+
+    async def _vision(self, payload: UploadPayload, send_to_model, decision: Dict[str, Any], reason: str):
+        started = time.perf_counter()
+        result = await send_to_model(payload)
+        elapsed_ms = 1000 * (time.perf_counter() - started)
+        self.record_vision_latency(elapsed_ms)
+        self.routed["vision"] += 1
+        return {**result, "routing": {**decision, "path": "vision", "reason": reason,
+                                      "elapsedMs": round(elapsed_ms, 2), "timeSavedMs": 0.0}}
+
+    async def _ask_text_llm(self, http: httpx.AsyncClient, text: str, fields: List[str]) -> Optional[Dict[str, Any]]:
+        from .OLD.InvoiceProcessor import InvoiceProcessor, InvoiceProcessingConfig
+
+        if self._prompts is None:
+            self._prompts = InvoiceProcessor()
+        # Compiled once per field selection; the document text is appended last
+        prompt = self._prompts.generate_extraction_prompt(InvoiceProcessingConfig(fields=fields), text, "pdf")
+        try:
+            content = await self.text_llm.complete(http, [{"role": "user", "content": prompt}], temperature=0.1)
+            match = re.search(r"\{.*\}", content, re.DOTALL)
+            parsed = json.loads(match.group()) if match else {}
+            return parsed.get("extracted_fields", parsed)
+        except Exception:
+            return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.routed, "visionLatencyMs": self.vision_ms}
@@ -0,0 +1,132 @@
+"""Token streaming between the model server, the backend and the browser.
+
+The model server's ``/process/stream`` answers with server-sent events: a
+``token`` event per decoded chunk of text and a final ``result`` event with
+the same JSON ``/process`` returns. ``FieldScanner`` watches the growing text
+for ``"field": value`` pairs so each field can be shown (and timed) as soon
+as the model has written it.
+"""
+import json
+import re
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+# A complete "key": value pair; the lookahead makes sure the value is finished
+FIELD_PAIR = re.compile(
+    r'"(?P<name>[A-Za-z_][\w ]*)"\s*:\s*'
+    r'(?P<value>"(?:[^"\\]|\\.)*"|-?\d+(?:\.\d+)?|null|true|false)'
+    r'(?=\s*[,}\]\n])'
+)
+
+
+def sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def iter_sse(lines: AsyncIterator[str]) -> AsyncIterator[Tuple[str, Any]]:
+    """Parse ``(event, data)`` pairs out of a text/event-stream body"""
+    event, data = "message", []
+    async for line in lines:
+        if not line:
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith("event:"):
+            event = line[6:].strip()
+        elif line.startswith("data:"):
+            data.append(line[5:].lstrip())
+    if data:
+        yield event, json.loads("\n".join(data))
+
+
+class FieldScanner:
+    """Finds fields in partially generated JSON as soon as their value is complete.
+
+    Only names in ``fields`` are reported (so keys inside line items are not
+    mistaken for top-level fields), each at most once.
+    """
+
+    def __init__(self, fields: Iterable[str]):
+        self.fields = {f.lower() for f in fields}
+        self.text = ""
+        self.found: Dict[str, Any] = {}
+        self._pos = 0
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        self.text += chunk
+        new = []
+        for match in FIELD_PAIR.finditer(self.text, self._pos):
+            self._pos = match.end()
+            name = match.group("name").strip().lower().replace(" ", "_")
+            if name in self.fields and name not in self.found:
+                try:
+                    value = json.loads(match.group("value"))
+                except ValueError:
+                    continue
+                self.found[name] = value
+                new.append((name, value))
+        return new
+
+
+class StreamStats:
+    """Rolling latency percentiles for streamed extractions.
+
+    Time to first field is the headline number: it is what the user waits for
+    before anything useful shows up.
+    """
+
+    def __init__(self, window: int = 500):
+        self.streams = 0
+        self.first_token_ms: "deque[float]" = deque(maxlen=window)
+        self.first_field_ms: "deque[float]" = deque(maxlen=window)
+        self.total_ms: "deque[float]" = deque(maxlen=window)
+
+    def record(self, timing: Dict[str, Optional[float]]):
+        self.streams += 1
+        for name, samples in (("firstTokenMs", self.first_token_ms), ("firstFieldMs", self.first_field_ms),
+                              ("totalMs", self.total_ms)):
+            if timing.get(name) is not None:
+                samples.append(timing[name])
+
+    @staticmethod
+    def _percentiles(samples: "deque[float]") -> Dict[str, Optional[float]]:
+        if not samples:
+            return {"p50": None, "p95": None}
+        ordered = sorted(samples)
+        pick = lambda q: round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 1)
+        return {"p50": pick(0.5), "p95": pick(0.95)}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "streams": self.streams,
+            "time_to_first_field_ms": self._percentiles(self.first_field_ms),
+            "time_to_first_token_ms": self._percentiles(self.first_token_ms),
+            "total_ms": self._percentiles(self.total_ms),
+        }
+
+
+class StreamTimer:
+    """Per-file timestamps relative to when the request started"""
+
+    def __init__(self, started: Optional[float] = None):
+        self.started = started if started is not None else time.perf_counter()
+        self.first_token_ms: Optional[float] = None
+        self.first_field_ms: Optional[float] = None
+
+    def elapsed_ms(self) -> float:
+        return round(1000 * (time.perf_counter() - self.started), 1)
+
+    def token(self):
+        if self.first_token_ms is None:
+            self.first_token_ms = self.elapsed_ms()
+
+    def field(self) -> float:
+        ms = self.elapsed_ms()
+        if self.first_field_ms is None:
+            self.first_field_ms = ms
+        return ms
+
+    def timing(self) -> Dict[str, Optional[float]]:
+        return {"firstTokenMs": self.first_token_ms, "firstFieldMs": self.first_field_ms,
+                "totalMs": self.elapsed_ms()}
@@ -0,0 +1,476 @@
+"""Vendor templates: repeat layouts extracted from the text layer, without the model.
+
+Most volume comes from a few vendors whose invoices always look the same.
+For PDFs with a text layer, every model extraction is kept as a sample:
+the page's words with their positions, and the fields the model returned.
+Samples are grouped by vendor and layout fingerprint: a SimHash of the
+label words in the header (the top third of the first page) and where
+they sit, since line items and totals move with the number of items.
+Once a group has ``samples`` extractions, a template is learned from them.
+For each field it looks for a rule that reproduces the model's value in
+every sample:
+
+* ``left``: the words after an anchor label on the same line
+  (``Invoice No.: 4711``), taking the rest of the run or a fixed word count
+* ``above``: the words under an anchor label on the next line
+* ``constant``: the same value every time, such as the vendor's own name,
+  which must then appear on the page
+* ``absent``: the model never found the field on this vendor's invoices
+
+The rule also remembers how the model formatted the value (as printed, ISO
+date, number). Fields without a consistent rule, and line items, are left
+out of the template.
+
+A later document whose fingerprint is within ``max_distance`` bits of a
+template's, and which shows that vendor's name, is run through the
+template's rules. Every requested field must be covered and its value
+must parse as its type (dates as dates, amounts as amounts); the fraction
+that passes is the confidence. At ``min_confidence`` or above, the result
+is returned in a few milliseconds with ``rawResponse.source == "template"``.
+Anything less goes to the model as before, and that extraction becomes a
+new sample. Once a template has missed ``samples`` times in a row, it is
+re-learned from those newer samples, or dropped if no rule fits them any
+more, and the vendor layout is learned again from scratch.
+
+Scanned pages have no text layer to anchor on and always go to the model.
+"""
+import asyncio
+import json
+import os
+import re
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple
+
+from .dedupe import simhash_features
+from .metrics import REGISTRY
+from .results import parse_amount, parse_date
+from .uploads import UploadPayload
+
+Word = Tuple[float, float, float, float, str]  # x0, y0, x1, y1 in PDF points, text
+
+DATE_FIELDS = {"invoice_date", "due_date"}
+AMOUNT_FIELDS = {"total_amount", "tax_amount", "subtotal", "amount_due"}
+MAX_VALUE_WORDS = 8
+MAX_LABEL_WORDS = 3
+GAP_HEIGHTS = 1.5  # a gap wider than this many word heights ends a run of words
+ISO_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+LABEL_WORD = re.compile(r"[^\W\d_]{2,}[:.#]?")
+MONTHS = {"jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"}
+
+TEMPLATE_LOOKUPS = REGISTRY.counter("template_lookups_total", "Template lookups for text-layer PDFs", ["outcome"])
+
+
+@dataclass
+class Layout:
+    """The text layer of a document's first pages, as visual lines of positioned words"""
+    lines: List[List[Word]]
+    pages: List[int]  # page index of each line
+    fingerprint: int
+    text: str  # every word lower-cased, without spaces, for presence checks
+    read_ms: float = 0.0
+
+
+def _norm(text: str) -> str:
+    return "".join(text.lower().split())
+
+
+def _group_lines(words: Sequence[Word]) -> List[List[Word]]:
+    lines: List[List[Word]] = []
+    center = None
+    for word in sorted(words, key=lambda w: ((w[1] + w[3]) / 2, w[0])):
+        middle, height = (word[1] + word[3]) / 2, word[3] - word[1]
+        if center is None or abs(middle - center) > 0.4 * height:
+            lines.append([])
+            center = middle
+        lines[-1].append(word)
+    return [sorted(line, key=lambda w: w[0]) for line in lines]
+
+
+def read_layout(data: bytes, max_pages: int = 3, min_chars: int = 50) -> Optional[Layout]:
+    """The layout of a PDF's text layer; None for scans and anything unreadable"""
+    import fitz  # PyMuPDF
+
+    try:
+        lines, pages, features, chars = [], [], [], 0
+        with fitz.open(stream=data, filetype="pdf") as doc:
+            for page in doc:
+                if page.number >= max_pages:
+                    break
+                words = [tuple(w[:5]) for w in page.get_text("words")]
+                chars += sum(len(w[4]) for w in words)
+                for line in _group_lines(words):
+                    lines.append(line)
+                    pages.append(page.number)
+                if page.number == 0:
+                    # Header labels and where they sit; the values that change between invoices are left out
+                    width, height = page.rect.width or 1.0, page.rect.height or 1.0
+                    features = [f"{w[4].lower()}@{int(8 * w[0] / width)},{int(16 * w[1] / height)}"
+                                for w in words if w[1] < height / 3 and LABEL_WORD.fullmatch(w[4])
+                                and w[4][:3].lower() not in MONTHS]
+    except Exception:
+        return None
+    if chars < min_chars:
+        return None
+    return Layout(lines, pages, simhash_features(features),
+                  "".join(_norm(w[4]) for line in lines for w in line))
+
+
+# --- Rules ---
+def _gap(left: Word, right: Word) -> bool:
+    return right[0] - left[2] > GAP_HEIGHTS * (right[3] - right[1])
+
+
+def _run(words: List[Word], start: int, count: Optional[int]) -> List[Word]:
+    """Words from ``start`` on, up to ``count`` of them or until a wide gap"""
+    run = words[start:start + 1]
+    for word in words[start + 1:]:
+        if (count is None and len(run) >= MAX_VALUE_WORDS) or (count is not None and len(run) >= count):
+            break
+        if count is None and _gap(run[-1], word):
+            break
+        run.append(word)
+    return run if count is None or len(run) == count else []
+
+
+def _label_hits(layout: Layout, label: Tuple[str, ...]) -> List[Tuple[int, int]]:
+    hits = []
+    for li, words in enumerate(layout.lines):
+        for i in range(len(words) - len(label) + 1):
+            if all(words[i + k][4].lower() == part for k, part in enumerate(label)):
+                hits.append((li, i))
+    return hits
+
+
+def _line_below(layout: Layout, li: int) -> Optional[int]:
+    """The next line on the same page, if it is close enough to belong to the label above it"""
+    if li + 1 >= len(layout.lines) or layout.pages[li + 1] != layout.pages[li]:
+        return None
+    label, below = layout.lines[li][0], layout.lines[li + 1][0]
+    return li + 1 if below[1] - label[3] < 3 * (label[3] - label[1]) else None
+
+
+def apply_rule(layout: Layout, rule: Dict[str, Any]) -> Optional[str]:
+    """The text a positional rule picks out of ``layout``"""
+    label = tuple(rule["label"])
+    hits = _label_hits(layout, label)
+    occurrence = rule["occurrence"]
+    if not -len(hits) <= occurrence < len(hits):
+        return None
+    li, i = hits[occurrence]
+    words = layout.lines[li]
+    end = i + len(label)
+    if rule["kind"] == "left":
+        run = _run(words, end, rule.get("words")) if end < len(words) else []
+    else:
+        below = _line_below(layout, li)
+        if below is None:
+            return None
+        x0, x1 = words[i][0], words[end - 1][2]
+        slack = words[i][3] - words[i][1]
+        start = next((k for k, w in enumerate(layout.lines[below]) if w[2] >= x0 - slack and w[0] <= x1 + slack),
+                     None)
+        run = _run(layout.lines[below], start, rule.get("words")) if start is not None else []
+    return " ".join(w[4] for w in run) or None
+
+
+def output_form(value: Any, text: str) -> Optional[str]:
+    """How the model wrote ``text`` from the page as ``value``, or None if it is a different value"""
+    if isinstance(value, str) and _norm(value) == _norm(text):
+        return "text"
+    if isinstance(value, str) and ISO_DATE.match(value.strip()) and parse_date(text) == value.strip():
+        return "date"
+    if not re.search(r"\d", text) or re.search(r"[a-z]{4,}", text.lower()):
+        return None
+    amount = parse_amount(text)
+    if amount is None:
+        return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and abs(value - amount) < 0.005:
+        return "number"
+    if isinstance(value, str) and value.strip() == f"{amount:.2f}":
+        return "decimal"
+    return None
+
+
+def format_value(text: str, form: str) -> Any:
+    if form == "date":
+        return parse_date(text)
+    if form == "number":
+        return parse_amount(text)
+    if form == "decimal":
+        amount = parse_amount(text)
+        return None if amount is None else f"{amount:.2f}"
+    return text
+
+
+def valid(name: str, value: Any) -> bool:
+    """Whether a value the template produced is plausible for its field"""
+    if value in (None, ""):
+        return False
+    if name in DATE_FIELDS:
+        return parse_date(str(value)) is not None
+    if name in AMOUNT_FIELDS:
+        return parse_amount(value) is not None
+    return True
+
+
+def _candidate_rules(layout: Layout, value: Any) -> List[Dict[str, Any]]:
+    """Every rule that would read ``value`` off this one layout"""
+    rules = []
+    for li, words in enumerate(layout.lines):
+        for i in range(len(words)):
+            for j in range(i + 1, min(i + MAX_VALUE_WORDS, len(words)) + 1):
+                if output_form(value, " ".join(w[4] for w in words[i:j])) is None:
+                    continue
+                anchors = []  # (kind, label words, line, index of the label's first word)
+                # The words running into the value from the left; the value itself may be further off
+                start = i
+                while start > 0 and i - start < MAX_LABEL_WORDS and (start == i or not _gap(words[start - 1],
+                                                                                            words[start])):
+                    start -= 1
+                    if any(c.isalpha() for c in words[start][4]):
+                        anchors.append(("left", words[start:i], li, start))
+                # The words right above it
+                if li > 0 and _line_below(layout, li - 1) == li:
+                    above = [k for k, w in enumerate(layout.lines[li - 1])
+                             if w[2] >= words[i][0] and w[0] <= words[j - 1][2]][:MAX_LABEL_WORDS]
+                    label = [layout.lines[li - 1][k] for k in above]
+                    if label and above == list(range(above[0], above[0] + len(above))) \
+                            and any(c.isalpha() for w in label for c in w[4]):
+                        anchors.append(("above", label, li - 1, above[0]))
+                for kind, label, line, first in anchors:
+                    label = [w[4].lower() for w in label]
+                    hits = _label_hits(layout, tuple(label))
+                    index = hits.index((line, first))
+                    for occurrence in (index, index - len(hits)):
+                        for count in (None, j - i):
+                            rules.append({"kind": kind, "label": label, "occurrence": occurrence, "words": count})
+    return rules
+
+
+def learn_rule(samples: Sequence[Tuple[Layout, Dict[str, Any]]], name: str) -> Optional[Dict[str, Any]]:
+    """A rule for field ``name`` that reproduces the model's value on every sample"""
+    values = [fields.get(name) for _, fields in samples]
+    if all(v in (None, "") for v in values):
+        return {"kind": "absent"}
+    if any(isinstance(v, (list, dict, bool)) or v in (None, "") for v in values):
+        return None
+    constant = None
+    if isinstance(values[0], str) and all(v == values[0] for v in values) \
+            and all(_norm(values[0]) in layout.text for layout, _ in samples):
+        constant = {"kind": "constant", "value": values[0]}
+        if name == "vendor_name":
+            return constant
+    tried = set()
+    for rule in _candidate_rules(samples[0][0], values[0]):
+        key = json.dumps(rule, sort_keys=True)
+        if key in tried:
+            continue
+        tried.add(key)
+        forms = set()
+        for layout, fields in samples:
+            text = apply_rule(layout, rule)
+            forms.add(output_form(fields[name], text) if text is not None else None)
+        if len(forms) == 1 and None not in forms:
+            return {**rule, "output": forms.pop()}
+    return constant
+
+
+@dataclass
+class Group:
+    """Samples and (once learned) the template of one vendor layout"""
+    id: int
+    vendor: str
+    fingerprint: int
+    samples: Deque[Tuple[Layout, Dict[str, Any]]]
+    template: Optional[Dict[str, Any]] = None
+    pending: int = 0  # samples added since the template was last learned
+    hits: int = 0
+    misses: int = 0
+    recent_misses: int = 0  # since the last hit or learn
+
+
+class TemplateLearner:
+    """Learns per-vendor templates from model extractions and applies them to later documents"""
+
+    def __init__(self, samples: int = 3, max_distance: int = 12, min_confidence: float = 1.0,
+                 path: Optional[str] = None, max_groups: int = 1000, max_pages: int = 3,
+                 max_bytes: int = 20 * 1024 * 1024):
+        self.samples = samples
+        self.max_distance = max_distance
+        self.min_confidence = min_confidence
+        self.path = path
+        self.max_groups = max_groups
+        self.max_pages = max_pages
+        self.max_bytes = max_bytes
+        self._groups: "OrderedDict[int, Group]" = OrderedDict()
+        self._next_id = 0
+        self.model_ms: Optional[float] = None  # moving average of what the model took for these documents
+        self.counts = {"lookups": 0, "hits": 0, "noLayout": 0, "noTemplate": 0, "uncovered": 0,
+                       "lowConfidence": 0, "learned": 0, "relearned": 0, "invalidated": 0, "templateMs": 0.0, "timeSavedMs": 0.0}
+        if path and os.path.exists(path):
+            self._load(path)
+
+    def applies_to(self, payload: UploadPayload) -> bool:
+        return (payload.filename.lower().endswith(".pdf") or payload.content_type == "application/pdf") \
+            and payload.size <= self.max_bytes
+
+    async def read(self, payload: UploadPayload) -> Optional[Layout]:
+        started = time.perf_counter()
+        layout = await asyncio.to_thread(read_layout, await payload.read(), self.max_pages)
+        if layout is None:
+            self.counts["noLayout"] += 1
+        else:
+            layout.read_ms = 1000 * (time.perf_counter() - started)
+        return layout
+
+    def _nearest(self, layout: Layout) -> List[Group]:
+        scored = [(bin(g.fingerprint ^ layout.fingerprint).count("1"), g) for g in self._groups.values()]
+        return [g for d, g in sorted(scored, key=lambda s: s[0]) if d <= self.max_distance]
+
+    def extract(self, layout: Layout, payload: UploadPayload, prompt: str,
+                fields: List[str]) -> Optional[Dict[str, Any]]:
+        """The template result for ``layout``, or None when the model has to extract it"""
+        started = time.perf_counter()
+        self.counts["lookups"] += 1
+        candidates = [g for g in self._nearest(layout)
+                      if g.template is not None and _norm(g.vendor) in layout.text]
+        if not candidates:
+            self.counts["noTemplate"] += 1
+            TEMPLATE_LOOKUPS.inc(outcome="noTemplate")
+            return None
+        miss = "uncovered"
+        for group in candidates:
+            rules = group.template["rules"]
+            if any(name not in rules for name in fields):
+                continue
+            extracted, passed = {}, 0
+            for name in fields:
+                rule = rules[name]
+                if rule["kind"] == "absent":
+                    value, ok = None, True
+                elif rule["kind"] == "constant":
+                    value = rule["value"]
+                    ok = _norm(str(value)) in layout.text
+                else:
+                    text = apply_rule(layout, rule)
+                    value = format_value(text, rule["output"]) if text is not None else None
+                    ok = valid(name, value)
+                extracted[name] = value
+                passed += ok
+            confidence = passed / len(fields) if fields else 0.0
+            if confidence < self.min_confidence:
+                miss = "lowConfidence"
+                group.misses += 1
+                group.recent_misses += 1
+                continue
+
+            elapsed_ms = layout.read_ms + 1000 * (time.perf_counter() - started)
+            saved = max(self.model_ms - elapsed_ms, 0.0) if self.model_ms is not None else None
+            group.hits += 1
+            group.recent_misses = 0
+            self.counts["hits"] += 1
+            self.counts["templateMs"] += elapsed_ms
+            self.counts["timeSavedMs"] += saved or 0.0
+            TEMPLATE_LOOKUPS.inc(outcome="hit")
+            self._groups.move_to_end(group.id)
+            return {
+                "fileName": payload.filename,
+                "promptUsed": prompt,
+                "extractedFields": extracted,
+                "rawResponse": {"source": "template"},
+                "template": {"id": group.id, "vendor": group.vendor, "confidence": round(confidence, 3),
+                             "elapsedMs": round(elapsed_ms, 2),
+                             "timeSavedMs": None if saved is None else round(saved, 2)},
+            }
+        self.counts[miss] += 1
+        TEMPLATE_LOOKUPS.inc(outcome=miss)
+        return None
+
+    async def learn(self, layout: Layout, result: Dict[str, Any], model_ms: float):
+        """Keep a model extraction as a sample; learn the group's template once it has enough"""
+        fields = result.get("extractedFields")
+        if "error" in result or not isinstance(fields, dict):
+            return
+        self.model_ms = model_ms if self.model_ms is None else 0.8 * self.model_ms + 0.2 * model_ms
+        vendor = fields.get("vendor_name")
+        if not isinstance(vendor, str) or not vendor.strip():
+            return
+        group = next((g for g in self._nearest(layout) if _norm(g.vendor) == _norm(vendor)), None)
+        if group is None:
+            group = self._add_group(vendor.strip(), layout.fingerprint)
+        group.samples.append((layout, fields))
+        group.pending += 1
+        self._groups.move_to_end(group.id)
+        if group.pending < self.samples:
+            return
+        rules = await asyncio.to_thread(self._learn_rules, list(group.samples))
+        group.pending = 0
+        if rules is not None:
+            self.counts["relearned" if group.template is not None else "learned"] += 1
+            group.template = {"rules": rules, "samples": len(group.samples), "learnedAt": time.time()}
+            group.fingerprint = layout.fingerprint  # follow slow drift of the layout
+        elif group.template is not None and group.recent_misses >= self.samples:
+            # The layout changed under the template and nothing fits the newer samples
+            self.counts["invalidated"] += 1
+            group.template = None
+        else:
+            return
+        group.recent_misses = 0
+        if self.path:
+            await asyncio.to_thread(self._save, self.path)
+
+    @staticmethod
+    def _learn_rules(samples: List[Tuple[Layout, Dict[str, Any]]]) -> Optional[Dict[str, Dict[str, Any]]]:
+        names = set.intersection(*(set(fields) for _, fields in samples))
+        rules = {}
+        for name in sorted(names):
+            rule = learn_rule(samples, name)
+            if rule is not None:
+                rules[name] = rule
+        # Worth keeping only if it reads something off the page besides the vendor name
+        if not any(r["kind"] in ("left", "above") for r in rules.values()):
+            return None
+        return rules
+
+    def _add_group(self, vendor: str, fingerprint: int) -> Group:
+        if len(self._groups) >= self.max_groups:
+            # Drop the least recently used group still learning, else the least recently used template
+            victim = next((g for g in self._groups.values() if g.template is None), None) \
+                or next(iter(self._groups.values()))
+            del self._groups[victim.id]
+        group = Group(self._next_id, vendor, fingerprint, deque(maxlen=self.samples))
+        self._groups[group.id] = group
+        self._next_id += 1
+        return group
+
+    def _save(self, path: str):
+        templates = [{"id": g.id, "vendor": g.vendor, "fingerprint": g.fingerprint, **g.template}
+                     for g in self._groups.values() if g.template is not None]
+        with open(path + ".tmp", "w") as f:
+            json.dump(templates, f)
+        os.replace(path + ".tmp", path)
+
+    def _load(self, path: str):
+        with open(path) as f:
+            for saved in json.load(f):
+                group = self._add_group(saved["vendor"], saved["fingerprint"])
+                group.template = {k: saved[k] for k in ("rules", "samples", "learnedAt")}
+
+    def stats(self) -> Dict[str, Any]:
+        lookups, hits = self.counts["lookups"], self.counts["hits"]
+        return {
+            **self.counts,
+            "templateMs": round(self.counts["templateMs"], 1),
+            "timeSavedMs": round(self.counts["timeSavedMs"], 1),
+            "hitRate": round(hits / lookups, 3) if lookups else None,
+            "avgTemplateMs": round(self.counts["templateMs"] / hits, 2) if hits else None,
+            "modelMs": None if self.model_ms is None else round(self.model_ms, 1),
+            "templates": sum(g.template is not None for g in self._groups.values()),
+            "learning": sum(g.template is None for g in self._groups.values()),
+            "vendors": [{"vendor": g.vendor, "hits": g.hits, "misses": g.misses,
+                         "fields": sorted(g.template["rules"])}
+                        for g in self._groups.values() if g.template is not None],
+        }
+
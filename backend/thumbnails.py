@@ -0,0 +1,173 @@
+"""First-page thumbnails for the upload previews, cached by file hash.
+
+The browser used to build previews itself from the full-size files (a data
+URL per image, a pdf.js render per PDF), which froze the page on large
+batches. Instead it hashes each file, asks for ``/thumbnails/<sha256>`` and
+uploads the file only when the server has no thumbnail for it yet.
+
+``render_thumbnail`` draws just the first page (PDF, multi-frame TIFF or
+image) straight at thumbnail scale - a PDF page is rasterized at the zoom
+that fits the box rather than at a fixed DPI and scaled down afterwards -
+and encodes it as WebP or JPEG. Rendering runs on a process pool; the
+thumbnails are kept in an LRU bounded by their total size. The URL names
+the file's content, so responses can be cached by the browser for good.
+"""
+import asyncio
+import io
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from .metrics import REGISTRY
+from .uploads import UploadPayload
+
+CONTENT_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+THUMBNAIL_REQUESTS = REGISTRY.counter("thumbnail_requests_total", "Thumbnail lookups", ["outcome"])
+THUMBNAIL_SECONDS = REGISTRY.histogram("thumbnail_render_seconds", "Time to render one thumbnail")
+
+
+@dataclass(frozen=True)
+class ThumbnailOptions:
+    width: int = 300  # the preview tiles are 150 px tall; 2x for high-DPI screens
+    height: int = 300
+    format: str = "WEBP"  # or "JPEG"
+    quality: int = 70
+
+
+def render_thumbnail(data: bytes, options: ThumbnailOptions) -> Optional[bytes]:
+    """The first page fitted into the options' box, encoded; None if it cannot be decoded"""
+    from PIL import Image, ImageOps
+
+    if not data:
+        return None  # pool warmup
+    try:
+        if data[:5] == b"%PDF-":
+            import fitz  # PyMuPDF
+
+            with fitz.open(stream=data, filetype="pdf") as doc:
+                page = doc[0]
+                zoom = min(options.width / page.rect.width, options.height / page.rect.height)
+                pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+                image = Image.frombytes("RGB", (pixmap.width, pixmap.height), pixmap.samples)
+        else:
+            image = Image.open(io.BytesIO(data))
+            image.draft("RGB", (options.width, options.height))  # JPEGs decode at a fraction of full size
+            image = ImageOps.exif_transpose(image)  # only the first frame of a TIFF / GIF
+        image = image.convert("RGB")
+        image.thumbnail((options.width, options.height), Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, options.format, quality=options.quality)
+        return buffer.getvalue()
+    except Exception:
+        return None
+
+
+class ThumbnailCache:
+    """Renders thumbnails on a shared process pool and keeps recent ones in memory"""
+
+    def __init__(self, options: Optional[ThumbnailOptions] = None, max_bytes: int = 32 * 1024 * 1024,
+                 workers: int = 2, executor: Optional[Executor] = None):
+        self.options = options or ThumbnailOptions()
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self._executor = executor
+        self._own_executor = executor is None
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._bytes = 0
+        self._rendering: Dict[str, asyncio.Future] = {}
+        self.counts = {"hits": 0, "misses": 0, "rendered": 0, "failed": 0, "evictions": 0, "ms": 0.0}
+
+    @property
+    def content_type(self) -> str:
+        return CONTENT_TYPES[self.options.format]
+
+    def etag(self, sha256: str) -> str:
+        # The options are part of it, so changing the size or format invalidates browser copies
+        o = self.options
+        return f'"{sha256[:32]}-{o.width}x{o.height}-{o.format.lower()}{o.quality}"'
+
+    def start(self):
+        """Spawn the workers and import Pillow / PyMuPDF in them before the first preview"""
+        if self._executor is None:
+            # Spawned, not forked: a forked worker would inherit the server's listening socket
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+        for _ in range(self.workers):
+            self._executor.submit(render_thumbnail, b"", self.options)
+
+    def get(self, sha256: str) -> Optional[bytes]:
+        thumbnail = self._entries.get(sha256)
+        if thumbnail is None:
+            self.counts["misses"] += 1
+            THUMBNAIL_REQUESTS.inc(outcome="miss")
+            return None
+        self._entries.move_to_end(sha256)
+        self.counts["hits"] += 1
+        THUMBNAIL_REQUESTS.inc(outcome="hit")
+        return thumbnail
+
+    async def render(self, payload: UploadPayload) -> Optional[bytes]:
+        """The payload's thumbnail, from the cache or rendered once however many ask at the same time"""
+        sha256 = await payload.sha256()
+        thumbnail = self.get(sha256)
+        if thumbnail is not None:
+            return thumbnail
+        pending = self._rendering.get(sha256)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._rendering[sha256] = future
+        thumbnail = None
+        try:
+            thumbnail = await self._render(await payload.read())
+            if thumbnail is not None:
+                self._remember(sha256, thumbnail)
+        finally:
+            del self._rendering[sha256]
+            future.set_result(thumbnail)  # whoever joined a failed render gets None
+        return thumbnail
+
+    async def _render(self, data: bytes) -> Optional[bytes]:
+        if self._executor is None:
+            self.start()
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        thumbnail = await loop.run_in_executor(self._executor, render_thumbnail, data, self.options)
+        seconds = loop.time() - started
+        THUMBNAIL_SECONDS.observe(seconds)
+        self.counts["ms"] += 1000 * seconds
+        self.counts["rendered" if thumbnail is not None else "failed"] += 1
+        return thumbnail
+
+    def _remember(self, sha256: str, thumbnail: bytes):
+        if len(thumbnail) > self.max_bytes:
+            return
+        self._entries[sha256] = thumbnail
+        self._bytes += len(thumbnail)
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+            self.counts["evictions"] += 1
+
+    def close(self):
+        if self._own_executor and self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.counts["hits"] + self.counts["misses"]
+        renders = self.counts["rendered"] + self.counts["failed"]
+        return {
+            **self.counts,
+            "ms": round(self.counts["ms"], 1),
+            "avgRenderMs": round(self.counts["ms"] / renders, 2) if renders else None,
+            "hitRate": round(self.counts["hits"] / lookups, 3) if lookups else None,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "maxBytes": self.max_bytes,
+            "options": vars(self.options),
+        }
@@ -0,0 +1,137 @@
+import asyncio
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import uuid
+from typing import AsyncIterator, BinaryIO, Optional, Tuple
+
+from fastapi import UploadFile
+
+CHUNK_SIZE = 64 * 1024
+
+
+class UploadPayload:
+    """A file on its way to the model, read in chunks straight from its source.
+
+    By default the source is the request's own spooled UploadFile, so nothing
+    is copied. ``detach`` moves the bytes into a private SpooledTemporaryFile
+    that stays in memory up to ``spill_threshold`` bytes and spills to an
+    anonymous temp file beyond that - use it when the payload has to outlive
+    the request that uploaded it.
+    """
+
+    def __init__(self, filename: str, source: BinaryIO, size: int,
+                 content_type: str = "application/octet-stream"):
+        self.filename = filename
+        self.source = source
+        self.size = size
+        self.content_type = content_type
+        self._sha256: Optional[str] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    async def from_upload(cls, upload: UploadFile, spill_threshold: Optional[int] = None) -> "UploadPayload":
+        size = upload.size
+        if size is None:
+            # UploadFile.seek() only takes an offset, so measure on the file itself
+            if _in_memory(upload.file):
+                size = _file_size(upload.file)
+            else:
+                size = await asyncio.to_thread(_file_size, upload.file)
+        payload = cls(upload.filename or "upload", upload.file, size,
+                      upload.content_type or "application/octet-stream")
+        if spill_threshold:
+            await payload.detach(spill_threshold)
+        return payload
+
+    async def detach(self, spill_threshold: int):
+        """Copy the bytes into a spool owned by this payload"""
+        spool = tempfile.SpooledTemporaryFile(max_size=spill_threshold)
+        async for chunk in self.aiter_chunks():
+            if _in_memory(spool):
+                spool.write(chunk)
+            else:
+                await asyncio.to_thread(spool.write, chunk)
+        spool.seek(0)
+        self.source = spool
+
+    async def aiter_chunks(self) -> AsyncIterator[bytes]:
+        """Yield the file from the start; safe to call again for a retry, or concurrently for a hedge"""
+        offset = 0
+        while True:
+            if _in_memory(self.source):
+                chunk = self._read_at(offset)
+            else:
+                chunk = await asyncio.to_thread(self._read_at, offset)
+            if not chunk:
+                break
+            offset += len(chunk)
+            yield chunk
+
+    def _read_at(self, offset: int) -> bytes:
+        # Every reader keeps its own offset, so readers sharing the source don't interleave
+        with self._lock:
+            self.source.seek(offset)
+            return self.source.read(CHUNK_SIZE)
+
+    async def read(self) -> bytes:
+        """The whole file as bytes - only for consumers that need random access"""
+        return b"".join([chunk async for chunk in self.aiter_chunks()])
+
+    async def sha256(self) -> str:
+        """Hex digest of the file bytes, computed once"""
+        if self._sha256 is None:
+            digest = hashlib.sha256()
+            async for chunk in self.aiter_chunks():
+                digest.update(chunk)
+            self._sha256 = digest.hexdigest()
+        return self._sha256
+
+    def close(self):
+        self.source.close()
+
+
+def _file_size(file: BinaryIO) -> int:
+    file.seek(0, os.SEEK_END)
+    size = file.tell()
+    file.seek(0)
+    return size
+
+
+def _in_memory(source: BinaryIO) -> bool:
+    # Spooled files that have not rolled over yet are plain memory reads;
+    # anything else is real disk I/O and goes to a worker thread
+    return isinstance(source, io.BytesIO) or getattr(source, "_rolled", None) is False
+
+
+def multipart_body(payload: UploadPayload, fields: dict) -> Tuple[AsyncIterator[bytes], dict]:
+    """Build a streamed multipart/form-data body for ``payload`` plus plain form ``fields``.
+
+    Returns the body iterator and the request headers. Content-Length is
+    known up front, so the upstream sees a normal (non-chunked) upload.
+    """
+    boundary = uuid.uuid4().hex
+    head = b"".join(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        for name, value in fields.items()
+    )
+    filename = payload.filename.replace('"', "%22")
+    head += (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f"Content-Type: {payload.content_type}\r\n\r\n"
+    ).encode()
+    tail = f"\r\n--{boundary}--\r\n".encode()
+
+    async def body():
+        yield head
+        async for chunk in payload.aiter_chunks():
+            yield chunk
+        yield tail
+
+    headers = {
+        "Content-Type": f"multipart/form-data; boundary={boundary}",
+        "Content-Length": str(len(head) + payload.size + len(tail)),
+    }
+    return body(), headers
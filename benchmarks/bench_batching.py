@@ -0,0 +1,58 @@
+"""Throughput of BatchScheduler with a CPU stand-in for model.generate.
+
+The stand-in costs a fixed per-call overhead plus a small per-item cost,
+which is roughly how a batched GPU generate behaves.
+
+    python -m benchmarks.bench_batching --requests 64 --sizes 1,4,8,16
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from inference.batching import BatchScheduler
+
+
+class StandInModel:
+    def __init__(self, call_ms: float, item_ms: float):
+        self.call_ms = call_ms
+        self.item_ms = item_ms
+
+    def run_batch(self, items):
+        time.sleep((self.call_ms + self.item_ms * len(items)) / 1000)
+        return [f"decoded:{item}" for item in items]
+
+
+async def run(model: StandInModel, requests: int, max_batch_size: int, max_wait_ms: float):
+    scheduler = BatchScheduler(model.run_batch, max_batch_size, max_wait_ms)
+    start = time.perf_counter()
+    outputs = await asyncio.gather(*(scheduler.submit(i) for i in range(requests)))
+    elapsed = time.perf_counter() - start
+    await scheduler.stop()
+    assert outputs == [f"decoded:{i}" for i in range(requests)]
+    stats = scheduler.stats()
+    return {
+        "max_batch_size": max_batch_size,
+        "seconds": round(elapsed, 3),
+        "requests_per_sec": round(requests / elapsed, 2),
+        "mean_batch_size": round(stats["mean_batch_size"], 2),
+        "mean_queue_wait_ms": round(stats["mean_queue_wait_ms"], 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--sizes", default="1,4,8,16")
+    parser.add_argument("--max-wait-ms", type=float, default=20)
+    parser.add_argument("--call-ms", type=float, default=80)
+    parser.add_argument("--item-ms", type=float, default=5)
+    args = parser.parse_args()
+
+    model = StandInModel(args.call_ms, args.item_ms)
+    for size in (int(x) for x in args.sizes.split(",")):
+        print(json.dumps(asyncio.run(run(model, args.requests, size, args.max_wait_ms))))
+
+
+if __name__ == "__main__":
+    main()
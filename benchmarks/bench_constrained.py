@@ -0,0 +1,150 @@
+"""Generated tokens per invoice: free text vs prompted JSON vs constrained decoding.
+
+The "model" is a stand-in that writes a known answer for each synthetic
+invoice, picking at every step the longest allowed token that continues it
+(roughly what BPE does). Three ways of answering are compared:
+
+* ``free_text``: a markdown transcription of the page, the way the OCR model
+  answers unconstrained, cut off at ``--max-new-tokens``
+* ``prompted_json``: the fenced, indented JSON ``InvoiceProcessor`` asks for,
+  with confidence score and processing notes
+* ``constrained``: the compact object ``inference.constrained`` forces,
+  ending in EOS as soon as it closes; every output is checked with json.loads
+
+Without ``--tokenizer`` the vocabulary is built from the synthetic corpus
+(single characters plus frequent chunks); pass a Hugging Face tokenizer name
+to count real tokens and time real mask computation.
+
+    python -m benchmarks.bench_constrained --invoices 50
+"""
+import argparse
+import json
+import random
+import re
+import statistics
+import time
+from collections import Counter
+
+from benchmarks.synthetic import invoice_lines, make_invoice
+from inference.constrained import Constraint, Vocabulary, grammar_for
+
+FIELDS = "vendor_name,invoice_number,invoice_date,due_date,total_amount,tax_amount,line_items"
+
+
+def answer(invoice, fields):
+    values = dict(invoice.expected_fields())
+    values["line_items"] = [{"description": name, "quantity": str(qty), "unit_price": f"${price:,.2f}",
+                             "total": f"${qty * price:,.2f}"} for name, qty, price in invoice.line_items]
+    return {f: values.get(f) for f in fields}
+
+
+def free_text(invoice):
+    lines = []
+    for block, block_lines in invoice_lines(invoice):
+        lines.append(f"## {block.title()}")
+        lines.extend(block_lines)
+        lines.append("")
+    return "\n".join(lines)
+
+
+def prompted_json(obj):
+    wrapped = {"extracted_fields": obj, "confidence_score": "95%",
+               "processing_notes": "All requested fields were found on the first page of the document."}
+    return "```json\n" + json.dumps(wrapped, indent=4) + "\n```"
+
+
+def compact_json(obj):
+    return json.dumps(obj, separators=(", ", ": "))
+
+
+def stand_in_vocabulary(texts, size):
+    chunks = Counter()
+    for text in texts:
+        chunks.update(re.findall(r" ?[A-Za-z]+| ?\d{1,3}|[^\w\s]{1,3}|\s+", text))
+    strings = [chr(c) for c in range(32, 127)] + ["\n"]
+    strings += [c for c, _ in chunks.most_common(size) if c not in strings]
+    return Vocabulary(strings + [None], eos_id=len(strings))
+
+
+def greedy(target, vocabulary, allowed=None, max_tokens=None):
+    """Token ids for ``target``, longest allowed match first"""
+    by_length = sorted((i for i, s in enumerate(vocabulary.strings) if s), key=lambda i: -len(vocabulary.strings[i]))
+    ids, pos = [], 0
+    while pos < len(target) and (max_tokens is None or len(ids) < max_tokens):
+        pool = allowed() if allowed else None
+        pool = set(pool) if pool is not None else None
+        for i in by_length:
+            if (pool is None or i in pool) and target.startswith(vocabulary.strings[i], pos):
+                break
+        else:
+            raise ValueError(f"no allowed token continues {target[pos:pos + 20]!r}")
+        ids.append(i)
+        pos += len(vocabulary.strings[i])
+        yield i
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--invoices", type=int, default=50)
+    parser.add_argument("--fields", default=FIELDS)
+    parser.add_argument("--max-new-tokens", type=int, default=512)
+    parser.add_argument("--vocab-size", type=int, default=4000, help="stand-in vocabulary chunks")
+    parser.add_argument("--tokenizer", help="Hugging Face tokenizer to use instead of the stand-in")
+    parser.add_argument("--seed", type=int, default=11)
+    args = parser.parse_args()
+
+    fields = args.fields.split(",")
+    rng = random.Random(args.seed)
+    invoices = [make_invoice(rng, items=rng.randint(3, 12)) for _ in range(args.invoices)]
+    answers = [answer(inv, fields) for inv in invoices]
+
+    if args.tokenizer:
+        from transformers import AutoTokenizer
+        vocabulary = Vocabulary.from_tokenizer(AutoTokenizer.from_pretrained(args.tokenizer))
+    else:
+        # Built from a separate set of invoices so the test answers are not memorized
+        train = random.Random(args.seed + 1)
+        corpus = [make_invoice(train) for _ in range(50)]
+        vocabulary = stand_in_vocabulary(
+            [free_text(i) + prompted_json(answer(i, fields)) + compact_json(answer(i, fields)) for i in corpus],
+            args.vocab_size)
+
+    counts = {"free_text": [], "prompted_json": [], "constrained": []}
+    mask_ms, parse_failures = [], 0
+    for invoice, obj in zip(invoices, answers):
+        counts["free_text"].append(len(list(greedy(free_text(invoice), vocabulary, max_tokens=args.max_new_tokens))))
+        counts["prompted_json"].append(len(list(greedy(prompted_json(obj), vocabulary, max_tokens=args.max_new_tokens))))
+
+        constraint = Constraint(grammar_for(fields), vocabulary)
+        text, tokens, started = "", 0, time.perf_counter()
+        for token in greedy(compact_json(obj), vocabulary, allowed=constraint.allowed):
+            constraint.advance(token)
+            text += vocabulary.strings[token]
+            tokens += 1
+        assert constraint.done and constraint.allowed() == [vocabulary.eos_id]
+        mask_ms.append(1000 * (time.perf_counter() - started) / (tokens + 1))
+        counts["constrained"].append(tokens + 1)  # + EOS
+        try:
+            parse_failures += json.loads(text) != obj
+        except ValueError:
+            parse_failures += 1
+
+    baseline = statistics.mean(counts["prompted_json"])
+    for mode, values in counts.items():
+        print(json.dumps({
+            "mode": mode,
+            "tokens_per_invoice": round(statistics.mean(values), 1),
+            "hit_max_new_tokens": sum(v >= args.max_new_tokens for v in values),
+            "vs_prompted_json": round(statistics.mean(values) / baseline, 3),
+        }))
+    print(json.dumps({
+        "mode": "constrained",
+        "parse_failures": parse_failures,
+        # Includes building masks the first time a grammar position is reached
+        "first_invoice_ms_per_token": round(mask_ms[0], 3),
+        "warm_ms_per_token": round(statistics.mean(mask_ms[1:] or mask_ms), 3),
+    }))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""Accuracy and latency of the CPU inference server against the fp16 GPU path.
+
+Renders synthetic invoice scans with known field values and posts each one,
+with the backend's prompt and field list, straight to every target's
+``/process``:
+
+* ``--gpu-url``: the fp16 GPU endpoint (the Colab notebook), the reference
+* ``--cpu-url``: CPU servers that are already running
+* ``--quantization`` x ``--threads``: CPU servers (``inference.server``)
+  this script starts one after another, timing their startup. The first
+  start of a quantization converts and caches the model; ``--starts 2``
+  restarts each one to time the cached start as well.
+
+Per target it reports field accuracy against the ground truth, overall and
+per field (exact match after normalizing case, spacing, currency symbols,
+thousands separators and date formats), agreement with the GPU answers,
+request latency percentiles and throughput, plus startup seconds and peak
+RSS for the servers it started. One JSON line per target.
+
+    python -m benchmarks.bench_cpu --gpu-url https://xxxx.ngrok-free.app/process --quantization int8,int4 --threads 8,16
+    python -m benchmarks.bench_cpu --cpu-url http://cpu-box:8000/process --gpu-url https://xxxx.ngrok-free.app/process
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from backend.main import build_prompt
+from benchmarks.bench_e2e import peak_rss_bytes, percentiles, start_server, wait_ready
+from benchmarks.synthetic import image_file, make_invoice
+
+FIELDS = ["vendor_name", "invoice_number", "invoice_date", "due_date", "total_amount", "tax_amount"]
+DATE_FORMATS = ("%Y-%m-%d", "%m/%d/%Y", "%d/%m/%Y", "%B %d, %Y", "%b %d, %Y", "%d %B %Y")
+
+
+def normalize(value: Any) -> Optional[str]:
+    if value in (None, ""):
+        return None
+    text = str(value).strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).strftime("%Y-%m-%d")
+        except ValueError:
+            pass
+    return re.sub(r"[\s$€£,]", "", text.lower())
+
+
+def extracted(result: Dict[str, Any]) -> Dict[str, Any]:
+    fields = result.get("extractedFields")
+    if isinstance(fields, str):
+        try:
+            fields = json.loads(fields)
+        except ValueError:
+            return {}
+    return fields if isinstance(fields, dict) else {}
+
+
+async def run_target(url: str, files, concurrency: int) -> Dict[str, Any]:
+    """Post every file; returns latencies, wall time and the fields each answer held"""
+    limit = asyncio.Semaphore(concurrency)
+    prompt = build_prompt(FIELDS)
+    answers: List[Optional[Dict[str, Any]]] = [None] * len(files)
+    latencies, errors = [], 0
+
+    async def post(client: httpx.AsyncClient, index: int, name: str, data: bytes):
+        nonlocal errors
+        async with limit:
+            started = time.perf_counter()
+            try:
+                response = await client.post(url, files={"file": (name, data, "image/png")},
+                                             data={"prompt": prompt, "fields": json.dumps(FIELDS)})
+                response.raise_for_status()
+                answers[index] = extracted(response.json())
+                latencies.append(1000 * (time.perf_counter() - started))
+            except httpx.HTTPError:
+                errors += 1
+
+    async with httpx.AsyncClient(timeout=600) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(post(client, i, name, data) for i, (name, data, _) in enumerate(files)))
+        seconds = time.perf_counter() - started
+    return {"answers": answers, "latencies": latencies, "seconds": seconds, "errors": errors}
+
+
+def score(files, run: Dict[str, Any], reference: Optional[List[Optional[Dict[str, Any]]]]) -> Dict[str, Any]:
+    correct = {f: 0 for f in FIELDS}
+    agree = total = 0
+    for i, (_, _, invoice) in enumerate(files):
+        answer = run["answers"][i] or {}
+        expected = invoice.expected_fields()
+        for field in FIELDS:
+            got = normalize(answer.get(field))
+            correct[field] += got is not None and got == normalize(expected[field])
+            if reference is not None and reference[i] is not None:
+                total += 1
+                agree += got == normalize(reference[i].get(field))
+    answered = len(files)
+    return {
+        "accuracy": round(sum(correct.values()) / (answered * len(FIELDS)), 3),
+        "fieldAccuracy": {f: round(c / answered, 3) for f, c in correct.items()},
+        "agreementWithGpu": round(agree / total, 3) if total else None,
+        "latency_ms": percentiles(run["latencies"]),
+        "files_per_sec": round(answered / run["seconds"], 3),
+        "errors": run["errors"],
+    }
+
+
+def start_cpu_server(args, quantization: str, threads: int, port: int) -> Dict[str, Any]:
+    """Start ``inference.server`` and time it until /health answers"""
+    started = time.perf_counter()
+    server = start_server("inference.server:app", port, {
+        "CPU_QUANTIZATION": quantization,
+        "CPU_THREADS": str(threads),
+        "ONNX_VISION": "1" if args.onnx_vision else "0",
+        **({"MODEL_CACHE_DIR": args.cache_dir} if args.cache_dir else {}),
+    })
+    url = f"http://127.0.0.1:{port}"
+    try:
+        wait_ready(url + "/health", timeout=args.startup_timeout)
+    except RuntimeError:
+        server.terminate()
+        server.wait()
+        raise
+    load = httpx.get(url + "/stats").json().get("load", {})
+    return {"server": server, "url": url + "/process", "startupSeconds": round(time.perf_counter() - started, 1),
+            "loadSeconds": load.get("loadSeconds"), "fromCache": load.get("fromCache")}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--dpi", type=int, default=200)
+    parser.add_argument("--gpu-url", help="fp16 GPU /process endpoint, used as the reference")
+    parser.add_argument("--cpu-url", action="append", default=[], help="running CPU /process endpoint (repeatable)")
+    parser.add_argument("--quantization", default="", help="comma-separated: none,int8,int4 - servers to start")
+    parser.add_argument("--threads", default="0", help="comma-separated intra-op thread counts; 0 = every core")
+    parser.add_argument("--starts", type=int, default=1, help="starts per started server; 2 times the cached start")
+    parser.add_argument("--onnx-vision", action="store_true")
+    parser.add_argument("--cache-dir", help="MODEL_CACHE_DIR for started servers")
+    parser.add_argument("--startup-timeout", type=float, default=1800)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--port", type=int, default=8794)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    files = []
+    for i in range(args.files):
+        invoice = make_invoice(rng, items=rng.randint(3, 10))
+        files.append((f"invoice_{i:04d}.png", image_file(invoice, args.dpi, "PNG", seed=i), invoice))
+
+    reference = None
+    if args.gpu_url:
+        run = asyncio.run(run_target(args.gpu_url, files, args.concurrency))
+        reference = run["answers"]
+        print(json.dumps({"target": "gpu-fp16", "url": args.gpu_url, **score(files, run, None)}, sort_keys=True))
+
+    for url in args.cpu_url:
+        run = asyncio.run(run_target(url, files, args.concurrency))
+        print(json.dumps({"target": "cpu", "url": url, **score(files, run, reference)}, sort_keys=True))
+
+    for quantization in [q.strip() for q in args.quantization.split(",") if q.strip()]:
+        for threads in [int(t) for t in args.threads.split(",")]:
+            starts = []
+            for _ in range(args.starts):
+                started = start_cpu_server(args, quantization, threads, args.port)
+                if len(starts) + 1 < args.starts:
+                    started["server"].terminate()
+                    started["server"].wait()
+                starts.append(started)
+            server = starts[-1]["server"]
+            try:
+                run = asyncio.run(run_target(starts[-1]["url"], files, args.concurrency))
+                rss = peak_rss_bytes(server.pid)
+            finally:
+                server.terminate()
+                server.wait()
+            print(json.dumps({
+                "target": f"cpu-{quantization}", "threads": threads, **score(files, run, reference),
+                "startups": [{k: s[k] for k in ("startupSeconds", "loadSeconds", "fromCache")} for s in starts],
+                "peak_rss_mb": round(rss / 2**20),
+            }, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Near-duplicate detection: copies found, different invoices never linked.
+
+For each of ``--invoices`` synthetic invoices the original goes into a
+``DuplicateDetector``, then copies are looked up against it:
+
+* ``rescan``: a re-scan of the same invoice (new scan noise, JPEG instead
+  of PNG);
+* ``amount_changed``: the same invoice with one line item's price changed,
+  so only the amounts differ - the case page hashes cannot tell apart;
+* ``pdf_resaved`` / ``pdf_amount_changed``: the same two cases for a
+  born-digital PDF, re-saved with other compression (different bytes, same
+  text).
+
+Runs with the default ``image_distance`` (0: images are not hashed and
+dedupe is text-only) and with ``--image-distance``, and reports per kind
+how many copies were fingerprinted, reported as similar, linked, and
+linked to another invoice, plus the fingerprint time of the originals. It
+exits with status 1 if the default links an image or a changed PDF, or
+misses a re-saved one.
+
+    python -m benchmarks.bench_dedupe --invoices 40 --image-distance 4
+"""
+import argparse
+import asyncio
+import dataclasses
+import io
+import json
+import random
+import sys
+import time
+
+from backend.dedupe import DuplicateDetector
+from backend.uploads import UploadPayload
+from benchmarks.bench_e2e import percentiles
+from benchmarks.synthetic import born_digital_pdf, image_file, make_invoice
+
+PROMPT = "Extract the following fields from the invoice: Vendor Name, Total Amount."
+KINDS = ("rescan", "amount_changed", "pdf_resaved", "pdf_amount_changed")
+
+
+def payload(name: str, data: bytes, content_type: str) -> UploadPayload:
+    return UploadPayload(name, io.BytesIO(data), len(data), content_type)
+
+
+def pdf_payload(name: str, data: bytes) -> UploadPayload:
+    return payload(name, data, "application/pdf")
+
+
+def amount_changed(invoice, rng: random.Random):
+    """The same invoice with the last line item's price changed"""
+    name, qty, price = invoice.line_items[-1]
+    new_price = round(price + rng.uniform(5, 300), 2)
+    return dataclasses.replace(invoice, line_items=invoice.line_items[:-1] + [(name, qty, new_price)])
+
+
+def resaved(data: bytes) -> bytes:
+    import fitz  # PyMuPDF
+
+    with fitz.open(stream=data, filetype="pdf") as doc:
+        return doc.tobytes(garbage=4, deflate=True)
+
+
+async def run(args, image_distance: int, files) -> dict:
+    detector = DuplicateDetector(image_distance=image_distance, report_distance=args.report_distance)
+    fingerprint_ms = []
+    for i, originals in enumerate(files):
+        for name, upload in ((f"invoice_{i}.png", payload(f"invoice_{i}.png", originals["image"], "image/png")),
+                             (f"invoice_{i}.pdf", pdf_payload(f"invoice_{i}.pdf", originals["pdf"]))):
+            started = time.perf_counter()
+            fingerprint = await detector.fingerprint(upload)
+            fingerprint_ms.append(1000 * (time.perf_counter() - started))
+            if fingerprint is not None:
+                detector.add(fingerprint, PROMPT, {"fileName": name})
+
+    counts = {kind: {"fingerprinted": 0, "reported": 0, "linked": 0, "linkedToOther": 0} for kind in KINDS}
+    for i, originals in enumerate(files):
+        for kind in KINDS:
+            pdf = kind.startswith("pdf")
+            upload = pdf_payload(f"{kind}_{i}.pdf", originals[kind]) if pdf \
+                else payload(f"{kind}_{i}.jpg", originals[kind], "image/jpeg")
+            fingerprint = await detector.fingerprint(upload)
+            if fingerprint is None:
+                continue
+            counts[kind]["fingerprinted"] += 1
+            match = detector.find(fingerprint, PROMPT)
+            if match is None:
+                continue
+            counts[kind]["reported"] += 1
+            if match[1]["linked"]:
+                counts[kind]["linked"] += 1
+                counts[kind]["linkedToOther"] += match[1]["fileName"] != f"invoice_{i}.{'pdf' if pdf else 'png'}"
+    return {"image_distance": image_distance, "invoices": len(files), **counts,
+            "fingerprint_ms": percentiles(fingerprint_ms)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--invoices", type=int, default=20)
+    parser.add_argument("--image-distance", type=int, default=4, help="linking distance to compare the default with")
+    parser.add_argument("--report-distance", type=int, default=8)
+    parser.add_argument("--dpi", type=int, default=150)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    files = []
+    for i in range(args.invoices):
+        invoice = make_invoice(rng)
+        changed = amount_changed(invoice, rng)
+        pdf = born_digital_pdf(invoice)
+        files.append({
+            "image": image_file(invoice, args.dpi, seed=i),
+            "pdf": pdf,
+            "rescan": image_file(invoice, args.dpi, "JPEG", seed=i + 10000),
+            "amount_changed": image_file(changed, args.dpi, "JPEG", seed=i + 20000),
+            "pdf_resaved": resaved(pdf),
+            "pdf_amount_changed": resaved(born_digital_pdf(changed)),
+        })
+
+    default = asyncio.run(run(args, 0, files))
+    print(json.dumps(default, sort_keys=True))
+    print(json.dumps(asyncio.run(run(args, args.image_distance, files)), sort_keys=True))
+    failures = []
+    if default["rescan"]["linked"] + default["amount_changed"]["linked"]:
+        failures.append("default links image matches")
+    if default["pdf_amount_changed"]["linked"]:
+        failures.append("default links PDFs whose amounts differ")
+    if default["pdf_resaved"]["linked"] < args.invoices:
+        failures.append(f"default links {default['pdf_resaved']['linked']}/{args.invoices} re-saved PDFs")
+    print(json.dumps({"check": "dedupe_default", "passed": not failures, "failures": failures}, sort_keys=True))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
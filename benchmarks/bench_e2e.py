@@ -0,0 +1,263 @@
+"""End-to-end benchmark of the backend against the mock model.
+
+Builds a synthetic corpus (PNG/JPEG scans, image-only PDFs and born-digital
+PDFs with varying page counts and DPI), starts the mock model and the real
+backend as separate uvicorn processes and drives each endpoint with
+``--concurrency`` concurrent clients. The backend is restarted for every
+endpoint so its peak RSS belongs to that run alone; the result cache is off
+unless ``--cache`` is given.
+
+Per endpoint it reports throughput, p50/p95/p99 request latency (overall and
+per file kind), peak backend RSS, and bytes uploaded / sent on to the model /
+returned per invoice. Output is one JSON document with sorted keys, so two
+runs can be diffed directly:
+
+    python -m benchmarks.bench_e2e --invoices 60 --out bench.json
+    diff <(jq . before.json) <(jq . bench.json)
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+import httpx
+
+from benchmarks.synthetic import CorpusFile, build_corpus
+
+FIELDS = ["vendor_name", "invoice_number", "invoice_date", "due_date", "total_amount", "tax_amount"]
+ENDPOINTS = ("process", "process_stream", "jobs")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    ordered = sorted(values)
+    pick = lambda q: round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 1)
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99), "max": round(ordered[-1], 1)}
+
+
+def start_server(app: str, port: int, env: Dict[str, str]) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env={**os.environ, **env}, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+def wait_ready(url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up")
+
+
+def peak_rss_bytes(pid: int) -> int:
+    # High-water mark of the resident set; Linux only
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def multipart(files: List[CorpusFile]):
+    return [("files", (f.name, f.data, f.content_type)) for f in files]
+
+
+async def call(client: httpx.AsyncClient, endpoint: str, files: List[CorpusFile]) -> Dict:
+    """One request; returns its timings, response size and error count"""
+    data = {"fields": json.dumps(FIELDS)}
+    started = time.perf_counter()
+    first_field = None
+    received = 0
+    if endpoint == "process":
+        response = await client.post("/process", files=multipart(files), data=data)
+        response.raise_for_status()
+        received = len(response.content)
+        results = response.json()
+    elif endpoint == "process_stream":
+        results = []
+        async with client.stream("POST", "/process/stream", files=multipart(files), data=data) as response:
+            response.raise_for_status()
+            event = None
+            async for line in response.aiter_lines():
+                received += len(line) + 1
+                if line.startswith("event:"):
+                    event = line[6:].strip()
+                    if event == "field" and first_field is None:
+                        first_field = 1000 * (time.perf_counter() - started)
+                elif line.startswith("data:") and event == "result":
+                    results.append(json.loads(line[5:])["result"])
+    else:
+        response = await client.post("/jobs", files=multipart(files), data=data)
+        response.raise_for_status()
+        received = len(response.content)
+        job_id = response.json()["jobId"]
+        async with client.stream("GET", f"/jobs/{job_id}/events") as events:
+            async for line in events.aiter_lines():
+                received += len(line) + 1
+                if line.startswith("event: done"):
+                    break
+        job = (await client.get(f"/jobs/{job_id}")).json()
+        received += len(json.dumps(job))
+        results = job["results"]
+    return {
+        "ms": 1000 * (time.perf_counter() - started),
+        "first_field_ms": first_field,
+        "received": received,
+        "errors": sum("error" in r for r in results),
+    }
+
+
+async def drive(base_url: str, endpoint: str, batches: List[List[CorpusFile]], concurrency: int) -> Dict:
+    queue: asyncio.Queue = asyncio.Queue()
+    for batch in batches:
+        queue.put_nowait(batch)
+    samples = []
+
+    async def worker(client: httpx.AsyncClient):
+        while not queue.empty():
+            batch = queue.get_nowait()
+            try:
+                sample = await call(client, endpoint, batch)
+            except httpx.HTTPError as e:
+                sample = {"ms": None, "first_field_ms": None, "received": 0, "errors": len(batch), "failed": str(e)}
+            samples.append((batch, sample))
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=300) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return {"seconds": elapsed, "samples": samples}
+
+
+def run_endpoint(args, endpoint: str, corpus: List[CorpusFile], model_url: str) -> Dict:
+    env = {
+        "COLAB_URL": f"{model_url}/process",
+        "RESULT_CACHE_BYTES": str(64 * 1024 * 1024) if args.cache else "0",
+        "HEALTH_PROBE_INTERVAL": "0",
+        "TEXT_ROUTING": "1" if args.text_routing else "0",
+    }
+    backend = start_server("backend.main:app", args.port, env)
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        wait_ready(base_url + "/backends/stats")
+        batches = [corpus[i:i + args.files_per_request] for i in range(0, len(corpus), args.files_per_request)]
+        if args.warmup:
+            asyncio.run(drive(base_url, endpoint, batches[:args.warmup], 1))
+        model_before = httpx.get(model_url + "/stats").json()
+        run = asyncio.run(drive(base_url, endpoint, batches, args.concurrency))
+        model_after = httpx.get(model_url + "/stats").json()
+        rss = peak_rss_bytes(backend.pid)
+    finally:
+        backend.terminate()
+        backend.wait()
+
+    invoices = len(corpus)
+    samples = run["samples"]
+    by_kind = defaultdict(list)
+    for batch, sample in samples:
+        if sample["ms"] is not None:
+            for f in batch:
+                by_kind[f.kind].append(sample["ms"])
+    latencies = [s["ms"] for _, s in samples if s["ms"] is not None]
+    first_fields = [s["first_field_ms"] for _, s in samples if s["first_field_ms"] is not None]
+    result = {
+        "endpoint": endpoint,
+        "requests": len(samples),
+        "invoices": invoices,
+        "errors": sum(s["errors"] for _, s in samples),
+        "seconds": round(run["seconds"], 3),
+        "invoices_per_sec": round(invoices / run["seconds"], 2),
+        "latency_ms": percentiles(latencies),
+        "latency_ms_by_kind": {kind: percentiles(v) for kind, v in sorted(by_kind.items())},
+        "peak_rss_mb": round(rss / 2 ** 20, 1),
+        "bytes_per_invoice": {
+            "uploaded": round(sum(len(f.data) for f in corpus) / invoices),
+            "to_model": round((model_after["bytes_received"] - model_before["bytes_received"]) / invoices),
+            "returned": round(sum(s["received"] for _, s in samples) / invoices),
+        },
+        "model_calls_per_invoice": round((model_after["requests"] - model_before["requests"]) / invoices, 2),
+    }
+    if first_fields:
+        result["time_to_first_field_ms"] = percentiles(first_fields)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--invoices", type=int, default=60)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--kinds", default="image,scanned_pdf,digital_pdf")
+    parser.add_argument("--pages", default="1,2,4", help="page counts for PDFs")
+    parser.add_argument("--dpis", default="100,200,300")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS))
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent clients")
+    parser.add_argument("--files-per-request", type=int, default=1)
+    parser.add_argument("--warmup", type=int, default=2, help="unmeasured requests per endpoint")
+    parser.add_argument("--latency-ms", type=float, default=200, help="mock model latency per call")
+    parser.add_argument("--token-ms", type=float, default=0, help="mock model time per streamed token")
+    parser.add_argument("--failure-rate", type=float, default=0)
+    parser.add_argument("--cache", action="store_true", help="leave the backend's result cache on")
+    parser.add_argument("--no-text-routing", dest="text_routing", action="store_false")
+    parser.add_argument("--port", type=int, default=8790)
+    parser.add_argument("--model-port", type=int, default=8791)
+    parser.add_argument("--out", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    corpus = build_corpus(args.invoices, args.seed, args.kinds.split(","),
+                          [int(p) for p in args.pages.split(",")], [int(d) for d in args.dpis.split(",")])
+    corpus_seconds = time.perf_counter() - started
+
+    model = start_server("benchmarks.mock_model:app", args.model_port, {
+        "MOCK_LATENCY_MS": str(args.latency_ms),
+        "MOCK_TOKEN_MS": str(args.token_ms),
+        "MOCK_FAILURE_RATE": str(args.failure_rate),
+    })
+    model_url = f"http://127.0.0.1:{args.model_port}"
+    try:
+        wait_ready(model_url + "/health")
+        scenarios = [run_endpoint(args, endpoint, corpus, model_url) for endpoint in args.endpoints.split(",")]
+    finally:
+        model.terminate()
+        model.wait()
+
+    kinds = defaultdict(lambda: {"files": 0, "pages": 0, "bytes": 0})
+    for f in corpus:
+        kinds[f.kind]["files"] += 1
+        kinds[f.kind]["pages"] += f.pages
+        kinds[f.kind]["bytes"] += len(f.data)
+    report = {
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "port", "model_port")},
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "commit": subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                     capture_output=True, text=True).stdout.strip() or None,
+        },
+        "corpus": {"invoices": len(corpus), "build_seconds": round(corpus_seconds, 2), "by_kind": dict(kinds)},
+        "scenarios": scenarios,
+    }
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
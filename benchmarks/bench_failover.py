@@ -0,0 +1,64 @@
+"""Load balancing and failover across several local mock backends.
+
+Starts ``--healthy`` well-behaved mocks and one that fails most calls, sends
+a batch through a BackendPool and prints per-backend stats. Every file
+should still succeed; the bad backend should end up with its circuit open.
+
+    python -m benchmarks.bench_failover --files 60
+"""
+import argparse
+import asyncio
+import io
+import json
+import time
+
+from backend.backends import BackendPool
+from backend.inference_client import InferenceClient
+from backend.uploads import UploadPayload
+from benchmarks.mock_model import create_app, serve
+
+PROMPT = "Extract the following fields from the invoice: Vendor Name, Total Amount."
+
+
+async def run(urls, files: int, concurrency: int):
+    pool = BackendPool(urls, failure_threshold=3, cooldown=5, max_retries=2, backoff=0.05, probe_interval=1)
+    client = InferenceClient(pool, concurrency)
+    client.start()
+    try:
+        payloads = [UploadPayload(f"invoice_{i}.pdf", io.BytesIO(b"%PDF-1.4 demo"), 13) for i in range(files)]
+        start = time.perf_counter()
+        results = await client.process_many(payloads, PROMPT, concurrency)
+        elapsed = time.perf_counter() - start
+    finally:
+        await client.aclose()
+    return {
+        "files": files,
+        "errors": sum("error" in r for r in results),
+        "seconds": round(elapsed, 3),
+        "backends": pool.stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=60)
+    parser.add_argument("--healthy", type=int, default=2)
+    parser.add_argument("--latency-ms", type=float, default=100)
+    parser.add_argument("--bad-failure-rate", type=float, default=0.9)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--port", type=int, default=8770)
+    args = parser.parse_args()
+
+    servers, urls = [], []
+    for i in range(args.healthy + 1):
+        failure_rate = args.bad_failure_rate if i == args.healthy else 0.0
+        servers.append(serve(create_app(args.latency_ms, failure_rate), args.port + i))
+        urls.append(f"http://127.0.0.1:{args.port + i}/process")
+
+    print(json.dumps(asyncio.run(run(urls, args.files, args.concurrency)), indent=2))
+    for server in servers:
+        server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
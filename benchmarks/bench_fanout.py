@@ -0,0 +1,74 @@
+"""Throughput of the old sequential requests.post loop vs the pooled InferenceClient.
+
+    python -m benchmarks.bench_fanout --files 50 --latency-ms 200
+"""
+import argparse
+import asyncio
+import io
+import json
+import time
+
+import requests
+
+from backend.inference_client import InferenceClient
+from backend.uploads import UploadPayload
+from benchmarks.mock_model import create_app, serve
+
+PROMPT = "Extract the following fields from the invoice: Vendor Name, Total Amount."
+
+
+def make_files(count: int, size: int):
+    return [(f"invoice_{i}.pdf", b"%PDF-1.4\n" + b"0" * size) for i in range(count)]
+
+
+def run_sequential(url: str, files):
+    # Mirrors the original /process loop: one blocking post per file, no session
+    for name, data in files:
+        response = requests.post(url, files={"file": (name, io.BytesIO(data))},
+                                 data={"prompt": PROMPT}, timeout=60)
+        response.raise_for_status()
+
+
+async def run_concurrent(url: str, files, global_limit: int, request_limit: int):
+    client = InferenceClient(url, global_limit)
+    try:
+        payloads = [UploadPayload(name, io.BytesIO(data), len(data)) for name, data in files]
+        results = await client.process_many(payloads, PROMPT, request_limit)
+        assert [r["fileName"] for r in results] == [name for name, _ in files]
+    finally:
+        await client.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=50)
+    parser.add_argument("--size", type=int, default=256 * 1024, help="bytes per file")
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--limits", default="4,8,16", help="per-request caps to try")
+    args = parser.parse_args()
+
+    server = serve(create_app(args.latency_ms), args.port)
+    url = f"http://127.0.0.1:{args.port}/process"
+    files = make_files(args.files, args.size)
+
+    runs = []
+    start = time.perf_counter()
+    run_sequential(url, files)
+    runs.append({"mode": "sequential", "limit": 1, "seconds": time.perf_counter() - start})
+
+    for limit in (int(x) for x in args.limits.split(",")):
+        start = time.perf_counter()
+        asyncio.run(run_concurrent(url, files, max(limit, 16), limit))
+        runs.append({"mode": "pooled", "limit": limit, "seconds": time.perf_counter() - start})
+
+    for run in runs:
+        run["files_per_sec"] = round(args.files / run["seconds"], 2)
+        run["seconds"] = round(run["seconds"], 3)
+        print(json.dumps(run))
+
+    server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
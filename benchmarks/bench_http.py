@@ -0,0 +1,276 @@
+"""Microbenchmarks for the model HTTP client against local mock servers.
+
+* ``connections``: a new client per call - what ``ModelAPIClient`` did with
+  its per-call aiohttp session - against the shared pooled client, over
+  plain HTTP and, when ``openssl`` is available, TLS with a self-signed
+  certificate (the ngrok tunnel is TLS), sequential and ``--concurrency``
+  wide.
+* ``gzip``: wire bytes with and without gzipped bodies per file kind of the
+  synthetic corpus, the compression cost, and the mean call latency through
+  a mock whose uplink is limited to ``--uplink-mbps``.
+* ``gzip_bomb``: a small gzip body that inflates to ``--bomb-mb`` sent
+  through ``GzipRequestMiddleware`` in process; it must be refused with 413
+  and peak allocation must stay under ``BOMB_PEAK_MB``, whatever the limit.
+* ``deadline``: a backend slower than the deadline; how long until the
+  caller gets its answer (or error), with a deadline and with only the flat
+  per-attempt timeout, and whether the deadline reached the server.
+* ``hedging``: two backends where ``--slow-rate`` of the calls take
+  ``--slow-ms`` longer; latency percentiles and the extra load with and
+  without hedging.
+* ``http2``: whether the client can use HTTP/2 here (needs ``h2``).
+
+One JSON line per measurement. It exits with status 1 if a check fails.
+
+    python -m benchmarks.bench_http --calls 400 --concurrency 8
+    python -m benchmarks.bench_http --only hedging --slow-rate 0.02 --hedge-quantile 0.95
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zlib
+from typing import Callable, Dict, List, Optional
+
+import httpx
+import uvicorn
+
+from backend.backends import BackendPool
+from backend.inference_client import InferenceClient
+from backend.model_http import GzipRequestMiddleware, http2_available
+from backend.uploads import UploadPayload, multipart_body
+from benchmarks.bench_e2e import percentiles
+from benchmarks.mock_model import create_app, serve
+from benchmarks.synthetic import build_corpus
+
+PORT = 8870
+BOMB_PEAK_MB = 4  # a few INFLATE_STEPs
+
+
+def self_signed_cert(directory: str) -> Optional[Dict[str, str]]:
+    if shutil.which("openssl") is None:
+        return None
+    key, cert = os.path.join(directory, "key.pem"), os.path.join(directory, "cert.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=127.0.0.1",
+                    "-keyout", key, "-out", cert], check=True, capture_output=True)
+    return {"ssl_keyfile": key, "ssl_certfile": cert}
+
+
+def serve_tls(app, port: int, tls: Dict[str, str]) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", **tls))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server
+
+
+def payload_for(data: bytes, name: str = "invoice.png", content_type: str = "image/png") -> UploadPayload:
+    return UploadPayload(name, io.BytesIO(data), len(data), content_type)
+
+
+async def timed_calls(call: Callable, calls: int, concurrency: int) -> Dict:
+    limit = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors = 0
+
+    async def one():
+        nonlocal errors
+        async with limit:
+            started = time.perf_counter()
+            try:
+                await call()
+            except Exception:
+                errors += 1
+            latencies.append(1000 * (time.perf_counter() - started))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(calls)))
+    seconds = time.perf_counter() - started
+    return {"ms": percentiles(latencies), "calls_per_sec": round(calls / seconds, 1), "errors": errors}
+
+
+async def connections(args, data: bytes):
+    with tempfile.TemporaryDirectory() as directory:
+        tls = self_signed_cert(directory)
+        servers = [("http", serve(create_app(0), PORT))]
+        if tls is not None:
+            servers.append(("https", serve_tls(create_app(0), PORT + 1, tls)))
+        for scheme, server in servers:
+            url = f"{scheme}://127.0.0.1:{server.config.port}/process"
+            shared = httpx.AsyncClient(verify=False, limits=httpx.Limits(max_connections=args.concurrency))
+
+            async def post(client: httpx.AsyncClient):
+                body, headers = multipart_body(payload_for(data), {"prompt": "Extract"})
+                (await client.post(url, content=body, headers=headers)).raise_for_status()
+
+            async def per_call():
+                async with httpx.AsyncClient(verify=False) as client:
+                    await post(client)
+
+            for concurrency in (1, args.concurrency):
+                for name, call in (("per_call_client", per_call), ("shared_client", lambda: post(shared))):
+                    result = await timed_calls(call, args.calls, concurrency)
+                    print(json.dumps({"bench": "connections", "scheme": scheme, "client": name,
+                                      "concurrency": concurrency, **result}, sort_keys=True))
+            await shared.aclose()
+            server.should_exit = True
+
+
+async def gzip_bodies(args, corpus):
+    by_kind: Dict[str, List] = {}
+    for f in corpus:
+        by_kind.setdefault(f.kind, []).append(f)
+    for kind, files in by_kind.items():
+        raw = sum(len(f.data) for f in files)
+        started = time.perf_counter()
+        packed = sum(len(zlib.compress(f.data, 6, wbits=31)) for f in files)
+        ms = 1000 * (time.perf_counter() - started)
+        saved_ms = (raw - packed) * 8 / (args.uplink_mbps * 1e3) / len(files)
+        print(json.dumps({"bench": "gzip", "kind": kind, "content_type": files[0].content_type, "files": len(files),
+                          "raw_kb": round(raw / 1024, 1), "gzip_kb": round(packed / 1024, 1),
+                          "ratio": round(packed / raw, 3), "compress_ms_per_mb": round(ms / (raw / 2**20), 1),
+                          "uplink_ms_saved_per_file": round(saved_ms, 1)}, sort_keys=True))
+
+    # End to end through the mock, whose uplink is rate limited on the bytes as received
+    compressible = [f for f in corpus if f.kind != "image"]
+    for gzip in (False, True):
+        server = serve(create_app(0, upload_mbps=args.uplink_mbps), PORT + 2)
+        client = InferenceClient(f"http://127.0.0.1:{PORT + 2}/process", args.concurrency, gzip=gzip)
+        latencies, errors = [], 0
+        for f in compressible:
+            started = time.perf_counter()
+            result = await client.try_process(payload_for(f.data, f.name, f.content_type), "Extract")
+            latencies.append(1000 * (time.perf_counter() - started))
+            errors += "error" in result
+        stats = httpx.get(f"http://127.0.0.1:{PORT + 2}/stats").json()
+        print(json.dumps({"bench": "gzip_e2e", "gzip": gzip, "files": len(compressible), "errors": errors,
+                          "uplink_mbps": args.uplink_mbps, "wire_kb": round(stats["bytes_received"] / 1024, 1),
+                          "ms": percentiles(latencies)}, sort_keys=True))
+        await client.aclose()
+        server.should_exit = True
+        await asyncio.sleep(0.2)
+
+
+async def gzip_bomb(args) -> bool:
+    packer = zlib.compressobj(9, wbits=31)
+    zeros = bytes(2**20)
+    body = b"".join(packer.compress(zeros) for _ in range(args.bomb_mb)) + packer.flush()
+    limit = 200 * 2**20  # the middleware's default
+    # Chunked the way uvicorn hands a request body to the app
+    chunks = [body[i:i + 65536] for i in range(0, len(body), 65536)]
+    messages = [{"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1}
+                for i, chunk in enumerate(chunks)]
+
+    async def app(scope, receive, send):
+        # Reads and drops the body, so only the middleware's own buffers count
+        while (await receive()).get("more_body"):
+            pass
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def receive():
+        return messages.pop(0)
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "POST", "path": "/process", "headers": [(b"content-encoding", b"gzip")]}
+    tracemalloc.start()
+    started = time.perf_counter()
+    await GzipRequestMiddleware(app, max_bytes=limit)(scope, receive, send)
+    elapsed_ms = 1000 * (time.perf_counter() - started)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    status = sent[0]["status"]
+    passed = status == 413 and peak < BOMB_PEAK_MB * 2**20
+    print(json.dumps({"bench": "gzip_bomb", "gzip_kb": round(len(body) / 1024, 1), "inflates_mb": args.bomb_mb,
+                      "limit_mb": limit / 2**20, "status": status, "peak_mb": round(peak / 2**20, 1),
+                      "ms": round(elapsed_ms, 1), "passed": passed}, sort_keys=True))
+    return passed
+
+
+async def deadline(args, data: bytes):
+    server = serve(create_app(args.slow_ms), PORT + 3)
+    url = f"http://127.0.0.1:{PORT + 3}/process"
+    for name, seconds in (("flat_timeout", None), ("deadline", args.deadline_ms / 1000)):
+        pool = BackendPool([url], max_retries=2, probe_interval=0)
+        client = InferenceClient(pool, timeout=60.0, deadline=seconds)
+        started = time.perf_counter()
+        result = await client.try_process(payload_for(data), "Extract")
+        print(json.dumps({"bench": "deadline", "mode": name, "server_ms": args.slow_ms,
+                          "deadline_ms": args.deadline_ms if seconds else None,
+                          "elapsed_ms": round(1000 * (time.perf_counter() - started), 1),
+                          "error": result.get("error"), "attempts": pool.backends[0].requests}, sort_keys=True))
+        await client.aclose()
+    stats = httpx.get(f"http://127.0.0.1:{PORT + 3}/stats").json()
+    print(json.dumps({"bench": "deadline_header", "requests": stats["requests"],
+                      "with_deadline": stats["with_deadline"]}, sort_keys=True))
+    server.should_exit = True
+
+
+async def hedging(args, data: bytes):
+    servers = [serve(create_app(args.latency_ms, slow_rate=args.slow_rate, slow_ms=args.slow_ms), PORT + 4 + i)
+               for i in range(2)]
+    urls = [f"http://127.0.0.1:{s.config.port}/process" for s in servers]
+    for quantile in (0.0, args.hedge_quantile):
+        before = sum(httpx.get(u.replace("/process", "/stats")).json()["requests"] for u in urls)
+        pool = BackendPool(urls, probe_interval=0, hedge_quantile=quantile, hedge_min=args.latency_ms / 1000,
+                           hedge_budget=args.hedge_budget)
+        client = InferenceClient(pool, args.concurrency)
+        result = await timed_calls(lambda: client.process(payload_for(data), "Extract"), args.calls, args.concurrency)
+        sent = sum(httpx.get(u.replace("/process", "/stats")).json()["requests"] for u in urls) - before
+        print(json.dumps({"bench": "hedging", "hedge_quantile": quantile or None, "slow_rate": args.slow_rate,
+                          "slow_ms": args.slow_ms, "extra_load": round(sent / args.calls - 1, 3),
+                          "hedged": pool.hedges, **result}, sort_keys=True))
+        await client.aclose()
+    for server in servers:
+        server.should_exit = True
+
+
+async def run(args) -> bool:
+    print(json.dumps({"bench": "http2", "available": http2_available(),
+                      "note": None if http2_available() else "install h2 to multiplex calls over one connection"},
+                     sort_keys=True))
+    corpus = build_corpus(args.files, seed=args.seed)
+    data = next(f.data for f in corpus if f.kind == "image")
+    benches = {"connections": lambda: connections(args, data), "gzip": lambda: gzip_bodies(args, corpus),
+               "gzip_bomb": lambda: gzip_bomb(args), "deadline": lambda: deadline(args, data),
+               "hedging": lambda: hedging(args, data)}
+    passed = True
+    for name, bench in benches.items():
+        if args.only in (None, name):
+            # Checks return whether they passed; measurements return None
+            passed = await bench() is not False and passed
+            await asyncio.sleep(0.2)  # let the previous servers shut down
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", choices=["connections", "gzip", "gzip_bomb", "deadline", "hedging"])
+    parser.add_argument("--calls", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--files", type=int, default=12, help="synthetic corpus size for the gzip bench")
+    parser.add_argument("--uplink-mbps", type=float, default=20)
+    parser.add_argument("--bomb-mb", type=int, default=1024, help="what the gzip_bomb body inflates to")
+    parser.add_argument("--latency-ms", type=float, default=50, help="mock model latency for the hedging bench")
+    parser.add_argument("--slow-rate", type=float, default=0.02)
+    parser.add_argument("--slow-ms", type=float, default=1000)
+    parser.add_argument("--hedge-quantile", type=float, default=0.95)
+    parser.add_argument("--hedge-budget", type=float, default=0.1)
+    parser.add_argument("--deadline-ms", type=float, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    sys.exit(0 if asyncio.run(run(parser.parse_args())) else 1)
+
+
+if __name__ == "__main__":
+    main()
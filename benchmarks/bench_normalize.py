@@ -0,0 +1,118 @@
+"""Bytes on the wire and latency with and without upload-side image normalization.
+
+Generates phone photos of receipts (large, noisy, sideways JPEGs with an
+EXIF orientation) plus ordinary scans, starts the mock model with
+``--upload-mbps`` standing in for the tunnel to the GPU, and posts every
+file to the real backend's ``/process`` twice: once with
+``NORMALIZE_IMAGES=0`` and once with it on. Reports bytes uploaded and
+sent to the model per file, request latency and the backend's own
+``/normalize/stats``.
+
+    python -m benchmarks.bench_normalize --photos 12 --scans 12 --upload-mbps 10
+    python -m benchmarks.bench_normalize --format WEBP --quality 70 --grayscale
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import httpx
+
+from benchmarks.bench_e2e import percentiles, start_server, wait_ready
+from benchmarks.synthetic import image_file, make_invoice, phone_photo
+
+FIELDS = ["vendor_name", "invoice_number", "invoice_date", "total_amount"]
+
+
+async def post_all(url: str, files, concurrency: int):
+    limit = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def post(client: httpx.AsyncClient, name: str, data: bytes):
+        async with limit:
+            started = time.perf_counter()
+            response = await client.post("/process", files={"files": (name, data, "image/jpeg")},
+                                         data={"fields": json.dumps(FIELDS)})
+            response.raise_for_status()
+            latencies.append(1000 * (time.perf_counter() - started))
+
+    async with httpx.AsyncClient(base_url=url, timeout=300) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(post(client, name, data) for name, data in files))
+        return latencies, time.perf_counter() - started
+
+
+def run(args, files, model_url: str, normalize: bool) -> dict:
+    env = {
+        "COLAB_URL": f"{model_url}/process",
+        "RESULT_CACHE_BYTES": "0",
+        "HEALTH_PROBE_INTERVAL": "0",
+        "NORMALIZE_IMAGES": "1" if normalize else "0",
+        "NORMALIZE_MAX_SIDE": str(args.max_side),
+        "NORMALIZE_FORMAT": args.format,
+        "NORMALIZE_QUALITY": str(args.quality),
+        "NORMALIZE_GRAYSCALE": "1" if args.grayscale else "0",
+        "NORMALIZE_AUTOCONTRAST": "1" if args.autocontrast else "0",
+        "NORMALIZE_WORKERS": str(args.workers),
+    }
+    backend = start_server("backend.main:app", args.port, env)
+    url = f"http://127.0.0.1:{args.port}"
+    try:
+        wait_ready(url + "/normalize/stats")
+        before = httpx.get(model_url + "/stats").json()
+        latencies, seconds = asyncio.run(post_all(url, files, args.concurrency))
+        after = httpx.get(model_url + "/stats").json()
+        stats = httpx.get(url + "/normalize/stats").json()
+    finally:
+        backend.terminate()
+        backend.wait()
+    return {
+        "normalize": normalize,
+        "files": len(files),
+        "uploaded_bytes_per_file": round(sum(len(d) for _, d in files) / len(files)),
+        "to_model_bytes_per_file": round((after["bytes_received"] - before["bytes_received"]) / len(files)),
+        "latency_ms": percentiles(latencies),
+        "files_per_sec": round(len(files) / seconds, 2),
+        "normalize_stats": stats,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--photos", type=int, default=12, help="phone photos (500 DPI, quality 95)")
+    parser.add_argument("--scans", type=int, default=12, help="200 DPI scanner JPEGs")
+    parser.add_argument("--upload-mbps", type=float, default=10, help="simulated uplink to the model server")
+    parser.add_argument("--latency-ms", type=float, default=300, help="mock model latency per call")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--max-side", type=int, default=2048)
+    parser.add_argument("--format", default="JPEG", choices=["JPEG", "WEBP"])
+    parser.add_argument("--quality", type=int, default=80)
+    parser.add_argument("--grayscale", action="store_true")
+    parser.add_argument("--autocontrast", action="store_true")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--port", type=int, default=8792)
+    parser.add_argument("--model-port", type=int, default=8793)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    files = [(f"photo_{i}.jpg", phone_photo(make_invoice(rng), seed=i)) for i in range(args.photos)]
+    files += [(f"scan_{i}.jpg", image_file(make_invoice(rng), 200, "JPEG", seed=i)) for i in range(args.scans)]
+
+    model = start_server("benchmarks.mock_model:app", args.model_port, {
+        "MOCK_LATENCY_MS": str(args.latency_ms),
+        "MOCK_UPLOAD_MBPS": str(args.upload_mbps),
+    })
+    model_url = f"http://127.0.0.1:{args.model_port}"
+    try:
+        wait_ready(model_url + "/health")
+        for normalize in (False, True):
+            print(json.dumps(run(args, files, model_url, normalize), sort_keys=True))
+    finally:
+        model.terminate()
+        model.wait()
+
+
+if __name__ == "__main__":
+    main()
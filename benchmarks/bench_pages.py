@@ -0,0 +1,90 @@
+"""Multi-page scanned PDFs: pages one at a time vs concurrently.
+
+Posts image-only PDFs of ``--pages`` page counts to the real backend's
+``/process`` against the mock model, once with ``PAGE_CONCURRENCY=1`` and
+once with ``--concurrency`` pages in flight per document. Reports document
+latency per page count, the per-page latency the backend measured and the
+number of model calls per document.
+
+    python -m benchmarks.bench_pages --docs 4 --pages 1,2,4,8 --latency-ms 400
+"""
+import argparse
+import json
+import random
+import time
+from collections import defaultdict
+
+import httpx
+
+from benchmarks.bench_e2e import percentiles, start_server, wait_ready
+from benchmarks.synthetic import make_invoice, scanned_pdf
+
+FIELDS = ["vendor_name", "invoice_number", "invoice_date", "total_amount", "line_items"]
+
+
+def run(args, documents, model_url: str, concurrency: int) -> dict:
+    env = {
+        "COLAB_URL": f"{model_url}/process",
+        "RESULT_CACHE_BYTES": "0",
+        "HEALTH_PROBE_INTERVAL": "0",
+        "PAGE_CONCURRENCY": str(concurrency),
+        "PAGE_DPI": str(args.dpi),
+    }
+    backend = start_server("backend.main:app", args.port, env)
+    url = f"http://127.0.0.1:{args.port}"
+    by_pages, page_ms = defaultdict(list), []
+    try:
+        wait_ready(url + "/pages/stats")
+        before = httpx.get(model_url + "/stats").json()
+        with httpx.Client(base_url=url, timeout=300) as client:
+            for pages, data in documents:
+                started = time.perf_counter()
+                response = client.post("/process", files={"files": (f"scan_{pages}p.pdf", data, "application/pdf")},
+                                       data={"fields": json.dumps(FIELDS)})
+                response.raise_for_status()
+                by_pages[pages].append(1000 * (time.perf_counter() - started))
+                result = response.json()[0]
+                assert "error" not in result, result["error"]
+                # Single-page documents skip the split, so they have no per-page timings
+                page_ms.extend(p["ms"] for p in result.get("pages", []))
+        after = httpx.get(model_url + "/stats").json()
+    finally:
+        backend.terminate()
+        backend.wait()
+    return {
+        "page_concurrency": concurrency,
+        "document_ms_by_pages": {n: percentiles(v) for n, v in sorted(by_pages.items())},
+        "page_ms": percentiles(page_ms),
+        "model_calls_per_document": round((after["requests"] - before["requests"]) / len(documents), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=4, help="documents per page count")
+    parser.add_argument("--pages", default="1,2,4,8")
+    parser.add_argument("--dpi", type=int, default=150)
+    parser.add_argument("--concurrency", type=int, default=4, help="pages in flight per document")
+    parser.add_argument("--latency-ms", type=float, default=400, help="mock model latency per call")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--port", type=int, default=8794)
+    parser.add_argument("--model-port", type=int, default=8795)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    documents = [(n, scanned_pdf(make_invoice(rng, items=6 * n), n, args.dpi, seed=i))
+                 for n in map(int, args.pages.split(",")) for i in range(args.docs)]
+
+    model = start_server("benchmarks.mock_model:app", args.model_port, {"MOCK_LATENCY_MS": str(args.latency_ms)})
+    model_url = f"http://127.0.0.1:{args.model_port}"
+    try:
+        wait_ready(model_url + "/health")
+        for concurrency in (1, args.concurrency):
+            print(json.dumps(run(args, documents, model_url, concurrency), sort_keys=True))
+    finally:
+        model.terminate()
+        model.wait()
+
+
+if __name__ == "__main__":
+    main()
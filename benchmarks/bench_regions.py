@@ -0,0 +1,57 @@
+"""Vision tokens and latency per page: full page vs ROI crops.
+
+The layout pass and cropping are timed for real. Model time is modeled
+from the token count (``--prefill-ms-per-1k`` per thousand vision tokens
+plus a fixed ``--decode-ms`` per prompt), since CI has no GPU; pass the
+numbers measured on the notebook server to get realistic totals. With
+``--crops-batched`` the crops of a page are assumed to share one batched
+generate (as the notebook's BatchScheduler does), so decode is paid once.
+
+    python -m benchmarks.bench_regions --pages 10 --dpi 200
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+
+from benchmarks.synthetic import make_invoice, render_page
+from inference.regions import MODES, prepare_regions, vision_tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--dpi", type=int, default=200)
+    parser.add_argument("--max-side", type=int, default=1280)
+    parser.add_argument("--prefill-ms-per-1k", type=float, default=120.0)
+    parser.add_argument("--decode-ms", type=float, default=900.0)
+    parser.add_argument("--crops-batched", action="store_true")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    pages = [render_page(make_invoice(rng), args.dpi, noise=i % 2, seed=i) for i in range(args.pages)]
+
+    for mode in MODES:
+        tokens, prep_ms, model_ms, crops = [], [], [], []
+        for page in pages:
+            start = time.perf_counter()
+            images = prepare_regions(page, mode, max_side=args.max_side)
+            prep_ms.append(1000 * (time.perf_counter() - start))
+            page_tokens = sum(vision_tokens(im.size) for im in images)
+            tokens.append(page_tokens)
+            crops.append(len(images))
+            prompts = 1 if args.crops_batched else len(images)
+            model_ms.append(page_tokens / 1000 * args.prefill_ms_per_1k + prompts * args.decode_ms)
+        print(json.dumps({
+            "mode": mode,
+            "crops_per_page": statistics.mean(crops),
+            "vision_tokens_per_page": round(statistics.mean(tokens)),
+            "preprocess_ms": round(statistics.mean(prep_ms), 1),
+            "modeled_end_to_end_ms": round(statistics.mean(p + m for p, m in zip(prep_ms, model_ms)), 1),
+        }))
+
+
+if __name__ == "__main__":
+    main()
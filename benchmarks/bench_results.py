@@ -0,0 +1,140 @@
+"""Filtered queries, aggregates and exports on a large results store.
+
+Fills a fresh ``ResultStore`` with ``--rows`` synthetic extraction results
+(``--vendors`` distinct vendors, dates over several years, amounts
+formatted as the model returns them, ``--missing`` of them without a date
+or total), then times the queries the ``/invoices`` routes run: lookups by
+invoice number, vendor and vendor prefix pages, date and amount range
+pages, a page deep into a cursor walk, aggregates and a CSV export. Each
+query runs ``--repeat`` times; the median and worst are reported. A full
+cursor walk over one vendor checks that paging returns every row exactly
+once. One JSON line per query, then a summary line.
+
+    python -m benchmarks.bench_results --rows 1000000
+    python -m benchmarks.bench_results --rows 200000 --db /tmp/results.sqlite3
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from backend.results import InvoiceQuery, ResultStore
+from benchmarks.synthetic import VENDORS, make_invoice
+
+DATE_STYLES = ("%Y-%m-%d", "%m/%d/%Y", "%B %d, %Y")
+
+
+def results(args, rng: random.Random):
+    """``(sha256, result)`` pairs shaped like the backend's extraction results"""
+    for i in range(args.rows):
+        invoice = make_invoice(rng, items=args.items)
+        fields = invoice.expected_fields()
+        fields["vendor_name"] = f"{VENDORS[i % len(VENDORS)]} {rng.randrange(args.vendors // len(VENDORS) or 1)}"
+        date = time.gmtime(rng.uniform(1.55e9, 1.76e9))  # 2019 - 2025
+        fields["invoice_date"] = time.strftime(rng.choice(DATE_STYLES), date)
+        if rng.random() < args.missing:
+            fields[rng.choice(["invoice_date", "total_amount"])] = None
+        fields["line_items"] = [{"item_description": name, "item_quantity": qty, "item_unit_price": f"{price:.2f}",
+                                 "item_total": f"{qty * price:.2f}"} for name, qty, price in invoice.line_items]
+        yield f"{i:064x}", {"fileName": f"invoice_{i:07d}.png", "extractedFields": fields}
+
+
+def load(store: ResultStore, args) -> float:
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    batch = []
+    for entry in results(args, rng):
+        batch.append(entry)
+        if len(batch) == 10000:
+            store.write(batch)
+            batch = []
+    store.write(batch)
+    return time.perf_counter() - started
+
+
+def timed(fn, repeat: int) -> dict:
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        out = fn()
+        times.append(1000 * (time.perf_counter() - started))
+    rows = len(out["invoices"]) if isinstance(out, dict) else len(out)
+    return {"median_ms": round(statistics.median(times), 2), "max_ms": round(max(times), 2), "rows": rows}
+
+
+def cursor_at(store: ResultStore, query: InvoiceQuery, pages: int, **kwargs):
+    cursor = None
+    for _ in range(pages):
+        cursor = store.page(query, cursor=cursor, **kwargs)["nextCursor"]
+    return cursor
+
+
+def walk(store: ResultStore, query: InvoiceQuery, **kwargs) -> list:
+    ids, cursor = [], None
+    while True:
+        page = store.page(query, cursor=cursor, limit=500, **kwargs)
+        ids += [invoice["id"] for invoice in page["invoices"]]
+        cursor = page["nextCursor"]
+        if cursor is None:
+            return ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--vendors", type=int, default=5000)
+    parser.add_argument("--items", type=int, default=3, help="line items per invoice")
+    parser.add_argument("--missing", type=float, default=0.02, help="fraction without a date or total")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--db", help="store path (default: a temporary file)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    directory = tempfile.TemporaryDirectory()
+    path = args.db or os.path.join(directory.name, "results.sqlite3")
+    store = ResultStore(path)
+    seconds = load(store, args)
+    stats = store.stats()
+    print(json.dumps({"rows": args.rows, "load_seconds": round(seconds, 1),
+                      "rows_per_sec": round(args.rows / seconds), "line_items": stats["lineItems"],
+                      "db_mb": round(stats["dbBytes"] / 2**20, 1)}, sort_keys=True))
+
+    sample = store.get(args.rows // 2)
+    vendor, number = sample["vendor_name"], sample["invoice_number"]
+    month = InvoiceQuery(date_from="2023-06-01", date_to="2023-06-30")
+    queries = {
+        "invoice_number": lambda: store.page(InvoiceQuery(invoice_number=number)),
+        "vendor_page": lambda: store.page(InvoiceQuery(vendor_name=vendor.upper()), sort="invoice_date"),
+        "vendor_prefix_page": lambda: store.page(InvoiceQuery(vendor_prefix=vendor[:12].lower()),
+                                                 sort="total_amount"),
+        "month_page_by_total": lambda: store.page(month, sort="total_amount"),
+        "amount_range_page": lambda: store.page(InvoiceQuery(min_total=5000, max_total=5100), line_items=True),
+        "deep_page_200": (lambda c=cursor_at(store, InvoiceQuery(), 200, sort="total_amount"):
+                          store.page(InvoiceQuery(), sort="total_amount", cursor=c)),
+        "vendor_totals": lambda: store.aggregate(InvoiceQuery(vendor_name=vendor)),
+        "vendor_by_month": lambda: store.aggregate(InvoiceQuery(vendor_name=vendor), "month"),
+        "top_vendors_in_month": lambda: store.aggregate(month, "vendor_name", limit=20),
+        "months_in_2023": lambda: store.aggregate(InvoiceQuery(date_from="2023-01-01", date_to="2023-12-31"),
+                                                  "month"),
+        "all_by_year": lambda: store.aggregate(InvoiceQuery(), "year"),
+        "csv_month_export": lambda: list(store.export_csv(month)),
+    }
+    worst = 0.0
+    for name, fn in queries.items():
+        timing = timed(fn, args.repeat)
+        worst = max(worst, timing["median_ms"])
+        print(json.dumps({"query": name, **timing}, sort_keys=True))
+
+    walked = walk(store, InvoiceQuery(vendor_name=vendor), sort="invoice_date", descending=False)
+    expected = store.aggregate(InvoiceQuery(vendor_name=vendor))[0]["invoices"]
+    print(json.dumps({"worst_median_ms": worst, "paging_consistent": len(walked) == len(set(walked)) == expected,
+                      "walked": len(walked)}, sort_keys=True))
+    store.close()
+    directory.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Cold start: import time, time to ready and first-request latency.
+
+* ``import``: ``import backend.main`` and ``create_app()`` in a fresh
+  interpreter, ``--repeat`` times, and which of the heavy libraries
+  (PyMuPDF, Pillow, NumPy, Jinja2, PyPDF2) the import pulled in - it
+  should be none.
+* ``first_request``: for each ``WARMUP`` mode, a backend started with
+  uvicorn in front of the mock model; the time from spawning it until it
+  answers, then the latency of its first ``/process`` (an image, a scanned
+  and a born-digital PDF) against the second one with other files of the
+  same kinds. ``background`` sends the first request while warmup still
+  runs, as an autoscaled worker would get it.
+
+One JSON line per measurement, then a ``regression`` line. It exits with
+status 1 if the import loads a heavy library or a limit is exceeded, so it
+can gate a change that slows startup down.
+
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --repeat 10 --max-import-ms 800 --max-first-request-ms 1500
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+import httpx
+
+from benchmarks.bench_e2e import FIELDS, ROOT, multipart, percentiles, start_server
+from benchmarks.mock_model import create_app, serve
+from benchmarks.synthetic import build_corpus
+
+HEAVY_MODULES = ("fitz", "PIL", "numpy", "jinja2", "PyPDF2")
+IMPORT_PROBE = f"""
+import json, sys, time
+started = time.perf_counter()
+import backend.main
+imported = time.perf_counter()
+backend.main.create_app()
+print(json.dumps({{"import_ms": 1000 * (imported - started), "create_app_ms": 1000 * (time.perf_counter() - imported),
+                  "heavy": [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))
+"""
+
+
+def measure_import(repeat: int) -> Dict:
+    runs = [json.loads(subprocess.run([sys.executable, "-c", IMPORT_PROBE], cwd=ROOT, check=True,
+                                      capture_output=True, text=True).stdout) for _ in range(repeat)]
+    return {"import_ms": percentiles([r["import_ms"] for r in runs]),
+            "create_app_ms": percentiles([r["create_app_ms"] for r in runs]),
+            "heavy_modules": sorted({m for r in runs for m in r["heavy"]})}
+
+
+def ready_after(url: str, started: float, timeout: float = 60) -> float:
+    """ms from ``started`` until ``url`` answers"""
+    while time.perf_counter() - started < timeout:
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return 1000 * (time.perf_counter() - started)
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.01)
+    raise RuntimeError(f"{url} did not come up")
+
+
+def first_requests(args, mode: str, port: int, model_url: str) -> Dict:
+    kinds = ("image", "scanned_pdf", "digital_pdf")
+    first, second = build_corpus(3, seed=args.seed, kinds=kinds), build_corpus(3, seed=args.seed + 1, kinds=kinds)
+    env = {"WARMUP": mode, "COLAB_URL": model_url, "RESULTS_DB": "", "RESULT_CACHE_BYTES": "0", "DEDUPE": "0",
+           "TEMPLATES": "0", "HEALTH_PROBE_INTERVAL": "0"}
+    started = time.perf_counter()
+    server = start_server("backend.main:app", port, env)
+    try:
+        url = f"http://127.0.0.1:{port}"
+        ready_ms = ready_after(url + "/startup/stats", started)
+        latencies: List[float] = []
+        with httpx.Client(base_url=url, timeout=120) as client:
+            for files in (first, second):
+                request_started = time.perf_counter()
+                response = client.post("/process", files=multipart(files), data={"fields": json.dumps(FIELDS)})
+                response.raise_for_status()
+                latencies.append(1000 * (time.perf_counter() - request_started))
+            startup = client.get("/startup/stats").json()
+            while startup["warmup"] == "background" and startup["warmupMs"] is None:
+                time.sleep(0.05)
+                startup = client.get("/startup/stats").json()
+    finally:
+        server.terminate()
+        server.wait()
+    return {"warmup": mode, "ready_ms": round(ready_ms, 1), "first_request_ms": round(latencies[0], 1),
+            "second_request_ms": round(latencies[1], 1),
+            "first_request_penalty_ms": round(latencies[0] - latencies[1], 1),
+            "lifespan_ms": startup["lifespanMs"], "warmup_ms": startup["warmupMs"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters for the import measurement")
+    parser.add_argument("--modes", default="off,background,startup", help="WARMUP modes to start the backend with")
+    parser.add_argument("--latency-ms", type=float, default=50, help="mock model latency")
+    parser.add_argument("--model-port", type=int, default=8880)
+    parser.add_argument("--port", type=int, default=8881)
+    parser.add_argument("--max-import-ms", type=float, default=1000, help="median import + create_app limit")
+    parser.add_argument("--max-first-request-ms", type=float, default=None,
+                        help="limit on the first request's extra latency with WARMUP=startup")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    failures = []
+    imported = measure_import(args.repeat)
+    print(json.dumps({"bench": "import", "repeat": args.repeat, **imported}, sort_keys=True))
+    import_ms = imported["import_ms"]["p50"] + imported["create_app_ms"]["p50"]
+    if imported["heavy_modules"]:
+        failures.append(f"import loads {', '.join(imported['heavy_modules'])}")
+    if import_ms > args.max_import_ms:
+        failures.append(f"import + create_app {import_ms:.0f} ms > {args.max_import_ms:.0f} ms")
+
+    model = serve(create_app(args.latency_ms), args.model_port)
+    model_url = f"http://127.0.0.1:{args.model_port}/process"
+    for mode in args.modes.split(","):
+        result = first_requests(args, mode, args.port, model_url)
+        print(json.dumps({"bench": "first_request", "model_latency_ms": args.latency_ms, **result}, sort_keys=True))
+        penalty = result["first_request_penalty_ms"]
+        if mode == "startup" and args.max_first_request_ms is not None and penalty > args.max_first_request_ms:
+            failures.append(f"first request {penalty:.0f} ms slower than the second "
+                            f"> {args.max_first_request_ms:.0f} ms")
+    model.should_exit = True
+
+    print(json.dumps({"bench": "regression", "passed": not failures, "failures": failures,
+                      "import_and_create_app_ms": round(import_ms, 1)}, sort_keys=True))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Time to first field: /process (whole JSON) vs /process/stream (SSE).
+
+Runs the real backend app on a local port in front of the mock model, whose
+``--latency-ms`` is the prefill before the first token and ``--token-ms``
+the decode time per token. Times are measured by the HTTP client, so any
+buffering between the model and the browser shows up in the numbers.
+
+    python -m benchmarks.bench_streaming --files 8 --latency-ms 300 --token-ms 15
+"""
+import argparse
+import json
+import statistics
+import time
+from dataclasses import replace
+
+import httpx
+
+from backend.config import Settings
+from backend.main import create_app as backend_app
+from benchmarks.mock_model import create_app, serve
+
+FIELDS = ["vendor_name", "invoice_number", "invoice_date", "total_amount"]
+
+
+def one_shot(client: httpx.Client, url: str, name: str) -> dict:
+    start = time.perf_counter()
+    response = client.post(url + "/process", files={"files": (name, b"img")},
+                           data={"fields": json.dumps(FIELDS)})
+    response.raise_for_status()
+    ms = 1000 * (time.perf_counter() - start)
+    # Nothing is visible until the whole response is in
+    return {"first_field_ms": ms, "total_ms": ms}
+
+
+def streamed(client: httpx.Client, url: str, name: str) -> dict:
+    start = time.perf_counter()
+    first_token = first_field = None
+    with client.stream("POST", url + "/process/stream", files={"files": (name, b"img")},
+                       data={"fields": json.dumps(FIELDS)}) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            now = 1000 * (time.perf_counter() - start)
+            if line == "event: token" and first_token is None:
+                first_token = now
+            elif line == "event: field" and first_field is None:
+                first_field = now
+            elif line == "event: done":
+                break
+    return {"first_token_ms": first_token, "first_field_ms": first_field,
+            "total_ms": 1000 * (time.perf_counter() - start)}
+
+
+def summarize(mode: str, runs) -> dict:
+    out = {"mode": mode}
+    for key in ("first_token_ms", "first_field_ms", "total_ms"):
+        values = sorted(r[key] for r in runs if r.get(key) is not None)
+        if values:
+            out[key] = {"p50": round(statistics.median(values), 1),
+                        "max": round(values[-1], 1)}
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--token-ms", type=float, default=15)
+    parser.add_argument("--model-port", type=int, default=8766)
+    parser.add_argument("--port", type=int, default=8767)
+    args = parser.parse_args()
+
+    model = serve(create_app(args.latency_ms, token_ms=args.token_ms), args.model_port)
+    # Each file is unique, and the backend must not answer from its cache
+    settings = replace(Settings.from_env(), colab_url=f"http://127.0.0.1:{args.model_port}/process",
+                       result_cache_bytes=0)
+    backend = serve(backend_app(settings), args.port)
+    url = f"http://127.0.0.1:{args.port}"
+
+    with httpx.Client(timeout=120) as client:
+        print(json.dumps(summarize("one-shot", [one_shot(client, url, f"a{i}.png") for i in range(args.files)])))
+        print(json.dumps(summarize("streamed", [streamed(client, url, f"b{i}.png") for i in range(args.files)])))
+        print(json.dumps({"backend_stream_stats": client.get(url + "/stream/stats").json()}))
+
+    backend.should_exit = True
+    model.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
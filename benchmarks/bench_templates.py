@@ -0,0 +1,190 @@
+"""Vendor templates: hit rate, accuracy and model time saved.
+
+Builds born-digital PDF invoices for ``--vendors`` vendors, each with its
+own layout: its own labels ("Bill #", "Amount payable", ...), labels left
+of or above their values, date and amount formats, and a line-item table
+of varying length that moves the totals down the page. ``--tail`` of the
+documents come from one-off vendors that are never seen twice. Documents
+arrive in random order and go through ``TemplateLearner`` in process. A
+miss stands in for the model: the ground truth is its answer (dates ISO,
+amounts as decimals), taking ``--model-ms``, and the document becomes a
+sample.
+
+Reports the overall hit rate and the rate once a vendor's template has
+been learned, per-field accuracy of template answers against the ground
+truth, template latency (text-layer read included) and the model time
+saved.
+
+    python -m benchmarks.bench_templates --vendors 20 --docs 1000 --model-ms 2500
+"""
+import argparse
+import asyncio
+import io
+import json
+import random
+import time
+from datetime import date, timedelta
+
+from backend.templates import TemplateLearner
+from backend.uploads import UploadPayload
+from benchmarks.bench_e2e import percentiles
+from benchmarks.synthetic import ITEMS, VENDORS
+
+FIELDS = ["vendor_name", "invoice_number", "invoice_date", "due_date", "tax_amount", "total_amount"]
+LABELS = {
+    "invoice_number": ["Invoice No.", "Bill #", "Document Number", "Our ref."],
+    "invoice_date": ["Date:", "Issued on", "Billing date"],
+    "due_date": ["Due:", "Payment due", "Pay by"],
+    "tax_amount": ["VAT", "Sales tax", "GST (10%)"],
+    "total_amount": ["Amount payable", "Grand total", "Balance due"],
+}
+DATE_STYLES = ("%d.%m.%Y", "%B %d, %Y", "%d %b %Y", "%Y-%m-%d")
+
+
+def make_style(rng: random.Random, name: str) -> dict:
+    return {
+        "name": name,
+        "labels": {f: rng.choice(options) for f, options in LABELS.items()},
+        "above": rng.random() < 0.5,  # header labels above their values, else to the left
+        "header_x": rng.uniform(40, 300),
+        "header_y": rng.uniform(140, 220),
+        "date_style": rng.choice(DATE_STYLES),
+        "euro": rng.random() < 0.3,
+        "has_due": rng.random() < 0.8,
+        "number_prefix": rng.choice(["INV-", "", "B", "2024/"]),
+    }
+
+
+def money(style: dict, amount: float) -> str:
+    if style["euro"]:
+        return f"{amount:,.2f} EUR".replace(",", "_").replace(".", ",").replace("_", ".")
+    return f"${amount:,.2f}"
+
+
+def make_document(rng: random.Random, style: dict):
+    """``(pdf bytes, ground-truth fields)``"""
+    import fitz  # PyMuPDF
+
+    issued = date(2024, 1, 1) + timedelta(days=rng.randrange(365))
+    items = [(rng.choice(ITEMS), rng.randint(1, 20), round(rng.uniform(2, 400), 2))
+             for _ in range(rng.randint(2, 12))]
+    subtotal = round(sum(q * p for _, q, p in items), 2)
+    tax = round(subtotal * 0.1, 2)
+    truth = {
+        "vendor_name": style["name"],
+        "invoice_number": f"{style['number_prefix']}{rng.randint(1, 99999):05d}",
+        "invoice_date": issued.isoformat(),
+        "due_date": (issued + timedelta(days=30)).isoformat() if style["has_due"] else None,
+        "tax_amount": f"{tax:.2f}",
+        "total_amount": f"{subtotal + tax:.2f}",
+    }
+    printed = {
+        "invoice_number": truth["invoice_number"],
+        "invoice_date": issued.strftime(style["date_style"]),
+        "due_date": (issued + timedelta(days=30)).strftime(style["date_style"]),
+    }
+
+    doc = fitz.open()
+    page = doc.new_page()  # A4-ish letter page, 612 x 792 points
+    page.insert_text((50, 60), style["name"], fontsize=16)
+    page.insert_text((50, 80), f"{rng.randint(1, 999)} Commerce Street, Springfield", fontsize=9)
+    x, y = style["header_x"], style["header_y"]
+    for field in ("invoice_number", "invoice_date", "due_date"):
+        if field == "due_date" and not style["has_due"]:
+            continue
+        if style["above"]:
+            page.insert_text((x, y), style["labels"][field], fontsize=9)
+            page.insert_text((x, y + 12), printed[field], fontsize=10)
+            y += 32
+        else:
+            page.insert_text((x, y), style["labels"][field], fontsize=10)
+            page.insert_text((x + 110, y), printed[field], fontsize=10)
+            y += 16
+    y = max(y, 300) + 20
+    page.insert_text((50, y), "Description", fontsize=10)
+    page.insert_text((330, y), "Qty", fontsize=10)
+    page.insert_text((400, y), "Unit price", fontsize=10)
+    page.insert_text((500, y), "Amount", fontsize=10)
+    for name, qty, price in items:
+        y += 16
+        page.insert_text((50, y), name, fontsize=10)
+        page.insert_text((330, y), str(qty), fontsize=10)
+        page.insert_text((400, y), money(style, price), fontsize=10)
+        page.insert_text((500, y), money(style, qty * price), fontsize=10)
+    y += 30
+    for label, amount in (("Subtotal", subtotal), (style["labels"]["tax_amount"], tax),
+                          (style["labels"]["total_amount"], subtotal + tax)):
+        page.insert_text((330, y), label, fontsize=10)
+        page.insert_text((480, y), money(style, amount), fontsize=10)
+        y += 16
+    page.insert_text((50, 760), "Thank you for your business.", fontsize=8)
+    data = doc.tobytes()
+    doc.close()
+    return data, truth
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    styles = [make_style(rng, f"{VENDORS[i % len(VENDORS)]} {i // len(VENDORS) or ''}".strip())
+              for i in range(args.vendors)]
+    learner = TemplateLearner(args.samples, args.max_distance, args.min_confidence)
+    hits = misses = learned_docs = learned_hits = one_off = 0
+    correct = {f: 0 for f in FIELDS}
+    template_ms, read_ms = [], []
+    learned = set()
+    for i in range(args.docs):
+        tail = rng.random() < args.tail
+        style = make_style(rng, f"One-off Vendor {i}") if tail else rng.choice(styles)
+        one_off += tail
+        data, truth = make_document(rng, style)
+        payload = UploadPayload(f"invoice_{i:05d}.pdf", io.BytesIO(data), len(data), "application/pdf")
+        started = time.perf_counter()
+        layout = await learner.read(payload)
+        read_ms.append(1000 * (time.perf_counter() - started))
+        result = learner.extract(layout, payload, "", FIELDS) if layout is not None else None
+        if style["name"] in learned:
+            learned_docs += 1
+        if result is not None:
+            hits += 1
+            learned_hits += style["name"] in learned
+            template_ms.append(result["template"]["elapsedMs"])
+            for f in FIELDS:
+                correct[f] += result["extractedFields"].get(f) == truth[f]
+        else:
+            misses += 1
+            await learner.learn(layout, {"fileName": payload.filename, "extractedFields": truth}, args.model_ms)
+            if any(v["vendor"] == style["name"] for v in learner.stats()["vendors"]):
+                learned.add(style["name"])
+
+    stats = learner.stats()
+    print(json.dumps({
+        "documents": args.docs,
+        "oneOffDocuments": one_off,
+        "templates": stats["templates"],
+        "hits": hits,
+        "hitRate": round(hits / args.docs, 3),
+        "hitRateOnceLearned": round(learned_hits / learned_docs, 3) if learned_docs else None,
+        "fieldAccuracy": {f: round(c / hits, 4) if hits else None for f, c in correct.items()},
+        "template_ms": percentiles(template_ms),
+        "read_ms": percentiles(read_ms),
+        "modelCallsAvoided": hits,
+        "timeSavedSeconds": round(stats["timeSavedMs"] / 1000, 1),
+        "misses": {k: stats[k] for k in ("noTemplate", "uncovered", "lowConfidence")},
+    }, sort_keys=True))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vendors", type=int, default=20)
+    parser.add_argument("--docs", type=int, default=1000)
+    parser.add_argument("--tail", type=float, default=0.1, help="share of documents from one-off vendors")
+    parser.add_argument("--samples", type=int, default=3, help="model extractions before a template is learned")
+    parser.add_argument("--max-distance", type=int, default=12)
+    parser.add_argument("--min-confidence", type=float, default=1.0)
+    parser.add_argument("--model-ms", type=float, default=2500, help="what a model extraction costs")
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
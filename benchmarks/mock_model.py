@@ -0,0 +1,149 @@
+"""Local stand-in for the Colab /process endpoint, used by the benchmarks.
+
+Run it on its own with ``uvicorn benchmarks.mock_model:app --port 8001`` or
+start it in-process with ``serve()``. Latency is tunable with MOCK_LATENCY_MS;
+MOCK_FAILURE_RATE makes that fraction of calls answer 503. MOCK_TOKEN_MS adds
+a per-token decode time, which ``/process/stream`` spends between the
+``token`` events it emits. MOCK_UPLOAD_MBPS simulates the uplink to the GPU
+(e.g. an ngrok tunnel): each request waits as long as its body would take
+at that rate. MOCK_SLOW_RATE of the calls take MOCK_SLOW_MS longer, a tail
+to hedge against. Gzipped request bodies are accepted like on the real
+servers; ``/stats`` counts calls, request bytes as received on the wire and
+calls that carried a deadline.
+"""
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request, UploadFile, File, Form
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from backend.model_http import DEADLINE_HEADER, GzipRequestMiddleware
+
+LATENCY_MS = float(os.getenv("MOCK_LATENCY_MS", "200"))
+FAILURE_RATE = float(os.getenv("MOCK_FAILURE_RATE", "0"))
+TOKEN_MS = float(os.getenv("MOCK_TOKEN_MS", "0"))
+UPLOAD_MBPS = float(os.getenv("MOCK_UPLOAD_MBPS", "0"))  # 0 = unlimited
+SLOW_RATE = float(os.getenv("MOCK_SLOW_RATE", "0"))
+SLOW_MS = float(os.getenv("MOCK_SLOW_MS", "1000"))
+
+FIELDS = {
+    "vendor_name": "Demo Vendor",
+    "invoice_number": "INV-2024-00042",
+    "invoice_date": "2024-03-14",
+    "due_date": "2024-04-14",
+    "tax_amount": "11.22",
+    "total_amount": "123.45",
+}
+
+
+def tokens(text: str):
+    """Rough stand-in for a tokenizer: ~4 characters per token"""
+    return [text[i:i + 4] for i in range(0, len(text), 4)]
+
+
+class WireBytesMiddleware:
+    """Counts request body bytes as they arrive, before any gzip inflation, in ``request.state.wire_bytes``"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        state = scope.setdefault("state", {})
+        state["wire_bytes"] = 0
+
+        async def counted_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                state["wire_bytes"] += len(message.get("body", b""))
+            return message
+
+        await self.app(scope, counted_receive, send)
+
+
+def create_app(latency_ms: float = LATENCY_MS, failure_rate: float = FAILURE_RATE,
+               token_ms: float = TOKEN_MS, upload_mbps: float = UPLOAD_MBPS,
+               slow_rate: float = SLOW_RATE, slow_ms: float = SLOW_MS) -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(GzipRequestMiddleware)
+    app.add_middleware(WireBytesMiddleware)
+    output = json.dumps({"extracted_fields": FIELDS}, indent=2)
+    counters = {"requests": 0, "bytes_received": 0, "with_deadline": 0}
+
+    async def count(request: Request):
+        # The form has been read by now, so the whole body has arrived
+        size = request.state.wire_bytes
+        counters["requests"] += 1
+        counters["bytes_received"] += size
+        counters["with_deadline"] += DEADLINE_HEADER.lower() in request.headers
+        if upload_mbps:
+            await asyncio.sleep(size * 8 / (upload_mbps * 1e6))
+
+    def result(filename: str, prompt: str, size: int, request: Request, generate_ms: float):
+        return {
+            "fileName": filename,
+            "promptUsed": prompt,
+            "extractedFields": {
+                "vendor_name": "Demo Vendor",
+                "total_amount": "123.45"
+            },
+            "rawResponse": {"source": "local mock", "bytes": size},
+            # Same shape as the notebook server's per-stage timing
+            "timing": {"requestId": request.headers.get("x-request-id"), "stages": {"generate": generate_ms}}
+        }
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok"}
+
+    @app.get("/stats")
+    async def stats():
+        return counters
+
+    @app.post("/process")
+    async def process(request: Request, file: UploadFile = File(...), prompt: str = Form(...)):
+        await count(request)
+        contents = await file.read()
+        generate_ms = latency_ms + token_ms * len(tokens(output))
+        if random.random() < slow_rate:
+            generate_ms += slow_ms
+        await asyncio.sleep(generate_ms / 1000)
+        if random.random() < failure_rate:
+            return JSONResponse({"detail": "mock failure"}, status_code=503)
+        return result(file.filename, prompt, len(contents), request, generate_ms)
+
+    @app.post("/process/stream")
+    async def process_stream(request: Request, file: UploadFile = File(...), prompt: str = Form(...)):
+        await count(request)
+        contents = await file.read()
+        if random.random() < failure_rate:
+            return JSONResponse({"detail": "mock failure"}, status_code=503)
+
+        async def events():
+            await asyncio.sleep(latency_ms / 1000)
+            for token in tokens(output):
+                await asyncio.sleep(token_ms / 1000)
+                yield f"event: token\ndata: {json.dumps({'text': token})}\n\n"
+            generate_ms = latency_ms + token_ms * len(tokens(output))
+            yield f"event: result\ndata: {json.dumps(result(file.filename, prompt, len(contents), request, generate_ms))}\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+app = create_app()
+
+
+def serve(app: FastAPI, port: int) -> uvicorn.Server:
+    """Start ``app`` on a background thread and wait until it accepts requests"""
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    return server
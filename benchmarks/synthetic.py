@@ -0,0 +1,193 @@
+"""Synthetic invoices for the benchmarks.
+
+Everything is generated from a seed so runs are reproducible.
+"""
+import io
+import random
+from dataclasses import dataclass, field
+from typing import List, Sequence, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+VENDORS = ["ACME Supplies Ltd", "Globex Corporation", "Initech Office Services", "Umbrella Logistics",
+           "Stark Industrial Parts", "Wayne Facilities Mgmt", "Hooli Cloud Services", "Soylent Catering Co"]
+ITEMS = ["Printer paper A4", "Toner cartridge", "Desk chair", "Monitor 27in", "USB-C cable", "Consulting hours",
+         "Cloud storage 1TB", "Shipping & handling", "Office cleaning", "Coffee beans 1kg"]
+
+
+@dataclass
+class Invoice:
+    vendor_name: str
+    invoice_number: str
+    invoice_date: str
+    due_date: str
+    line_items: List[Tuple[str, int, float]] = field(default_factory=list)
+    tax_rate: float = 0.1
+
+    @property
+    def subtotal(self) -> float:
+        return round(sum(q * p for _, q, p in self.line_items), 2)
+
+    @property
+    def tax_amount(self) -> float:
+        return round(self.subtotal * self.tax_rate, 2)
+
+    @property
+    def total_amount(self) -> float:
+        return round(self.subtotal + self.tax_amount, 2)
+
+    def expected_fields(self) -> dict:
+        return {
+            "vendor_name": self.vendor_name,
+            "invoice_number": self.invoice_number,
+            "invoice_date": self.invoice_date,
+            "due_date": self.due_date,
+            "tax_amount": f"${self.tax_amount:,.2f}",
+            "total_amount": f"${self.total_amount:,.2f}",
+        }
+
+
+def make_invoice(rng: random.Random, items: int = 8) -> Invoice:
+    month = rng.randint(1, 12)
+    day = rng.randint(1, 28)
+    return Invoice(
+        vendor_name=rng.choice(VENDORS),
+        invoice_number=f"INV-{rng.randint(2020, 2026)}-{rng.randint(1, 99999):05d}",
+        invoice_date=f"2024-{month:02d}-{day:02d}",
+        due_date=f"2024-{min(month + 1, 12):02d}-{day:02d}",
+        line_items=[(rng.choice(ITEMS), rng.randint(1, 20), round(rng.uniform(2, 400), 2)) for _ in range(items)],
+    )
+
+
+def invoice_lines(invoice: Invoice) -> List[Tuple[str, List[str]]]:
+    """Text blocks of the invoice as (block name, lines)"""
+    return [
+        ("header", [invoice.vendor_name, "12 Commerce Road", "Springfield, ST 55501"]),
+        ("meta", [f"Invoice Number: {invoice.invoice_number}", f"Invoice Date: {invoice.invoice_date}",
+                  f"Due Date: {invoice.due_date}"]),
+        ("items", ["Description                 Qty      Unit price        Amount"] + [
+            f"{name:<26}{qty:>5}{price:>16,.2f}{qty * price:>14,.2f}" for name, qty, price in invoice.line_items
+        ]),
+        ("totals", [f"Subtotal: ${invoice.subtotal:,.2f}", f"Tax (10%): ${invoice.tax_amount:,.2f}",
+                    f"Total Amount Due: ${invoice.total_amount:,.2f}"]),
+    ]
+
+
+def render_page(invoice: Invoice, dpi: int = 200, noise: float = 0.0, seed: int = 0) -> Image.Image:
+    """Render the invoice onto a US-letter page; ``noise`` > 0 makes it look scanned"""
+    width, height = int(8.5 * dpi), int(11 * dpi)
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default(size=max(8, dpi // 9))
+    line_height = int(dpi / 9 * 1.4)
+    margin = dpi
+
+    positions = {
+        "header": (margin, margin),
+        "meta": (int(width * 0.58), margin),
+        "items": (margin, int(height * 0.3)),
+        "totals": (int(width * 0.58), int(height * 0.75)),
+    }
+    for block, lines in invoice_lines(invoice):
+        x, y = positions[block]
+        for i, line in enumerate(lines):
+            draw.text((x, y + i * line_height), line, fill="black", font=font)
+
+    if noise:
+        rng = random.Random(seed)
+        image = image.rotate(rng.uniform(-noise, noise), fillcolor="white", expand=False)
+        speckle = ImageDraw.Draw(image)
+        for _ in range(int(width * height * 0.0005 * noise)):
+            x, y = rng.randrange(width), rng.randrange(height)
+            speckle.point((x, y), fill=(rng.randint(0, 120),) * 3)
+    return image
+
+
+def born_digital_pdf(invoice: Invoice, pages: int = 1) -> bytes:
+    """PDF with a real text layer (what an accounting system exports)"""
+    import fitz  # PyMuPDF
+
+    doc = fitz.open()
+    for number in range(pages):
+        page = doc.new_page()
+        y = 72
+        blocks = dict(invoice_lines(invoice))
+        if number:
+            # Continuation pages repeat the header and the item table
+            blocks = {"header": [f"{invoice.vendor_name} - {invoice.invoice_number}", f"Page {number + 1} of {pages}"],
+                      "items": blocks["items"]}
+        for lines in blocks.values():
+            page.insert_text((72, y), "\n".join(lines), fontsize=9)
+            y += 14 * (len(lines) + 1)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def scanned_pdf(invoice: Invoice, pages: int = 1, dpi: int = 200, seed: int = 0) -> bytes:
+    """Image-only PDF, one noisy rendered page per page"""
+    images = [render_page(invoice, dpi, noise=1.0, seed=seed + n).convert("L") for n in range(pages)]
+    buffer = io.BytesIO()
+    images[0].save(buffer, "PDF", resolution=dpi, save_all=True, append_images=images[1:])
+    return buffer.getvalue()
+
+
+def image_file(invoice: Invoice, dpi: int = 200, fmt: str = "PNG", seed: int = 0) -> bytes:
+    """A photographed / scanned single page as PNG or JPEG"""
+    image = render_page(invoice, dpi, noise=1.0, seed=seed)
+    buffer = io.BytesIO()
+    image.save(buffer, fmt, **({"quality": 85} if fmt == "JPEG" else {}))
+    return buffer.getvalue()
+
+
+def phone_photo(invoice: Invoice, dpi: int = 500, quality: int = 95, seed: int = 0) -> bytes:
+    """A receipt photographed on a phone: large, sensor-noisy JPEG stored sideways with
+    EXIF orientation 6 (the camera's usual portrait shot)"""
+    page = render_page(invoice, dpi, noise=1.0, seed=seed)
+    grain = Image.effect_noise(page.size, 12).convert("RGB")
+    page = Image.blend(page, grain, 0.08)
+    sideways = page.transpose(Image.Transpose.ROTATE_90)
+    exif = Image.Exif()
+    exif[0x0112] = 6  # rotate 90 CW to display
+    buffer = io.BytesIO()
+    sideways.save(buffer, "JPEG", quality=quality, exif=exif)
+    return buffer.getvalue()
+
+
+@dataclass
+class CorpusFile:
+    name: str
+    data: bytes
+    kind: str  # "image", "scanned_pdf" or "digital_pdf"
+    pages: int
+    dpi: int
+    invoice: Invoice
+
+    @property
+    def content_type(self) -> str:
+        if self.name.endswith(".pdf"):
+            return "application/pdf"
+        return "image/jpeg" if self.name.endswith(".jpg") else "image/png"
+
+
+def build_corpus(count: int, seed: int = 0, kinds: Sequence[str] = ("image", "scanned_pdf", "digital_pdf"),
+                 page_counts: Sequence[int] = (1, 2, 4), dpis: Sequence[int] = (100, 200, 300)) -> List[CorpusFile]:
+    """``count`` files cycling through ``kinds``, with page counts and DPIs drawn from the seed"""
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(count):
+        invoice = make_invoice(rng, items=rng.randint(3, 12))
+        kind = kinds[i % len(kinds)]
+        dpi = rng.choice(dpis)
+        pages = 1 if kind == "image" else rng.choice(page_counts)
+        if kind == "image":
+            fmt = rng.choice(["PNG", "JPEG"])
+            name = f"invoice_{i:04d}.{'png' if fmt == 'PNG' else 'jpg'}"
+            data = image_file(invoice, dpi, fmt, seed=i)
+        elif kind == "scanned_pdf":
+            name, data = f"invoice_{i:04d}.pdf", scanned_pdf(invoice, pages, dpi, seed=i)
+        else:
+            name, data = f"invoice_{i:04d}.pdf", born_digital_pdf(invoice, pages)
+            dpi = 0  # vector
+        corpus.append(CorpusFile(name, data, kind, pages, dpi, invoice))
+    return corpus
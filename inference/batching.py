@@ -0,0 +1,220 @@
+"""Dynamic micro-batching in front of ``model.generate``.
+
+Requests arriving within ``max_wait_ms`` of each other (up to
+``max_batch_size`` of them) are padded into one batch and run through a
+single generate call on a dedicated thread; each caller gets back only its
+own decoded output. Items whose caller's deadline passed while they were
+queued are dropped with ``DeadlineExceeded`` instead of being generated.
+Streamed calls, one generate each, take turns with the batches on the same
+thread through ``BatchScheduler.exclusive``.
+"""
+import asyncio
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from backend.model_http import DeadlineExceeded
+
+
+class BatchScheduler:
+    """Collects submitted items into batches for ``run_batch``.
+
+    ``run_batch`` takes a list of items and returns a list of outputs in the
+    same order. It runs on a single worker thread, so it may block (e.g. a
+    torch generate call) without stalling the event loop. If it sets a
+    ``last_stages`` dict of stage -> seconds on itself, those are reported to
+    callers that pass a ``timing`` dict to ``submit``.
+    """
+
+    def __init__(self, run_batch: Callable[[List[Any]], List[Any]],
+                 max_batch_size: int = 8, max_wait_ms: float = 20):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._queue: "asyncio.Queue[Tuple[Any, asyncio.Future, float, Optional[Dict[str, float]], Optional[float]]]" \
+            = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="generate")
+        # Held while a batch runs or an exclusive() caller has the model
+        self._turn = asyncio.Lock()
+        self._exclusive_waiting = 0
+        self._task = None
+        # Metrics
+        self.batches = 0
+        self.items = 0
+        self.batch_sizes: Dict[int, int] = {}
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+        self.expired = 0
+        self.exclusive_calls = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self._executor.shutdown(wait=False)
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() + self._exclusive_waiting
+
+    async def submit(self, item: Any, timing: Optional[Dict[str, float]] = None,
+                     deadline: Optional[float] = None) -> Any:
+        """Queue one item and wait for its own output.
+
+        ``timing`` is filled with the item's queue wait, its batch size and the
+        stage times of the batch it ran in (seconds). ``deadline`` is the
+        ``time.perf_counter()`` time after which the output is of no use.
+        """
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future, time.perf_counter(), timing, deadline))
+        return await future
+
+    @asynccontextmanager
+    async def exclusive(self, deadline: Optional[float] = None) -> AsyncIterator[Executor]:
+        """Hold the model for one call outside the batches, e.g. a streamed generate.
+
+        Waits for the running batch to finish and keeps the next one from
+        starting until the block exits; yields the generate thread's executor
+        to run the call on. Raises ``DeadlineExceeded`` if ``deadline`` (a
+        ``time.perf_counter()`` time) passes first.
+        """
+        self._exclusive_waiting += 1
+        try:
+            timeout = None if deadline is None else max(0.0, deadline - time.perf_counter())
+            await asyncio.wait_for(self._turn.acquire(), timeout)
+        except asyncio.TimeoutError:
+            self.expired += 1
+            raise DeadlineExceeded("Deadline passed while waiting for generate") from None
+        finally:
+            self._exclusive_waiting -= 1
+        try:
+            self.exclusive_calls += 1
+            yield self._executor
+        finally:
+            self._turn.release()
+
+    async def _collect(self) -> List[Tuple[Any, asyncio.Future, float, Optional[Dict[str, float]], Optional[float]]]:
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _loop(self):
+        while True:
+            batch = await self._collect()
+            # A streamed call may have the model; deadlines are checked once it is free
+            async with self._turn:
+                await self._run(batch)
+
+    async def _run(self, batch: List[Tuple[Any, asyncio.Future, float, Optional[Dict[str, float]], Optional[float]]]):
+        started = time.perf_counter()
+        live = []
+        for entry in batch:
+            future, deadline = entry[1], entry[4]
+            if deadline is not None and deadline <= started:
+                self.expired += 1
+                if not future.done():
+                    future.set_exception(DeadlineExceeded("Deadline passed while queued for generate"))
+            else:
+                live.append(entry)
+        batch = live
+        if not batch:
+            return
+        self._record(len(batch), [started - queued for _, _, queued, _, _ in batch])
+
+        items = [item for item, _, _, _, _ in batch]
+        try:
+            outputs = await asyncio.get_running_loop().run_in_executor(self._executor, self.run_batch, items)
+            if len(outputs) != len(items):
+                raise RuntimeError(f"run_batch returned {len(outputs)} outputs for {len(items)} items")
+        except Exception as e:
+            for _, future, _, _, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        stages = getattr(self.run_batch, "last_stages", None) or {}
+        for (_, future, queued, timing, _), output in zip(batch, outputs):
+            if timing is not None:
+                timing.update(stages, queue_wait=started - queued, batch_size=len(batch))
+            if not future.done():
+                future.set_result(output)
+
+    def _record(self, size: int, waits: List[float]):
+        self.batches += 1
+        self.items += size
+        self.batch_sizes[size] = self.batch_sizes.get(size, 0) + 1
+        self.queue_wait_total += sum(waits)
+        self.queue_wait_max = max(self.queue_wait_max, *waits)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "queue_depth": self.queue_depth,
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+            "batch_size_counts": dict(sorted(self.batch_sizes.items())),
+            "mean_queue_wait_ms": 1000 * self.queue_wait_total / self.items if self.items else 0.0,
+            "max_queue_wait_ms": 1000 * self.queue_wait_max,
+            "expired": self.expired,
+            "exclusive_calls": self.exclusive_calls,
+        }
+
+
+def make_generate_batch(model, processor, tokenizer, device: str, max_new_tokens: int = 512,
+                        prefix_cache=None, vocabulary=None):
+    """Build a ``run_batch`` for a transformers vision model.
+
+    Items are ``(image, prompt)`` pairs. Prompts are left-padded so every row
+    ends at the same position and generation continues from real tokens.
+    An optional ``inference.prefix_cache.PrefixKVCache`` skips re-encoding
+    shared instruction prefixes on single-item batches. With a
+    ``inference.constrained.Vocabulary``, items may be
+    ``(image, prompt, fields)`` and those rows are decoded as the JSON object
+    for ``fields``, stopping as soon as it closes.
+    """
+    import torch
+
+    processor.tokenizer.padding_side = "left"
+
+    def generate_batch(items: List[Tuple[Any, ...]]) -> List[str]:
+        images = [item[0] for item in items]
+        prompts = [item[1] for item in items]
+        started = time.perf_counter()
+        inputs = processor(images=images, text=prompts, padding=True, return_tensors="pt").to(device)
+        preprocessed = time.perf_counter()
+        kwargs = {"max_new_tokens": max_new_tokens}
+        fields = [item[2] if len(item) > 2 else None for item in items]
+        if vocabulary is not None and any(fields):
+            from inference.constrained import schema_logits_processor
+            kwargs["logits_processor"] = schema_logits_processor(vocabulary, fields)
+        with torch.no_grad():
+            if prefix_cache is not None:
+                generated_ids = prefix_cache.generate(inputs, **kwargs)
+            else:
+                generated_ids = model.generate(**inputs, **kwargs)
+        generated = time.perf_counter()
+        # Keep only the new tokens; the prompt is not part of the answer
+        generated_ids = generated_ids[:, inputs["input_ids"].shape[1]:]
+        outputs = tokenizer.batch_decode(generated_ids, skip_special_tokens=True)
+        generate_batch.last_stages = {"preprocess": preprocessed - started, "generate": generated - preprocessed,
+                                      "decode": time.perf_counter() - generated}
+        return outputs
+
+    return generate_batch
@@ -0,0 +1,341 @@
+"""Schema-constrained decoding for the extraction JSON.
+
+The field list a request selects is compiled into a tiny grammar for one
+compact JSON object, ``{"vendor_name": "...", "total_amount": "...", ...}``,
+with the same value types ``InvoiceProcessor._generate_json_structure``
+describes in the prompt: amounts and free text are strings, dates and
+quantities are strings restricted to date / number characters, and
+``line_items`` is an array of ``description / quantity / unit_price / total``
+objects. Every value may also be ``null``.
+
+Keys, punctuation and separators are forced; the model only chooses the
+values. Once the object closes the only allowed token is EOS, so generation
+stops right there instead of running on to ``max_new_tokens``, and the output
+always parses with ``json.loads``.
+
+Per step the allowed tokens depend only on the grammar position, so masks
+are computed once per position and reused. The grammar code is pure
+Python; only ``schema_logits_processor`` needs torch / transformers.
+"""
+import json
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+AMOUNT_FIELDS = ("total_amount", "tax_amount", "item_unit_price", "item_total")
+DATE_FIELDS = ("invoice_date", "due_date")
+LINE_ITEM_KEYS = (("description", "text"), ("quantity", "quantity"),
+                  ("unit_price", "amount"), ("total", "amount"))
+
+# Characters a value of each kind may contain; None means any printable
+# character except the quote, backslash and control characters
+KIND_CHARS = {
+    "text": None,
+    "amount": None,
+    "date": frozenset("0123456789-/. "),
+    "quantity": frozenset("0123456789.,"),
+}
+
+State = Tuple[int, int, int]  # (instruction, offset into a literal, value length)
+
+
+def field_kind(field: str) -> str:
+    """Value type of a field, following ``_generate_json_structure``"""
+    if field == "line_items":
+        return "line_items"
+    if field in AMOUNT_FIELDS:
+        return "amount"
+    if field in DATE_FIELDS:
+        return "date"
+    if field == "item_quantity":
+        return "quantity"
+    return "text"
+
+
+def _plain(ch: str, kind: str) -> bool:
+    chars = KIND_CHARS[kind]
+    if chars is not None:
+        return ch in chars
+    return ch not in '"\\' and ch.isprintable()
+
+
+class Grammar:
+    """Instructions for one field selection.
+
+    ``("lit", text)`` must be produced verbatim, ``("str", kind)`` is the body
+    of a string value (it ends at the next ``"``), ``("alt", [pc, ...])``
+    continues with whichever branch matches the next character (branches
+    start with distinct characters), ``("jmp", pc)`` and ``("end",)``.
+    """
+
+    def __init__(self, fields: Sequence[str], max_value_chars: int = 200):
+        self.fields = tuple(fields)
+        self.max_value_chars = max_value_chars
+        self.program: List[Optional[tuple]] = []
+        self._label = False
+        self._lit("{")
+        for i, field in enumerate(self.fields):
+            self._lit(("" if i == 0 else ", ") + f'"{field}": ')
+            if field_kind(field) == "line_items":
+                self._line_items()
+            else:
+                self._value(field_kind(field))
+        self._lit("}")
+        self.program.append(("end",))
+
+    def _lit(self, text: str):
+        # Merge with a preceding literal unless something jumps to this spot
+        if not self._label and self.program and self.program[-1] is not None and self.program[-1][0] == "lit":
+            self.program[-1] = ("lit", self.program[-1][1] + text)
+        else:
+            self.program.append(("lit", text))
+        self._label = False
+
+    def _mark(self) -> int:
+        """Position of the next instruction, as a jump target"""
+        self._label = True
+        return len(self.program)
+
+    def _value(self, kind: str):
+        alt = len(self.program)
+        self.program.append(None)  # patched below
+        string = self._mark()
+        self._lit('"')
+        self.program.append(("str", kind))
+        self._lit('"')
+        jump = len(self.program)
+        self.program.append(None)
+        null = self._mark()
+        self._lit("null")
+        self.program[alt] = ("alt", [string, null])
+        self.program[jump] = ("jmp", self._mark())
+
+    def _line_items(self):
+        self._lit("[")
+        alt = len(self.program)
+        self.program.append(None)
+        empty = self._mark()
+        self._lit("]")
+        jump = len(self.program)
+        self.program.append(None)
+        item = self._mark()
+        for i, (key, kind) in enumerate(LINE_ITEM_KEYS):
+            self._lit(("{" if i == 0 else ", ") + f'"{key}": ')
+            self._value(kind)
+        self._lit("}")
+        self.program[alt] = ("alt", [empty, item])
+        more = len(self.program)
+        self.program.append(None)
+        again = self._mark()
+        self._lit(", ")
+        self.program.append(("jmp", item))
+        close = self._mark()
+        self._lit("]")
+        self.program[more] = ("alt", [again, close])
+        self.program[jump] = ("jmp", self._mark())
+
+    # --- Matching ---
+    def start(self) -> State:
+        return self.normalize((0, 0, 0))
+
+    def normalize(self, state: State) -> State:
+        pc, off, n = state
+        while True:
+            instr = self.program[pc]
+            if instr[0] == "jmp":
+                pc, off, n = instr[1], 0, 0
+            elif instr[0] == "lit" and off == len(instr[1]):
+                pc, off, n = pc + 1, 0, 0
+            else:
+                return pc, off, n
+
+    def step(self, state: State, ch: str) -> Optional[State]:
+        pc, off, n = state
+        instr = self.program[pc]
+        if instr[0] == "lit":
+            return self.normalize((pc, off + 1, 0)) if instr[1][off] == ch else None
+        if instr[0] == "str":
+            if ch == '"':
+                return self.step(self.normalize((pc + 1, 0, 0)), ch)
+            return (pc, 0, n + 1) if _plain(ch, instr[1]) else None
+        if instr[0] == "alt":
+            for target in instr[1]:
+                nxt = self.step(self.normalize((target, 0, 0)), ch)
+                if nxt is not None:
+                    return nxt
+        return None
+
+    def walk(self, state: State, text: str) -> Optional[State]:
+        for ch in text:
+            state = self.step(state, ch)
+            if state is None:
+                return None
+        return state
+
+    def first_chars(self, state: State) -> str:
+        pc, off, _ = state
+        instr = self.program[pc]
+        if instr[0] == "lit":
+            return instr[1][off]
+        if instr[0] == "alt":
+            return "".join(self.first_chars(self.normalize((t, 0, 0))) for t in instr[1])
+        return ""
+
+    def signature(self, state: State) -> tuple:
+        """What the allowed-token mask depends on: everything but the exact value length"""
+        pc, off, n = state
+        return pc, off, n >= self.max_value_chars
+
+    def is_end(self, state: State) -> bool:
+        return self.program[state[0]][0] == "end"
+
+
+class Vocabulary:
+    """Decoded text of every token id, indexed for fast mask computation.
+
+    ``strings[i]`` is None for tokens that can never appear in the JSON
+    (special tokens, partial UTF-8 bytes).
+    """
+
+    def __init__(self, strings: Sequence[Optional[str]], eos_id: int):
+        self.strings = list(strings)
+        self.eos_id = eos_id
+        self._by_first: Dict[str, List[int]] = defaultdict(list)
+        self._quoted: List[int] = []
+        for i, text in enumerate(self.strings):
+            if not text:
+                continue
+            self._by_first[text[0]].append(i)
+            if '"' in text:
+                self._quoted.append(i)
+        self._plain: Dict[str, List[int]] = {}
+        self._masks: Dict[tuple, List[int]] = {}
+        self.eos_only = [eos_id]
+
+    @classmethod
+    def from_tokenizer(cls, tokenizer) -> "Vocabulary":
+        special = set(tokenizer.all_special_ids)
+        strings = []
+        for i in range(len(tokenizer)):
+            text = None if i in special else tokenizer.decode([i])
+            strings.append(None if text is None or "\ufffd" in text else text)
+        return cls(strings, tokenizer.eos_token_id)
+
+    def plain(self, kind: str) -> List[int]:
+        """Tokens that can sit anywhere inside a string value of this kind"""
+        if kind not in self._plain:
+            self._plain[kind] = [i for i, text in enumerate(self.strings)
+                                 if text and all(_plain(ch, kind) for ch in text)]
+        return self._plain[kind]
+
+    def allowed(self, grammar: Grammar, state: State) -> List[int]:
+        key = (grammar.fields, grammar.max_value_chars, grammar.signature(state))
+        mask = self._masks.get(key)
+        if mask is None:
+            mask = self._compute(grammar, state)
+            self._masks[key] = mask
+        return mask
+
+    def _compute(self, grammar: Grammar, state: State) -> List[int]:
+        if grammar.is_end(state):
+            return self.eos_only
+        instr = grammar.program[state[0]]
+        if instr[0] == "str":
+            # Staying inside the value is always fine; anything with a quote
+            # has to close the value and continue validly
+            candidates = self._quoted
+            base = [] if grammar.signature(state)[2] else self.plain(instr[1])
+        else:
+            candidates = [i for ch in grammar.first_chars(state) for i in self._by_first.get(ch, ())]
+            base = []
+        return sorted(set(base).union(i for i in candidates if grammar.walk(state, self.strings[i]) is not None))
+
+
+class Constraint:
+    """Decoding state of one sequence"""
+
+    def __init__(self, grammar: Grammar, vocabulary: Vocabulary):
+        self.grammar = grammar
+        self.vocabulary = vocabulary
+        self.state: Optional[State] = grammar.start()
+
+    @property
+    def done(self) -> bool:
+        return self.state is None or self.grammar.is_end(self.state)
+
+    def allowed(self) -> List[int]:
+        if self.done:
+            return self.vocabulary.eos_only
+        return self.vocabulary.allowed(self.grammar, self.state)
+
+    def advance(self, token_id: int):
+        if not self.done:
+            text = self.vocabulary.strings[token_id] or ""
+            self.state = self.grammar.walk(self.state, text)
+
+
+_grammars: Dict[tuple, Grammar] = {}
+
+
+def grammar_for(fields: Sequence[str]) -> Grammar:
+    """Grammars are shared per field selection so their masks stay cached"""
+    key = tuple(fields)
+    if key not in _grammars:
+        _grammars[key] = Grammar(key)
+    return _grammars[key]
+
+
+def schema_logits_processor(vocabulary: Vocabulary, fields_per_row: Sequence[Optional[Sequence[str]]]):
+    """``LogitsProcessorList`` constraining each row to its field selection (None = unconstrained)"""
+    import torch
+    from transformers import LogitsProcessor, LogitsProcessorList
+
+    constraints = [Constraint(grammar_for(f), vocabulary) if f else None for f in fields_per_row]
+
+    class SchemaLogitsProcessor(LogitsProcessor):
+        def __init__(self):
+            self.prompt_length = None
+            # Keyed by the mask list's id; the list is kept so the id stays unique
+            self._tensors: Dict[int, Tuple[List[int], "torch.Tensor"]] = {}
+
+        def __call__(self, input_ids, scores):
+            if self.prompt_length is None:
+                self.prompt_length = input_ids.shape[1]
+            else:
+                for row, constraint in enumerate(constraints):
+                    if constraint is not None:
+                        constraint.advance(int(input_ids[row, -1]))
+
+            mask = torch.zeros_like(scores)
+            for row, constraint in enumerate(constraints):
+                if constraint is None:
+                    continue
+                ids = constraint.allowed()
+                if id(ids) not in self._tensors:
+                    self._tensors[id(ids)] = (ids, torch.tensor(ids, device=scores.device))
+                mask[row].fill_(float("-inf"))
+                mask[row, self._tensors[id(ids)][1]] = 0
+            return scores + mask
+
+    return LogitsProcessorList([SchemaLogitsProcessor()])
+
+
+def parse_objects(texts: Sequence[str]) -> Optional[Dict[str, object]]:
+    """Merged object for the decoded crops, or None if one was cut off by
+    ``max_new_tokens`` before it closed"""
+    try:
+        return merge_objects([json.loads(text) for text in texts])
+    except ValueError:
+        return None
+
+
+def merge_objects(objects: Sequence[Dict[str, object]]) -> Dict[str, object]:
+    """Combine the objects decoded for several crops of one page: the first
+    non-null value of each field wins and line items are concatenated"""
+    merged: Dict[str, object] = {}
+    for obj in objects:
+        for key, value in obj.items():
+            if key == "line_items":
+                merged[key] = list(merged.get(key) or []) + list(value or [])
+            elif merged.get(key) is None:
+                merged[key] = value
+    return merged
@@ -0,0 +1,228 @@
+"""Loading the OCR model for CPU-only inference.
+
+The notebook loads ``nanonets/Nanonets-OCR-s`` in fp16/bf16 onto a GPU. On
+a CPU box ``load_cpu_model`` instead:
+
+* quantizes the language model's linear layers (where almost all generate
+  time goes): ``int8`` is torch dynamic quantization (int8 weights,
+  activations quantized on the fly, fbgemm / onednn kernels); ``int4`` is
+  optimum-quanto 4-bit weights, about half the memory of int8 but usually
+  no faster; ``none`` keeps fp32. The vision encoder runs once per image
+  and stays fp32, as does ``lm_head``.
+* sets the intra-op thread count (default: every core) and a single
+  inter-op thread, which is what a latency-bound generate loop wants.
+* caches the converted model: the first start loads the fp32 checkpoint,
+  quantizes it and saves the whole module under ``cache_dir``; later
+  starts load that artifact directly. Its name includes the torch /
+  transformers versions, since a pickled module only loads under the
+  versions that wrote it.
+* with ``onnx_vision``, exports the vision encoder to ONNX once (int8
+  weights via onnxruntime when the model is quantized) and runs it with
+  onnxruntime. The export has one fixed input size, so images are
+  letterboxed onto a ``vision_size`` square canvas first; images of any
+  other size fall back to the torch encoder.
+"""
+import hashlib
+import os
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Tuple
+
+QUANTIZATIONS = ("none", "int8", "int4")
+
+
+@dataclass(frozen=True)
+class CpuOptions:
+    quantization: str = "int8"  # one of QUANTIZATIONS
+    threads: int = 0  # intra-op threads; 0 = every core
+    interop_threads: int = 1
+    cache_dir: str = os.path.join(os.path.expanduser("~"), ".cache", "invoice-processor")
+    onnx_vision: bool = False
+    vision_size: int = 1024  # canvas side the ONNX vision encoder is exported for
+
+
+def configure_threads(threads: int = 0, interop_threads: int = 1) -> int:
+    """Set torch's thread pools; returns the intra-op thread count used"""
+    import torch
+
+    threads = threads or os.cpu_count() or 1
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(interop_threads)
+    except RuntimeError:
+        pass  # only settable before the first inter-op work, e.g. on a second load
+    return threads
+
+
+def _versions(quantization: str) -> str:
+    import torch
+    import transformers
+
+    versions = f"torch={torch.__version__} transformers={transformers.__version__}"
+    if quantization == "int4":
+        import optimum.quanto
+
+        versions += f" quanto={optimum.quanto.__version__}"
+    return versions
+
+
+def artifact_path(model_id: str, options: CpuOptions, suffix: str = ".pt") -> str:
+    """Where the converted model (or its ONNX vision encoder) is cached"""
+    digest = hashlib.sha256(_versions(options.quantization).encode()).hexdigest()[:12]
+    name = f"{model_id.replace('/', '--')}-{options.quantization}-{digest}{suffix}"
+    return os.path.join(options.cache_dir, name)
+
+
+def quantize(model, quantization: str):
+    """Quantize the language model's linear layers in place"""
+    import torch
+
+    decoder = model.get_decoder()
+    if quantization == "int8":
+        torch.ao.quantization.quantize_dynamic(decoder, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    elif quantization == "int4":
+        try:
+            from optimum.quanto import freeze, qint4
+            from optimum.quanto import quantize as quanto_quantize
+        except ImportError:
+            raise RuntimeError("int4 quantization needs optimum-quanto: pip install optimum-quanto")
+        quanto_quantize(decoder, weights=qint4)
+        freeze(decoder)
+    elif quantization != "none":
+        raise ValueError(f"quantization must be one of {QUANTIZATIONS}, not {quantization!r}")
+    return model
+
+
+def _save(obj, path: str):
+    import torch
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    torch.save(obj, path + ".tmp")
+    os.replace(path + ".tmp", path)  # a crash mid-write never leaves a truncated artifact
+
+
+def load_cpu_model(model_id: str, options: CpuOptions) -> Tuple[Any, Any, Any, Dict[str, Any]]:
+    """``(model, processor, tokenizer, info)`` ready for CPU generate calls"""
+    import torch
+    from transformers import AutoConfig, AutoModelForImageTextToText, AutoProcessor, AutoTokenizer
+
+    started = time.perf_counter()
+    threads = configure_threads(options.threads, options.interop_threads)
+    tokenizer = AutoTokenizer.from_pretrained(model_id)
+    processor = AutoProcessor.from_pretrained(model_id)
+
+    path = artifact_path(model_id, options)
+    from_cache = options.quantization != "none" and os.path.exists(path)
+    if from_cache:
+        model = torch.load(path, weights_only=False)
+    else:
+        config = AutoConfig.from_pretrained(model_id)
+        config._flash_attn_2_enabled = False
+        model = AutoModelForImageTextToText.from_pretrained(model_id, config=config, torch_dtype=torch.float32,
+                                                            low_cpu_mem_usage=True)
+        model = quantize(model, options.quantization)
+        if options.quantization != "none":
+            _save(model, path)
+    model.eval()
+
+    info = {"modelId": model_id, "device": "cpu", **asdict(options), "threads": threads,
+            "artifact": path if options.quantization != "none" else None, "fromCache": from_cache}
+    if options.onnx_vision:
+        info["onnxVision"] = install_onnx_vision(model, processor, model_id, options, threads)
+    info["loadSeconds"] = round(time.perf_counter() - started, 2)
+    return model, processor, tokenizer, info
+
+
+# --- ONNX vision encoder ---
+def letterbox(image, size: int):
+    """``image`` scaled to fit a white ``size`` x ``size`` canvas, centred"""
+    from PIL import Image
+
+    image = image.convert("RGB")
+    scale = min(size / image.width, size / image.height)
+    resized = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+                           Image.Resampling.LANCZOS)
+    canvas = Image.new("RGB", (size, size), "white")
+    canvas.paste(resized, ((size - resized.width) // 2, (size - resized.height) // 2))
+    return canvas
+
+
+def _canvas_inputs(processor, size: int):
+    from PIL import Image
+
+    inputs = processor.image_processor(images=[Image.new("RGB", (size, size), "white")], return_tensors="pt")
+    return inputs["pixel_values"], inputs["image_grid_thw"]
+
+
+def export_vision_onnx(encoder, processor, size: int, path: str, quantize_weights: bool):
+    """Export ``encoder`` for one ``size`` x ``size`` image; optionally with int8 weights"""
+    import torch
+
+    pixel_values, grid = _canvas_inputs(processor, size)
+
+    class FixedGrid(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.encoder = encoder
+
+        def forward(self, pixel_values):
+            return self.encoder(pixel_values, grid_thw=grid)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    exported = path + ".fp32.onnx" if quantize_weights else path + ".tmp"
+    with torch.no_grad():
+        torch.onnx.export(FixedGrid().eval(), (pixel_values,), exported, input_names=["pixel_values"],
+                          output_names=["embeddings"], opset_version=17)
+    if quantize_weights:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(exported, path + ".tmp", weight_type=QuantType.QInt8)
+        os.remove(exported)
+    os.replace(path + ".tmp", path)
+
+
+def install_onnx_vision(model, processor, model_id: str, options: CpuOptions, threads: int) -> Dict[str, Any]:
+    """Swap the model's vision encoder for an onnxruntime session, exporting it on first use"""
+    import numpy as np
+    import onnxruntime
+    import torch
+
+    owner = model.model if hasattr(model.model, "visual") else model
+    encoder = owner.visual
+    path = artifact_path(model_id, options, f"-vision{options.vision_size}.onnx")
+    exported = not os.path.exists(path)
+    if exported:
+        export_vision_onnx(encoder, processor, options.vision_size, path, options.quantization != "none")
+    session_options = onnxruntime.SessionOptions()
+    session_options.intra_op_num_threads = threads
+    session = onnxruntime.InferenceSession(path, session_options, providers=["CPUExecutionProvider"])
+    pixel_values, grid = _canvas_inputs(processor, options.vision_size)
+    patches = pixel_values.shape[0]
+
+    class OnnxVisionEncoder(torch.nn.Module):
+        """Runs fixed-size images through onnxruntime, anything else through ``encoder``"""
+
+        def __init__(self):
+            super().__init__()
+            self.encoder = encoder
+            self.onnx_images = 0
+            self.torch_images = 0
+
+        def __getattr__(self, name):
+            # The model reads attributes such as dtype / spatial_merge_size off its encoder
+            try:
+                return super().__getattr__(name)
+            except AttributeError:
+                return getattr(super().__getattr__("encoder"), name)
+
+        def forward(self, hidden_states, grid_thw=None, **kwargs):
+            if grid_thw is None or not bool((grid_thw == grid[0]).all()):
+                self.torch_images += 0 if grid_thw is None else len(grid_thw)
+                return self.encoder(hidden_states, grid_thw=grid_thw, **kwargs)
+            embeddings = [session.run(None, {"pixel_values": chunk.float().numpy()})[0]
+                          for chunk in hidden_states.split(patches)]
+            self.onnx_images += len(embeddings)
+            return torch.from_numpy(np.concatenate(embeddings)).to(hidden_states.dtype)
+
+    owner.visual = OnnxVisionEncoder()
+    return {"path": path, "exported": exported, "size": options.vision_size, "grid": grid[0].tolist()}
@@ -0,0 +1,75 @@
+"""Prefix KV cache for ``model.generate``.
+
+Prompts built static-instructions-first share a long identical token
+prefix. ``PrefixKVCache`` encodes each registered prefix once, keeps its
+``past_key_values`` and hands a copy to ``generate`` whenever a request's
+``input_ids`` start with that prefix, so only the variable tail is
+re-encoded. Lookups compare token ids, so a prompt that does not start with
+the prefix (e.g. the image placeholder comes first) is simply a miss.
+
+Only single-row calls use the cache: left padding in a batch shifts every
+row's prefix to a different position.
+"""
+import copy
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class PrefixKVCache:
+    def __init__(self, model, tokenizer, max_entries: int = 8):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_entries = max_entries
+        self._prefixes: List[Tuple[int, ...]] = []
+        self._entries: "OrderedDict[Tuple[int, ...], Any]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def register(self, prefix_text: str):
+        """Declare a static prompt prefix; its KV is computed on first use"""
+        ids = self.tokenizer(prefix_text, add_special_tokens=False)["input_ids"]
+        # The last token can merge with whatever follows, so leave it out
+        prefix = tuple(ids[:-1])
+        if prefix and prefix not in self._prefixes:
+            self._prefixes.append(prefix)
+            self._prefixes.sort(key=len, reverse=True)
+
+    def _match(self, input_ids: List[int]) -> Optional[Tuple[int, ...]]:
+        # Special tokens (BOS, chat template) may precede the prefix
+        for prefix in self._prefixes:
+            for offset in range(0, min(8, len(input_ids) - len(prefix)) + 1):
+                if tuple(input_ids[offset:offset + len(prefix)]) == prefix:
+                    return tuple(input_ids[:offset]) + prefix
+        return None
+
+    def _encode(self, prefix_ids: Tuple[int, ...]):
+        import torch
+
+        past = self._entries.get(prefix_ids)
+        if past is None:
+            ids = torch.tensor([prefix_ids], device=self.model.device)
+            with torch.no_grad():
+                past = self.model(input_ids=ids, use_cache=True).past_key_values
+            self._entries[prefix_ids] = past
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        else:
+            self._entries.move_to_end(prefix_ids)
+        return past
+
+    def generate(self, inputs: Dict[str, Any], **generate_kwargs):
+        """``model.generate(**inputs, **generate_kwargs)``, reusing a cached prefix when one matches"""
+        input_ids = inputs["input_ids"]
+        if input_ids.shape[0] == 1 and self._prefixes:
+            prefix_ids = self._match(input_ids[0].tolist())
+            if prefix_ids is not None and len(prefix_ids) < input_ids.shape[1]:
+                self.hits += 1
+                # generate() extends the cache in place, so every call gets its own copy
+                past = copy.deepcopy(self._encode(prefix_ids))
+                return self.model.generate(**inputs, past_key_values=past, **generate_kwargs)
+        self.misses += 1
+        return self.model.generate(**inputs, **generate_kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"prefixes": len(self._prefixes), "entries": len(self._entries),
+                "hits": self.hits, "misses": self.misses}
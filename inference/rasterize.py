@@ -0,0 +1,70 @@
+"""Streaming PDF rasterization across a process pool.
+
+``pdf2image.convert_from_path`` on a whole document renders every page into
+memory before returning. ``iter_pdf_pages`` instead renders one page per
+task and keeps at most ``max_in_flight`` pages rendered-but-unconsumed, so a
+40-page statement never holds more than a handful of bitmaps at once.
+Images are yielded as PIL objects; nothing is written to disk.
+"""
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, Iterator, Optional, Tuple
+
+
+def count_pdf_pages(pdf_path: str) -> int:
+    import pdf2image
+
+    return int(pdf2image.pdfinfo_from_path(pdf_path)["Pages"])
+
+
+def render_page(pdf_path: str, page_number: int, dpi: int):
+    """Render a single 1-based page; runs inside a pool worker"""
+    import pdf2image
+
+    return pdf2image.convert_from_path(pdf_path, dpi=dpi, first_page=page_number, last_page=page_number)[0]
+
+
+def iter_pdf_pages(pdf_path: str, dpi: int = 200, page_dpi: Optional[Dict[int, int]] = None,
+                   max_in_flight: int = 4, ordered: bool = True,
+                   executor: Optional[Executor] = None) -> Iterator[Tuple[int, "Image.Image"]]:
+    """Yield ``(page_number, image)`` for every page of ``pdf_path``.
+
+    ``page_dpi`` overrides ``dpi`` for individual 1-based pages. With
+    ``ordered=False`` pages are yielded as soon as they finish rendering;
+    otherwise in page order. Pass ``executor`` to share one pool between
+    documents instead of starting a new one per call.
+    """
+    page_dpi = page_dpi or {}
+    total = count_pdf_pages(pdf_path)
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=max_in_flight)
+
+    pending: "deque[Tuple[int, Future]]" = deque()
+    next_page = 1
+
+    def fill():
+        nonlocal next_page
+        while next_page <= total and len(pending) < max_in_flight:
+            dpi_for_page = page_dpi.get(next_page, dpi)
+            pending.append((next_page, executor.submit(render_page, pdf_path, next_page, dpi_for_page)))
+            next_page += 1
+
+    try:
+        fill()
+        while pending:
+            if ordered:
+                page_number, future = pending.popleft()
+            else:
+                done, _ = wait([f for _, f in pending], return_when=FIRST_COMPLETED)
+                page_number, future = next((n, f) for n, f in pending if f in done)
+                pending.remove((page_number, future))
+            image = future.result()
+            # Start the next render before handing this page to the caller
+            fill()
+            yield page_number, image
+    finally:
+        for _, future in pending:
+            future.cancel()
+        if own_executor:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,215 @@
+"""Standalone CPU inference server with the notebook's ``/process`` contract.
+
+A drop-in for the Colab GPU endpoint: the same ``/process`` and
+``/process/stream`` form fields and JSON, plus ``/health``, ``/metrics`` and
+``/stats``, so the backend only needs ``COLAB_URL`` (or ``INFERENCE_URLS``)
+pointed at it. The model is loaded by ``inference.cpu.load_cpu_model`` -
+quantized, thread-tuned and cached as a converted artifact - and served
+through the same region cropping, micro-batching and constrained decoding
+as the notebook.
+
+    CPU_QUANTIZATION=int8 CPU_THREADS=16 uvicorn inference.server:app --port 8000
+
+The first start converts and caches the model (minutes); later starts load
+the cached artifact. ``/stats`` reports the load time and whether the
+artifact came from the cache.
+"""
+import asyncio
+import io
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from fastapi import FastAPI, File, Form, Request, UploadFile
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from PIL import Image
+
+from backend.metrics import REGISTRY, SIZE_BUCKETS, MetricsMiddleware, Timeline
+from backend.model_http import DeadlineExceeded, GzipRequestMiddleware, request_deadline
+from inference.batching import BatchScheduler, make_generate_batch
+from inference.constrained import Vocabulary, parse_objects, schema_logits_processor
+from inference.cpu import CpuOptions, letterbox, load_cpu_model
+from inference.regions import prepare_regions
+from inference.streaming import stream_generate
+
+# --- Config ---
+MODEL_ID = os.getenv("MODEL_ID", "nanonets/Nanonets-OCR-s")
+CPU_QUANTIZATION = os.getenv("CPU_QUANTIZATION", "int8")  # none, int8 or int4
+CPU_THREADS = int(os.getenv("CPU_THREADS", "0"))  # intra-op threads; 0 = every core
+CPU_INTEROP_THREADS = int(os.getenv("CPU_INTEROP_THREADS", "1"))
+MODEL_CACHE_DIR = os.getenv("MODEL_CACHE_DIR", CpuOptions.cache_dir)  # converted artifacts
+ONNX_VISION = os.getenv("ONNX_VISION", "0") == "1"  # vision encoder through onnxruntime
+ONNX_VISION_SIZE = int(os.getenv("ONNX_VISION_SIZE", "1024"))  # images are letterboxed to this square
+ROI_MODE = os.getenv("ROI_MODE", "crop")  # full, crop, tiles or blocks; see inference.regions
+CONSTRAINED_DECODING = os.getenv("CONSTRAINED_DECODING", "1") == "1"
+MAX_NEW_TOKENS = int(os.getenv("MAX_NEW_TOKENS", "1024" if CONSTRAINED_DECODING else "512"))
+# CPU matmuls gain little from wide batches, but a pair still beats two sequential calls
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "2"))
+MAX_WAIT_MS = float(os.getenv("MAX_WAIT_MS", "10"))
+
+BATCH_SIZE = REGISTRY.histogram("generate_batch_size", "Items per generate call", buckets=SIZE_BUCKETS)
+
+
+def record_batch_timings(timeline: Timeline, timings):
+    # Crops of one page may share a batch, so take each stage's longest rather than the sum
+    for stage in ("queue_wait", "preprocess", "generate", "decode"):
+        values = [t[stage] for t in timings if stage in t]
+        if values:
+            timeline.add(stage, max(values))
+    for t in timings:
+        BATCH_SIZE.observe(t.get("batch_size", 1))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    options = CpuOptions(CPU_QUANTIZATION, CPU_THREADS, CPU_INTEROP_THREADS, MODEL_CACHE_DIR,
+                         ONNX_VISION, ONNX_VISION_SIZE)
+    # Loading takes a while even from the cache; keep the event loop free meanwhile
+    model, processor, tokenizer, info = await asyncio.to_thread(load_cpu_model, MODEL_ID, options)
+    vocabulary = Vocabulary.from_tokenizer(tokenizer) if CONSTRAINED_DECODING else None
+    scheduler = BatchScheduler(
+        make_generate_batch(model, processor, tokenizer, "cpu", max_new_tokens=MAX_NEW_TOKENS,
+                            vocabulary=vocabulary),
+        max_batch_size=MAX_BATCH_SIZE,
+        max_wait_ms=MAX_WAIT_MS,
+    )
+    REGISTRY.gauge("generate_queue_depth", "Items waiting for the generate scheduler", lambda: scheduler.queue_depth)
+    app.state.model, app.state.processor, app.state.tokenizer = model, processor, tokenizer
+    app.state.vocabulary = vocabulary
+    app.state.scheduler = scheduler
+    app.state.load_info = info
+    yield
+    await scheduler.stop()
+
+
+app = FastAPI(lifespan=lifespan)
+# Gzipped request bodies from a backend with MODEL_GZIP=1
+app.add_middleware(GzipRequestMiddleware)
+# Request ids from the backend, in-flight requests and bytes in/out
+app.add_middleware(MetricsMiddleware)
+
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded(request: Request, exc: DeadlineExceeded):
+    # The backend has given up on this request; nothing was generated for it
+    return JSONResponse({"detail": str(exc)}, status_code=504)
+
+
+def raw_response(crops: int, constrained: bool, **extra) -> dict:
+    return {"model": MODEL_ID, "device": "cpu", "quantization": CPU_QUANTIZATION, "roiMode": ROI_MODE,
+            "crops": crops, "constrained": constrained, **extra}
+
+
+async def read_crops(request: Request, file: UploadFile, timeline: Timeline):
+    timeline.add("upload", time.perf_counter() - request.state.started)
+    with timeline.span("read"):
+        contents = await file.read()
+        image = Image.open(io.BytesIO(contents)).convert("RGB")
+    # Cheap CPU layout pass, off the event loop
+    with timeline.span("regions"):
+        crops = await asyncio.to_thread(prepare_regions, image, ROI_MODE)
+        if ONNX_VISION:
+            # The exported encoder takes one image size only
+            crops = [letterbox(crop, ONNX_VISION_SIZE) for crop in crops]
+    return crops
+
+
+@app.post("/process")
+async def process(request: Request, file: UploadFile = File(...), prompt: str = Form(...),
+                  fields: Optional[str] = Form(None)):
+    timeline = Timeline(request.state.request_id)
+    crops = await read_crops(request, file, timeline)
+    # Field list sent by the backend; without it the model answers in free text
+    schema = json.loads(fields) if fields and app.state.vocabulary is not None else None
+
+    # Preprocess + generate + decode happen batched inside the scheduler
+    scheduler = app.state.scheduler
+    deadline = request_deadline(request.headers, request.state.started)
+    timings = [{} for _ in crops]
+    if len(crops) == 1:
+        outputs = [await scheduler.submit((crops[0], prompt, schema), timings[0], deadline)]
+    else:
+        crop_prompt = f"{prompt} Only report fields that are visible in this part of the page."
+        outputs = await asyncio.gather(*(scheduler.submit((crop, crop_prompt, schema), timing, deadline)
+                                         for crop, timing in zip(crops, timings)))
+    record_batch_timings(timeline, timings)
+    # Falls back to the raw text if an object was cut off before it closed
+    with timeline.span("parse"):
+        output = (parse_objects(outputs) if schema else None) or "\n".join(outputs)
+
+    return {
+        "fileName": file.filename,
+        "promptUsed": prompt,
+        "extractedFields": output,
+        "rawResponse": raw_response(len(crops), bool(schema)),
+        "timing": timeline.to_dict()
+    }
+
+
+@app.post("/process/stream")
+async def process_stream(request: Request, file: UploadFile = File(...), prompt: str = Form(...),
+                         fields: Optional[str] = Form(None)):
+    """Same as /process, but sends each decoded chunk as a `token` event, then the `result`"""
+    timeline = Timeline(request.state.request_id)
+    crops = await read_crops(request, file, timeline)
+    if len(crops) > 1:
+        prompt_used = f"{prompt} Only report fields that are visible in this part of the page."
+    else:
+        prompt_used = prompt
+    vocabulary = app.state.vocabulary
+    schema = json.loads(fields) if fields and vocabulary is not None else None
+    deadline = request_deadline(request.headers, request.state.started)
+
+    async def events():
+        outputs = []
+        started = time.perf_counter()
+        try:
+            for crop in crops:
+                text = ""
+                constraint = {"logits_processor": schema_logits_processor(vocabulary, [schema])} if schema else {}
+                # Takes its turn with /process batches on the scheduler's generate thread
+                async for chunk in stream_generate(app.state.model, app.state.processor, app.state.tokenizer, "cpu",
+                                                   crop, prompt_used, max_new_tokens=MAX_NEW_TOKENS,
+                                                   scheduler=app.state.scheduler, deadline=deadline, **constraint):
+                    if not outputs and not text:
+                        timeline.add("first_token", time.perf_counter() - started)
+                    text += chunk
+                    yield f"event: token\ndata: {json.dumps({'text': chunk})}\n\n"
+                outputs.append(text)
+        except DeadlineExceeded as e:
+            # The response has already started, so a 504 is no longer possible
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+            return
+        # Preprocess, generate and decode interleave when streaming
+        timeline.add("generate", time.perf_counter() - started)
+        result = {
+            "fileName": file.filename,
+            "promptUsed": prompt,
+            "extractedFields": (parse_objects(outputs) if schema else None) or "\n".join(outputs),
+            "rawResponse": raw_response(len(crops), bool(schema), streamed=True),
+            "timing": timeline.to_dict()
+        }
+        yield f"event: result\ndata: {json.dumps(result)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.get("/health")
+async def health():
+    """Liveness probe used by the backend's inference pool"""
+    return {"status": "ok", "model": MODEL_ID, "device": "cpu", "quantization": CPU_QUANTIZATION}
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text format: stage histograms, batch sizes, queue depth, in-flight requests, bytes"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/stats")
+async def stats():
+    """Batch-size and queue-wait metrics for the generate scheduler, and how the model was loaded"""
+    return {**app.state.scheduler.stats(), "load": app.state.load_info}
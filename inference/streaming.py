@@ -0,0 +1,92 @@
+"""Token-by-token generation for the notebook's ``/process/stream`` route.
+
+``model.generate`` runs on its own thread with a ``TextIteratorStreamer``;
+decoded text is handed to the event loop as it is produced. A streamed call
+is its own generate call rather than a row in a batch, so it trades some GPU
+throughput for a much earlier first token. Given the ``BatchScheduler`` it
+runs on the scheduler's generate thread, taking turns with the batches
+instead of sharing the model with them.
+"""
+import asyncio
+import threading
+import time
+from typing import Any, AsyncIterator, Optional
+
+from backend.model_http import DeadlineExceeded
+
+
+async def stream_generate(model, processor, tokenizer, device: str, image: Any, prompt: str,
+                          max_new_tokens: int = 512, scheduler=None, deadline: Optional[float] = None,
+                          **generate_kwargs) -> AsyncIterator[str]:
+    """Yield decoded text chunks for one ``(image, prompt)`` as they are generated.
+
+    With a ``scheduler`` the call waits for the model through
+    ``BatchScheduler.exclusive``. ``deadline`` (a ``time.perf_counter()``
+    time) bounds that wait and the generation; ``DeadlineExceeded`` is raised
+    if it passes, since the text so far is cut short.
+    """
+    if scheduler is None:
+        async for text in _stream(model, processor, tokenizer, device, image, prompt, max_new_tokens,
+                                  None, deadline, generate_kwargs):
+            yield text
+        return
+    async with scheduler.exclusive(deadline) as executor:
+        async for text in _stream(model, processor, tokenizer, device, image, prompt, max_new_tokens,
+                                  executor, deadline, generate_kwargs):
+            yield text
+
+
+async def _stream(model, processor, tokenizer, device, image, prompt, max_new_tokens, executor, deadline,
+                  generate_kwargs) -> AsyncIterator[str]:
+    import torch
+    from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    done = object()
+    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+    # Set when the caller stops reading, so an abandoned stream frees the model
+    stopped = threading.Event()
+
+    class Stopped(StoppingCriteria):
+        def __call__(self, input_ids, scores, **kwargs):
+            return torch.full((input_ids.shape[0],), stopped.is_set(), dtype=torch.bool, device=input_ids.device)
+
+    if deadline is not None:
+        generate_kwargs = {**generate_kwargs, "max_time": max(0.0, deadline - time.perf_counter())}
+
+    def run():
+        try:
+            inputs = processor(images=[image], text=[prompt], return_tensors="pt").to(device)
+            with torch.no_grad():
+                model.generate(**inputs, max_new_tokens=max_new_tokens, streamer=streamer,
+                               stopping_criteria=StoppingCriteriaList([Stopped()]), **generate_kwargs)
+        except Exception as e:
+            # Queue the error before ending the streamer so it lands ahead of `done`
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+            streamer.end()
+
+    def relay():
+        for text in streamer:
+            if text:
+                loop.call_soon_threadsafe(queue.put_nowait, text)
+        loop.call_soon_threadsafe(queue.put_nowait, done)
+
+    if executor is not None:
+        loop.run_in_executor(executor, run)
+    else:
+        threading.Thread(target=run, daemon=True, name="generate-stream").start()
+    threading.Thread(target=relay, daemon=True, name="generate-relay").start()
+
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stopped.set()
+    if deadline is not None and time.perf_counter() >= deadline:
+        raise DeadlineExceeded("Deadline passed while generating")
@@ -126,66 +126,23 @@
                 previewItem.className = 'invoice-preview';
                 previewItem.setAttribute('data-filename', file.name);
 
-                if (file.type === 'application/pdf') {
-                    previewItem.innerHTML = `
-                        <div class="pdf-preview">
-                            <div class="file-icon">📄</div>
-                            <button class="remove-file" data-file="${file.name}">×</button>
-                        </div>
-                        <div class="file-info">${file.name}</div>
-                    `;
-                    
-                    // Add click handler to show PDF preview
-                    previewItem.addEventListener('click', (e) => {
-                        if (!e.target.classList.contains('remove-file')) {
-                            previewFile(file);
-                        }
-                    });
-                    
-                    // Try to render PDF thumbnail if PDF.js is available
-                    if (typeof pdfjsLib !== 'undefined') {
-                        const loadingTask = pdfjsLib.getDocument(URL.createObjectURL(file));
-                        loadingTask.promise.then(pdf => {
-                            pdf.getPage(1).then(page => {
-                                const viewport = page.getViewport({ scale: 0.5 });
-                                const canvas = document.createElement('canvas');
-                                const context = canvas.getContext('2d');
-                                canvas.height = viewport.height;
-                                canvas.width = viewport.width;
-                                
-                                // Clear existing content
-                                const previewContainer = previewItem.querySelector('.pdf-preview');
-                                previewContainer.innerHTML = '';
-                                previewContainer.appendChild(canvas);
-                                
-                                // Render the page
-                                page.render({
-                                    canvasContext: context,
-                                    viewport: viewport
-                                });
-                            });
-                        }).catch(error => {
-                            console.error('PDF preview error:', error);
-                        });
+                // File icon until the server's thumbnail arrives
+                previewItem.innerHTML = `
+                    <div class="pdf-preview">
+                        <div class="file-icon">${file.type === 'application/pdf' ? '📄' : '🖼️'}</div>
+                    </div>
+                    <button class="remove-file" data-file="${file.name}">×</button>
+                    <div class="file-info">${file.name}</div>
+                `;
+
+                // Add click handler to show the full file
+                previewItem.addEventListener('click', (e) => {
+                    if (!e.target.classList.contains('remove-file')) {
+                        previewFile(file);
                     }
-                } else {
-                    const reader = new FileReader();
-                    reader.onload = function(e) {
-                        previewItem.innerHTML = `
-                            <img src="${e.target.result}" alt="${file.name}">
-                            <button class="remove-file" data-file="${file.name}">×</button>
-                            <div class="file-info">${file.name}</div>
-                        `;
-                        
-                        // Add click handler to show larger image preview
-                        previewItem.addEventListener('click', (e) => {
-                            if (!e.target.classList.contains('remove-file')) {
-                                previewFile(file, e.target.src);
-                            }
-                        });
-                    };
-                    reader.readAsDataURL(file);
-                }
+                });
+
+                queueThumbnail(file, previewItem);
 
                 // Add remove functionality
                 const removeBtn = previewItem.querySelector('.remove-file');
@@ -197,6 +154,61 @@
                 invoicePreviewsContainer.appendChild(previewItem);
             }
             
+            /* ========== THUMBNAILS ========== */
+            // Thumbnails are rendered by the server, a few files at a time, and looked up
+            // by content hash first so files it has already seen are never uploaded again
+            const THUMBNAIL_CONCURRENCY = 4;
+            const thumbnailQueue = [];
+            let thumbnailsActive = 0;
+
+            function queueThumbnail(file, previewItem) {
+                thumbnailQueue.push([file, previewItem]);
+                pumpThumbnails();
+            }
+
+            function pumpThumbnails() {
+                while (thumbnailsActive < THUMBNAIL_CONCURRENCY && thumbnailQueue.length > 0) {
+                    const [file, previewItem] = thumbnailQueue.shift();
+                    thumbnailsActive++;
+                    loadThumbnail(file, previewItem).finally(() => {
+                        thumbnailsActive--;
+                        pumpThumbnails();
+                    });
+                }
+            }
+
+            async function sha256Hex(file) {
+                // crypto.subtle only exists on https:// and localhost pages
+                if (!window.crypto?.subtle) return null;
+                const digest = await crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+                return Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join('');
+            }
+
+            async function loadThumbnail(file, previewItem) {
+                try {
+                    const hash = await sha256Hex(file);
+                    // Cached by the browser too, so a re-added file costs no request at all
+                    let response = hash ? await fetch(`http://localhost:8000/thumbnails/${hash}`) : null;
+                    if (!response || response.status === 404) {
+                        const formData = new FormData();
+                        formData.append('file', file);
+                        response = await fetch("http://localhost:8000/thumbnails", {
+                            method: "POST",
+                            body: formData
+                        });
+                    }
+                    if (!response.ok) return;  // keep the file icon
+
+                    const img = document.createElement('img');
+                    img.alt = file.name;
+                    img.src = URL.createObjectURL(await response.blob());
+                    img.onload = () => URL.revokeObjectURL(img.src);
+                    previewItem.querySelector('.pdf-preview')?.replaceWith(img);
+                } catch (error) {
+                    console.error('Thumbnail error:', error);
+                }
+            }
+
             function updateFileInfo() {
                 totalFiles.textContent = uploadedFiles.length;
                 
@@ -240,14 +252,14 @@
             }
 
             /* ========== PREVIEW MODAL FUNCTIONS ========== */
-            function previewFile(file, imageDataUrl = null) {
+            function previewFile(file) {
                 try {
                     const modal = createModal(file.name);
                     
                     if (file.type === 'application/pdf') {
                         showPdfPreview(file, modal);
                     } else {
-                        showImagePreview(imageDataUrl, file.name, modal);
+                        showImagePreview(URL.createObjectURL(file), file.name, modal);
                     }
 
                     setupModalCloseHandlers(modal);
@@ -379,18 +391,20 @@
                     // ✅ Append selected fields as JSON string
                     formData.append("fields", JSON.stringify(selectedFields));
 
-                    // ✅ Send to your FastAPI backend
-                    const response = await fetch("http://localhost:8000/process", {
+                    // ✅ Stream tokens and fields from the FastAPI backend as the model writes them
+                    const response = await fetch("http://localhost:8000/process/stream", {
                         method: "POST",
                         body: formData
                     });
 
                     if (!response.ok) throw new Error("Server error");
 
-                    const results = await response.json();
+                    startResults();
+                    const summary = await streamResults(response, uploadedFiles);
 
-                    displayResults(results);  // Your existing function to show results
-                    showNotification(`${results.length} file(s) processed successfully!`, 'success');
+                    const firstField = summary.timeToFirstFieldMs != null
+                        ? ` First field after ${(summary.timeToFirstFieldMs / 1000).toFixed(1)}s.` : '';
+                    showNotification(`${summary.completed} file(s) processed successfully!${firstField}`, 'success');
 
                 } catch (error) {
                     console.error('Processing error:', error);
@@ -404,6 +418,70 @@
 
 
 
+            // Reads the server-sent events of /process/stream from a fetch body
+            // (EventSource cannot POST) and resolves with the "done" summary
+            async function streamResults(response, files) {
+                const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+                let buffer = '';
+                let completed = 0;
+
+                while (true) {
+                    const { value, done } = await reader.read();
+                    if (done) break;
+                    buffer += value;
+
+                    let boundary;
+                    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                        const message = buffer.slice(0, boundary);
+                        buffer = buffer.slice(boundary + 2);
+
+                        let event = 'message';
+                        const data = [];
+                        message.split('\n').forEach(line => {
+                            if (line.startsWith('event:')) event = line.slice(6).trim();
+                            else if (line.startsWith('data:')) data.push(line.slice(5).trimStart());
+                        });
+                        if (data.length === 0) continue;
+                        const payload = JSON.parse(data.join('\n'));
+
+                        if (event === 'token') {
+                            streamingCard(payload.index, files[payload.index].name)
+                                .querySelector('.stream-text').textContent += payload.text;
+                        } else if (event === 'field') {
+                            const card = streamingCard(payload.index, files[payload.index].name);
+                            card.querySelector('.stream-fields').textContent +=
+                                `${payload.name}: ${JSON.stringify(payload.value)}  (${(payload.elapsedMs / 1000).toFixed(1)}s)\n`;
+                        } else if (event === 'result') {
+                            appendResult(payload.result, payload.index);
+                            completed++;
+                            progress.style.width = `${Math.round(completed / files.length * 100)}%`;
+                        } else if (event === 'done') {
+                            return payload;
+                        }
+                    }
+                }
+                throw new Error('Results stream ended early');
+            }
+
+            // Placeholder card that fills in while a file is still being extracted
+            function streamingCard(index, fileName) {
+                let card = resultsContainer.querySelector(`.result-card[data-index="${index}"]`);
+                if (!card) {
+                    card = document.createElement('div');
+                    card.className = 'result-card streaming';
+                    card.innerHTML = `
+                        <div class="result-header">
+                            <h3>${fileName}</h3>
+                            <span class="spinner"></span>
+                        </div>
+                        <pre class="stream-fields"></pre>
+                        <pre class="stream-text"></pre>
+                    `;
+                    insertCard(card, index);
+                }
+                return card;
+            }
+
             function getSelectedFields() {
                 const selected = [];
                 document.querySelectorAll('.field-selection input[type="checkbox"]:checked').forEach(checkbox => {
@@ -428,7 +506,7 @@
                         resultsContainer.appendChild(resultCard);
                     });
 
-                    setupResultCardInteractions();
+                    setupResultCardInteractions(resultsContainer);
                     resultsSection.scrollIntoView({ behavior: 'smooth' });
                     
                 } catch (error) {
@@ -437,6 +515,32 @@
                 }
             }
 
+            function startResults() {
+                resultsSection.style.display = 'block';
+                resultsContainer.innerHTML = '';
+                resultsSection.scrollIntoView({ behavior: 'smooth' });
+            }
+
+            // Adds one streamed result, keeping cards in upload order
+            function appendResult(result, index) {
+                const resultCard = createResultCard(result, index);
+                insertCard(resultCard, index);
+                setupResultCardInteractions(resultCard);
+            }
+
+            // Places a card by upload index, replacing any earlier card for that index
+            function insertCard(card, index) {
+                card.dataset.index = index;
+                const existing = resultsContainer.querySelector(`.result-card[data-index="${index}"]`);
+                if (existing) {
+                    existing.replaceWith(card);
+                    return;
+                }
+                const next = Array.from(resultsContainer.children)
+                    .find(other => Number(other.dataset.index) > index);
+                resultsContainer.insertBefore(card, next || null);
+            }
+
             function createResultCard(result, index) {
                 const resultCard = document.createElement('div');
                 resultCard.className = 'result-card';
@@ -478,8 +582,8 @@
                 return resultCard;
             }
 
-            function setupResultCardInteractions() {
-                document.querySelectorAll('.tab-btn').forEach(btn => {
+            function setupResultCardInteractions(root = document) {
+                root.querySelectorAll('.tab-btn').forEach(btn => {
                     btn.addEventListener('click', function() {
                         const tabName = this.getAttribute('data-tab');
                         const card = this.closest('.result-card');
@@ -494,7 +598,7 @@
                     });
                 });
 
-                document.querySelectorAll('.copy-btn').forEach(btn => {
+                root.querySelectorAll('.copy-btn').forEach(btn => {
                     btn.addEventListener('click', async function() {
                         try {
                             const targetId = this.getAttribute('data-target');
@@ -513,7 +617,7 @@
                     });
                 });
 
-                document.querySelectorAll('.download-btn').forEach(btn => {
+                root.querySelectorAll('.download-btn').forEach(btn => {
                     btn.addEventListener('click', function() {
                         try {
                             const filename = this.getAttribute('data-filename');